@@ -0,0 +1,153 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Static analysis of the tags and parameters which notebook cells depend on."""
+
+import ast
+import re
+import typing
+
+import IPython.core.inputtransformer2
+
+import nbvalx.jupyter_magics
+
+
+class CellDependencies(typing.NamedTuple):
+    """Tags and parameters which a cell depends on."""
+
+    cell_index: int
+    cell_id: str | None
+    cell_type: str
+    condition: list[str]
+    reads: list[str]
+    dependencies: list[str]
+
+
+def split_condition(cell: typing.Mapping[str, typing.Any]) -> tuple[str, str] | None:
+    """Split a cell with a run_if magic or a keep_if comment into the condition and the rest of the cell."""
+    if cell["cell_type"] == "code" and "%%run_if" in cell["source"]:
+        lines = cell["source"].splitlines()
+        magic_line_index_begin = 0
+        while not lines[magic_line_index_begin].startswith("%%run_if"):
+            magic_line_index_begin += 1
+        assert magic_line_index_begin < len(lines)
+        line = lines[magic_line_index_begin]
+        magic_line_index_end = magic_line_index_begin + 1
+        while line.endswith("\\"):
+            line = line.strip("\\") + lines[magic_line_index_end].strip()
+            magic_line_index_end += 1
+        assert magic_line_index_end < len(lines)
+        magic = line.replace("%%run_if", "")
+        for magic_line_index in range(magic_line_index_end - 1, magic_line_index_begin - 1, - 1):
+            lines.remove(lines[magic_line_index])
+        code = "\n".join(lines)
+        return nbvalx.jupyter_magics.IPythonExtension._split_magic_from_code(magic, code)
+    elif cell["cell_type"] == "markdown" and "<!-- keep_if" in cell["source"]:
+        lines = cell["source"].splitlines()
+        comment_line_index_begin = 0
+        while not lines[comment_line_index_begin].startswith("<!--"):
+            comment_line_index_begin += 1
+        assert comment_line_index_begin < len(lines)
+        line = lines[comment_line_index_begin]
+        comment_line_index_end = comment_line_index_begin + 1
+        while not line.endswith("-->"):
+            line = line + lines[comment_line_index_end].strip()
+            comment_line_index_end += 1
+        assert comment_line_index_end <= len(lines)
+        comment = line.replace("<!-- keep_if", "").replace("-->", "")
+        for comment_line_index in range(comment_line_index_end - 1, comment_line_index_begin - 1, - 1):
+            lines.remove(lines[comment_line_index])
+        text = "\n".join(lines)
+        return nbvalx.jupyter_magics.IPythonExtension._split_magic_from_code(comment, text)
+    else:
+        return None
+
+
+def condition_names(condition: str) -> set[str]:
+    """Return the names referenced by the condition of a run_if magic or of a keep_if comment."""
+    return {
+        node.id for node in ast.walk(nbvalx.jupyter_magics.IPythonExtension._parse_condition(condition))
+        if isinstance(node, ast.Name)
+    }
+
+
+def code_names(code: str) -> tuple[set[str], set[str]]:
+    """Return the names read and the names stored by code, which may contain IPython syntax."""
+    try:
+        tree = ast.parse(_transformer_manager.transform_cell(code))
+    except SyntaxError:
+        # Assume that every word in the code is read, and that nothing is stored
+        return (set(_word_pattern.findall(code)), set())
+    reads = set()
+    stores = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                reads.add(node.id)
+            else:
+                stores.add(node.id)
+        elif isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+            # Names whose attributes or items are assigned (or which are updated) are modified as well
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                for target_node in ast.walk(target):
+                    if isinstance(target_node, ast.Name):
+                        stores.add(target_node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stores.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                stores.add(alias.asname or alias.name.split(".")[0])
+        elif (
+            isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and node.func.attr in ("run_line_magic", "run_cell_magic", "system", "getoutput")
+        ):
+            # Analyze the arguments of magics and shell commands, which may contain code as well
+            for arg in node.args:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                    (arg_reads, arg_stores) = code_names(arg.value)
+                    reads.update(arg_reads)
+                    stores.update(arg_stores)
+    return (reads, stores)
+
+
+_transformer_manager = IPython.core.inputtransformer2.TransformerManager()  # type: ignore[no-untyped-call]
+_word_pattern = re.compile(r"[^\W\d]\w*")
+
+
+def analyze_dependencies(
+    cells: typing.Iterable[typing.Mapping[str, typing.Any]], tags: typing.Iterable[str],
+    parameters: typing.Iterable[str]
+) -> list[CellDependencies]:
+    """
+    Determine the tags and parameters which each cell depends on.
+
+    A cell depends on the tags and parameters referenced in its run_if or keep_if condition, on the parameters
+    read by its code, and on the dependencies of the variables defined by previous cells which its code reads.
+    """
+    entries = set(tags) | set(parameters)
+    parameters = set(parameters)
+    variables_dependencies: dict[str, set[str]] = dict()
+    table = list()
+    for (index, cell) in enumerate(cells):
+        condition: set[str] = set()
+        code = cell["source"]
+        condition_and_code = split_condition(cell)
+        if condition_and_code is not None:
+            condition = condition_names(condition_and_code[0]) & entries
+            code = condition_and_code[1]
+        if cell["cell_type"] == "code" and not code.startswith(("%load_ext nbvalx", "%%register_")):
+            (reads, stores) = code_names(code)
+        else:
+            (reads, stores) = (set(), set())
+        dependencies = condition | (reads & parameters)
+        for name in reads:
+            dependencies.update(variables_dependencies.get(name, set()))
+        for name in stores:
+            variables_dependencies.setdefault(name, set()).update(dependencies)
+        table.append(CellDependencies(
+            cell_index=index, cell_id=cell.get("id", None), cell_type=cell["cell_type"], condition=sorted(condition),
+            reads=sorted(reads & parameters), dependencies=sorted(dependencies)))
+    return table
@@ -0,0 +1,275 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""An IPython shell which runs in a separate process, executes code on request and can be forked."""
+
+import base64
+import io
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import typing
+
+import IPython.core.displayhook
+import IPython.core.displaypub
+import IPython.core.interactiveshell
+import traitlets
+import traitlets.config
+
+
+class ForkingShell:
+    """
+    A process running an IPython shell, which executes code on request and can be forked.
+
+    Jupyter kernels cannot be forked, since their sockets and threads do not survive a fork. This shell
+    rather captures outputs in the process itself, and sends them back in the format of notebook outputs.
+    """
+
+    def __init__(self, connection: socket.socket, process: subprocess.Popen[bytes] | None = None) -> None:
+        self._connection = connection
+        self._process = process
+        self.pid: int = _receive(connection)
+
+    @classmethod
+    def start(cls, cwd: str) -> "ForkingShell":
+        """Start a new process, running in the provided directory."""
+        (connection, shell_connection) = socket.socketpair()
+        with shell_connection:
+            process = subprocess.Popen(
+                [sys.executable, "-m", "nbvalx.forking_shell", str(shell_connection.fileno())],
+                cwd=cwd, stdin=subprocess.DEVNULL, pass_fds=(shell_connection.fileno(), ))
+        return cls(connection, process)
+
+    def execute(
+        self, code: str, timeout: float | None = None, silent: bool = False
+    ) -> list[dict[str, typing.Any]]:
+        """Execute code, and return its outputs."""
+        _send(self._connection, {"code": code, "silent": silent})
+        return self.wait(timeout)
+
+    def wait(self, timeout: float | None = None) -> list[dict[str, typing.Any]]:
+        """Wait for the outputs of the code being executed, and raise TimeoutError if not available in time."""
+        (readable, _, _) = select.select([self._connection], [], [], timeout)
+        if len(readable) == 0:
+            raise TimeoutError(f"Timeout of {timeout} seconds exceeded while waiting for process {self.pid}")
+        outputs: list[dict[str, typing.Any]] = _receive(self._connection)
+        return outputs
+
+    def interrupt(self) -> None:
+        """Interrupt the code being executed."""
+        os.kill(self.pid, signal.SIGINT)
+
+    def fork(self) -> "ForkingShell":
+        """Fork the process, and return a new process which starts from the current state."""
+        _send(self._connection, {"fork": True})
+        (_, fds, _, _) = socket.recv_fds(self._connection, 1, 1)
+        if len(fds) == 0:  # pragma: no cover
+            raise EOFError(f"Process {self.pid} was not able to fork")
+        return ForkingShell(socket.socket(fileno=fds[0]))
+
+    def stop(self) -> None:
+        """Stop the process, which terminates as soon as it is done with the code being executed."""
+        self._connection.close()
+        if self._process is not None:
+            self._process.wait()
+
+    def kill(self) -> None:
+        """Kill the process."""
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.stop()
+
+
+def _send(connection: socket.socket, message: typing.Any) -> None:  # noqa: ANN401
+    """Send a message, prefixed by its length."""
+    data = json.dumps(message).encode()
+    connection.sendall(struct.pack("!Q", len(data)) + data)
+
+
+def _receive(connection: socket.socket) -> typing.Any:  # noqa: ANN401
+    """Receive a message, and raise EOFError if the connection was closed."""
+    (length, ) = struct.unpack("!Q", _receive_exactly(connection, 8))
+    return json.loads(_receive_exactly(connection, length))
+
+
+def _receive_exactly(connection: socket.socket, length: int) -> bytes:
+    """Receive exactly the requested number of bytes."""
+    data = bytearray()
+    while len(data) < length:
+        chunk = connection.recv(length - len(data))
+        if len(chunk) == 0:
+            raise EOFError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+class _OutputStream(io.TextIOBase):
+    """A text stream which stores the text written to it as a stream output of the code being executed."""
+
+    def __init__(self, shell: "_Shell", name: str) -> None:
+        super().__init__()
+        self._shell = shell
+        self._name = name
+
+    @property
+    def encoding(self) -> str:  # type: ignore[override]
+        """Return the encoding of the stream."""
+        return "utf-8"
+
+    def writable(self) -> bool:
+        """Return that the stream is writable."""
+        return True
+
+    def write(self, text: str) -> int:
+        """Append text to the last output, if it is a stream output with the same name, or to a new output."""
+        outputs = self._shell.outputs
+        if len(outputs) > 0 and outputs[-1]["output_type"] == "stream" and outputs[-1]["name"] == self._name:
+            outputs[-1]["text"] += text
+        else:
+            outputs.append({"output_type": "stream", "name": self._name, "text": text})
+        return len(text)
+
+
+def _encode_data(data: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """Encode binary data, e.g. images, in base64, as in notebook outputs."""
+    return {
+        mime: base64.b64encode(value).decode() if isinstance(value, bytes) else value
+        for (mime, value) in data.items()
+    }
+
+
+class _DisplayHook(IPython.core.displayhook.DisplayHook):
+    """A display hook which stores the result of the code being executed as an execute_result output."""
+
+    def write_output_prompt(self) -> None:
+        """Do not write any prompt."""
+        pass
+
+    def write_format_data(
+        self, format_dict: dict[str, typing.Any], md_dict: dict[str, typing.Any] | None = None
+    ) -> None:
+        """Store the result as an output."""
+        assert self.shell is not None
+        self.shell.outputs.append({
+            "output_type": "execute_result", "data": _encode_data(format_dict), "metadata": md_dict or {},
+            "execution_count": self.prompt_count})
+
+    def finish_displayhook(self) -> None:
+        """Do not write any separator."""
+        pass
+
+
+class _DisplayPublisher(IPython.core.displaypub.DisplayPublisher):
+    """A display publisher which stores displayed objects as display_data outputs."""
+
+    def publish(
+        self, data: dict[str, typing.Any], metadata: dict[str, typing.Any] | None = None,
+        source: str | None = None, *, transient: dict[str, typing.Any] | None = None, update: bool = False,
+        **kwargs: typing.Any  # noqa: ANN401
+    ) -> None:
+        """Store the displayed object as an output."""
+        self.shell.outputs.append({
+            "output_type": "display_data", "data": _encode_data(data), "metadata": metadata or {}})
+
+    def clear_output(self, wait: bool = False) -> None:
+        """Ignore requests to clear outputs, as nbval does."""
+        pass
+
+
+class _Shell(IPython.core.interactiveshell.InteractiveShell):
+    """An IPython shell which stores outputs and tracebacks of the code being executed."""
+
+    displayhook_class = traitlets.Type(_DisplayHook)
+    display_pub_class = traitlets.Type(_DisplayPublisher)
+
+    def __init__(self, **kwargs: typing.Any) -> None:  # noqa: ANN401
+        self.outputs: list[dict[str, typing.Any]] = list()
+        super().__init__(**kwargs)  # type: ignore[no-untyped-call]
+
+    def execute(self, code: str, silent: bool) -> list[dict[str, typing.Any]]:
+        """Execute code, and return its outputs. Code can be interrupted only while it is being executed."""
+        self.outputs = list()
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            try:
+                self.run_cell(code, store_history=not silent, silent=silent)  # type: ignore[no-untyped-call]
+            finally:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+        except KeyboardInterrupt:  # pragma: no cover
+            # The interruption arrived after execution was completed
+            pass
+        return self.outputs
+
+    def _showtraceback(  # type: ignore[override]
+        self, etype: type[BaseException], evalue: BaseException, stb: list[str]
+    ) -> None:
+        """Store the traceback as an error output."""
+        self.outputs.append({
+            "output_type": "error", "ename": str(etype.__name__), "evalue": str(evalue), "traceback": stb})
+
+
+def _fork(connection: socket.socket) -> socket.socket | None:
+    """
+    Fork the process, and return the connection of the new process to the client, or None in the current process.
+
+    The process is forked twice, so that the new process is adopted by init and never becomes a zombie.
+    The client receives the connection to the new process over the current connection.
+    """
+    (client_connection, new_connection) = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        if os.fork() == 0:
+            connection.close()
+            client_connection.close()
+            return new_connection
+        else:
+            os._exit(0)
+    else:
+        os.waitpid(pid, 0)
+        new_connection.close()
+        socket.send_fds(connection, [b"f"], [client_connection.fileno()])
+        client_connection.close()
+        return None
+
+
+def main() -> None:
+    """Run a shell serving the connection provided on the command line, until the connection is closed."""
+    connection = socket.socket(fileno=int(sys.argv[1]))
+    # The history is stored by a thread in a database, neither of which survives a fork
+    shell = _Shell.instance(config=traitlets.config.Config({"HistoryManager": {"enabled": False}}))
+    sys.stdout = _OutputStream(shell, "stdout")
+    sys.stderr = _OutputStream(shell, "stderr")
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    forked = False
+    _send(connection, os.getpid())
+    while True:
+        try:
+            request = _receive(connection)
+        except EOFError:
+            break
+        if "fork" in request:
+            new_connection = _fork(connection)
+            if new_connection is not None:
+                connection = new_connection
+                forked = True
+                _send(connection, os.getpid())
+        else:
+            _send(connection, shell.execute(request["code"], request["silent"]))
+    if forked:
+        # Processes which were forked share the state of the original process, including any cleanup
+        # which it registered at exit: only the original process is allowed to carry it out
+        sys.stdout.flush()
+        os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,13 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Custom jupyter magics to selectively run cells using tags or add a parametrization."""
 
+import ast
+import functools
+import hashlib
+import json
+import os
+import pickle
+import re
 import types
 import typing
 
@@ -145,9 +152,28 @@ class IPythonExtension:
         if runner is None:
             runner = cls._ipython_runner
         magic, code = cls._split_magic_from_code(line, cell)
-        if simpleeval.simple_eval(magic, names=current_tags_dict):
+        if cls.evaluate_condition(magic, [current_tags_dict])[0]:
             runner(code)
 
+    @classmethod
+    def evaluate_condition(
+        cls, condition: str, current_tags_dicts: typing.Iterable[dict[str, bool | int | str]]
+    ) -> list[bool]:
+        """Evaluate the condition of a run_if magic for several values of the current tags, parsing it only once."""
+        parsed_condition = cls._parse_condition(condition)
+        evaluator = simpleeval.SimpleEval()
+        evaluations = list()
+        for current_tags_dict in current_tags_dicts:
+            evaluator.names = current_tags_dict
+            evaluations.append(bool(evaluator.eval(condition, previously_parsed=parsed_condition)))
+        return evaluations
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _parse_condition(condition: str) -> ast.AST:
+        """Parse the condition of a run_if magic, caching the result since the same condition is evaluated often."""
+        return simpleeval.SimpleEval.parse(condition)  # type: ignore[no-any-return]
+
     @classmethod
     def register_allowed_parameters(
         cls, line: str, cell: str, allowed_parameters_dict: dict[str, list[bool] | list[int] | list[str]] | None = None
@@ -175,6 +201,111 @@ class IPythonExtension:
             line, cell, allowed_parameters_dict, current_parameters_dict, "register_current_parameters",
             lambda name, value_str: runner(f"{name} = {value_str}"))
 
+    cache_marker = "# NBVALX_CACHE:"
+    _cache_arguments_pattern = re.compile(r"(?P<variables>[^(]*)(\(depends on:(?P<dependencies>[^)]*)\))?")
+
+    @classmethod
+    def cache_variables(
+        cls, line: str, cell: str, current_magic_entries_dict: dict[str, bool | int | str] | None = None,
+        namespace: dict[str, typing.Any] | None = None, runner: typing.Callable[[str], None] | None = None,
+        cache_dir: str | None = None
+    ) -> None:
+        """
+        Restore the variables provided in the magic argument from the cache, or run the cell and cache them.
+
+        Variables are cached in a pickle file, keyed by the code of the cell and by the current value of the tags
+        and parameters it depends on (all of them, unless listed after the variables as "(depends on: a, b)").
+        """
+        if current_magic_entries_dict is None:
+            current_magic_entries_dict = {**cls.current_tags, **cls.current_parameters}
+        if namespace is None:
+            namespace = IPython.get_ipython().user_ns  # type: ignore[attr-defined, union-attr]
+            assert namespace is not None
+        if runner is None:
+            runner = cls._ipython_runner
+        if cache_dir is None:
+            cache_dir = os.environ.get("NBVALX_CELL_CACHE_DIR", ".nbvalx_cell_cache")
+        magic, code = cls._split_magic_from_code(line, cell)
+        match = cls._cache_arguments_pattern.fullmatch(magic)
+        assert match is not None, f"Invalid arguments of %%cache_variables: {magic}"
+        variables = cls._split_names(match.group("variables"))
+        if match.group("dependencies") is not None:
+            dependencies = cls._split_names(match.group("dependencies"))
+        else:
+            dependencies = list(current_magic_entries_dict.keys())
+        # When running in parallel, every process caches its own variables
+        key = hashlib.sha256(json.dumps([
+            code, variables, cls._mpi_rank_and_size(),
+            {name: current_magic_entries_dict[name] for name in dependencies if name in current_magic_entries_dict}
+        ], sort_keys=True).encode()).hexdigest()
+        cache_path = os.path.join(cache_dir, key + ".pickle")
+        try:
+            with open(cache_path, "rb") as f:
+                cached_variables = pickle.load(f)
+        except Exception:
+            # The variables were never cached, or they cannot be restored: run the cell
+            pass
+        else:
+            # Mark the entry as recently used
+            os.utime(cache_path)
+            namespace.update(cached_variables)
+            return
+        runner(code)
+        missing_variables = [name for name in variables if name not in namespace]
+        if len(missing_variables) > 0:
+            raise RuntimeError(f"Variables {', '.join(missing_variables)} were not defined by the cell")
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_cache_path = f"{cache_path}.{os.getpid()}"
+        with open(temporary_cache_path, "wb") as f:
+            pickle.dump({name: namespace[name] for name in variables}, f)
+        os.replace(temporary_cache_path, cache_path)
+        cls._evict_cache(cache_dir, int(os.environ.get("NBVALX_CELL_CACHE_SIZE", 2**30)))
+
+    @staticmethod
+    def _split_names(names: str) -> list[str]:
+        """Split a comma separated list of names."""
+        return [name.strip() for name in names.split(",") if name.strip() != ""]
+
+    @staticmethod
+    def _mpi_rank_and_size() -> tuple[int, int]:
+        """Return the rank of the current process and the number of processes, if running in parallel."""
+        try:
+            import mpi4py.MPI
+        except ImportError:  # pragma: no cover
+            return (0, 1)
+        else:
+            return (mpi4py.MPI.COMM_WORLD.rank, mpi4py.MPI.COMM_WORLD.size)
+
+    @staticmethod
+    def _evict_cache(cache_dir: str, max_size: int) -> None:
+        """Remove the least recently used entries of the cache, until its size does not exceed the maximum size."""
+        entries = list()
+        with os.scandir(cache_dir) as iterator:
+            for dir_entry in iterator:
+                if dir_entry.name.endswith(".pickle"):
+                    try:
+                        stat = dir_entry.stat()
+                    except OSError:  # pragma: no cover
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, dir_entry.path))
+        size = sum(entry_size for (_, entry_size, _) in entries)
+        for (_, entry_size, path) in sorted(entries):
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # pragma: no cover
+                pass
+            size -= entry_size
+
+    @classmethod
+    def transform_cache_marker(cls, lines: list[str]) -> list[str]:
+        """Transform a cell starting with the cache marker comment into a cell running the cache_variables magic."""
+        if len(lines) > 0 and lines[0].startswith(cls.cache_marker):
+            return ["%%cache_variables " + lines[0][len(cls.cache_marker):].strip() + "\n", *lines[1:]]
+        else:
+            return lines
+
     @classmethod
     def suppress_traceback_handler(
         cls, ipython: IPython.core.interactiveshell.InteractiveShell, etype: type[BaseException],
@@ -201,6 +332,10 @@ def load_ipython_extension(
     ipython.register_magic_function(
         IPythonExtension.register_current_parameters,  # type: ignore[arg-type]
         "cell", "register_current_parameters")
+    ipython.register_magic_function(
+        IPythonExtension.cache_variables,  # type: ignore[arg-type]
+        "cell", "cache_variables")
+    ipython.input_transformers_cleanup.append(IPythonExtension.transform_cache_marker)
     ipython.set_custom_exc(  # type: ignore[no-untyped-call]
         (IPythonExtension.SuppressTracebackMockError, ), IPythonExtension.suppress_traceback_handler)
     IPythonExtension.loaded = True
@@ -219,6 +354,8 @@ def unload_ipython_extension(
     del ipython.magics_manager.magics["cell"]["register_allowed_parameters"]
     del ipython.magics_manager.magics["cell"]["register_current_parameters"]
     del ipython.magics_manager.magics["cell"]["run_if"]
+    del ipython.magics_manager.magics["cell"]["cache_variables"]
+    ipython.input_transformers_cleanup.remove(IPythonExtension.transform_cache_marker)
     IPythonExtension.loaded = False
     IPythonExtension.allowed_tags = {}
     IPythonExtension.current_tags = {}
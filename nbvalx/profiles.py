@@ -0,0 +1,108 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Summary of the profiles of notebook cells, as stored by the --ipynb-profile option of the notebook hooks."""
+
+import argparse
+import collections
+import pathlib
+import pstats
+import re
+import tracemalloc
+import typing
+
+
+class CellProfile(typing.NamedTuple):
+    """Total of a cell profile, i.e. either time or allocated memory, and its breakdown by function or by line."""
+
+    cell: str
+    total: float
+    entries: dict[str, float]
+
+
+def read_cell_profile(profile_file: pathlib.Path) -> CellProfile:
+    """Read a cell profile, stored by cProfile (with extension .prof) or by tracemalloc (extension .tracemalloc)."""
+    if profile_file.suffix == ".prof":
+        stats = pstats.Stats(str(profile_file))
+        entries = {
+            f"{filename}:{line}({function})": own_time
+            for ((filename, line, function), (_, _, own_time, _, _)) in stats.stats.items()  # type: ignore[attr-defined]
+        }
+        return CellProfile(cell=profile_file.stem, total=stats.total_tt, entries=entries)  # type: ignore[attr-defined]
+    elif profile_file.suffix == ".tracemalloc":
+        snapshot = tracemalloc.Snapshot.load(str(profile_file))
+        entries = {str(statistic.traceback): statistic.size for statistic in snapshot.statistics("lineno")}
+        return CellProfile(cell=profile_file.stem, total=sum(entries.values()), entries=entries)
+    else:
+        raise ValueError(f"Unknown profile format of {profile_file}")
+
+
+def find_profiles(paths: typing.Iterable[pathlib.Path]) -> dict[str, dict[str, list[pathlib.Path]]]:
+    """
+    Find the profiles stored in the provided directories, grouped by notebook and by variant.
+
+    Profiles of each variant are stored in a directory named after the generated notebook with extension .profile,
+    and the notebook is determined by removing the tags and parameters in square brackets from the variant.
+    """
+    profiles: dict[str, dict[str, list[pathlib.Path]]] = dict()
+    for path in paths:
+        profile_dirs = [path] if path.name.endswith(".profile") else sorted(path.rglob("*.profile"))
+        for profile_dir in profile_dirs:
+            variant = str(profile_dir)[:-len(".profile")]
+            notebook = _variant_pattern.sub("", variant)
+            profiles.setdefault(notebook, dict())[variant] = sorted(
+                profile_file for profile_file in profile_dir.iterdir() if profile_file.suffix in _units)
+    return profiles
+
+
+_variant_pattern = re.compile(r"\[.*\]$")
+_units = {".prof": "functions by own time", ".tracemalloc": "lines by allocated memory"}
+
+
+def summarize(paths: typing.Iterable[pathlib.Path], top: int = 10) -> str:
+    """Summarize the profiles stored in the provided directories, by notebook, by variant and by cell."""
+    lines = list()
+    for (notebook, variants) in sorted(find_profiles(paths).items()):
+        for kind in _units:
+            notebook_entries: collections.Counter[str] = collections.Counter()
+            notebook_lines = list()
+            for (variant, profile_files) in sorted(variants.items()):
+                cell_profiles = [
+                    read_cell_profile(profile_file) for profile_file in profile_files if profile_file.suffix == kind]
+                if len(cell_profiles) == 0:
+                    continue
+                notebook_lines.append(
+                    f"    {_format(sum(cell.total for cell in cell_profiles), kind)} {pathlib.Path(variant).name}")
+                for cell in sorted(cell_profiles, key=lambda cell: cell.total, reverse=True):
+                    notebook_lines.append(f"        {_format(cell.total, kind)} cell {cell.cell}")
+                    notebook_entries.update(cell.entries)
+            if len(notebook_lines) > 0:
+                lines.append(f"{_format(sum(notebook_entries.values()), kind)} {notebook}")
+                lines.extend(notebook_lines)
+                lines.append(f"    top {top} {_units[kind]}:")
+                for (entry, value) in notebook_entries.most_common(top):
+                    lines.append(f"        {_format(value, kind)} {entry}")
+    return "\n".join(lines)
+
+
+def _format(value: float, kind: str) -> str:
+    """Format a time, in seconds, or an amount of memory, in MiB."""
+    if kind == ".prof":
+        return f"{value:.3f}s"
+    else:
+        return f"{value / 2**20:.3f}MiB"
+
+
+def main() -> None:
+    """Print the summary of the profiles stored in the directories provided on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="+", type=pathlib.Path, help="Directories in which to look for profiles")
+    parser.add_argument("--top", type=int, default=10, help="Number of functions or lines reported per notebook")
+    arguments = parser.parse_args()
+    print(summarize(arguments.paths, arguments.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,24 +5,39 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Utility functions to be used in pytest configuration file for notebooks tests."""
 
+import base64
 import collections
+import concurrent.futures
 import copy
 import fnmatch
+import functools
 import glob
+import gzip
+import hashlib
 import itertools
 import json
+import mimetypes
 import os
 import pathlib
+import queue
+import random
 import re
 import shutil
+import sys
 import textwrap
+import threading
+import time
 import typing
 
 import _pytest.main
+import _pytest.mark.expression
 import nbformat
+import nbval.kernel
 import nbval.plugin
 import pytest
 
+import nbvalx.dependencies
+import nbvalx.forking_shell
 import nbvalx.jupyter_magics
 
 
@@ -47,6 +62,119 @@ def addoption(parser: pytest.Parser, pluginmanager: pytest.PytestPluginManager)
         "--link-data-in-work-dir", action="append", type=str, default=[], help=(
             "Glob patterns of data files that need to be copied to the work directory. The option can be passed "
             "multiple times in case multiple patterns are desired, and they will be joined with an or condition."))
+    # Log files
+    parser.addoption(
+        "--log-max-size", type=int, default=0, help=(
+            "Maximum size, in characters, of each text log file: the beginning and the end of larger logs are "
+            "retained, while the part in between is dropped. If zero (default), the size is not limited."))
+    parser.addoption(
+        "--log-compress", action="store_true", help="Compress text log files with gzip once the notebook is done")
+    parser.addoption(
+        "--log-ipynb-outputs", type=str, default="all", help=(
+            "Outputs to be stored in the notebook log file: either all (default), truncate, which limits each "
+            "output to the size passed to --log-max-size, or none"))
+    parser.addoption(
+        "--log-ipynb-spill-size", type=int, default=0, help=(
+            "Outputs larger than this size, in characters, are stored in separate files rather than in the notebook "
+            "log, and are released from memory as soon as the cell is done. If zero (default), outputs are kept."))
+    # Number of worker processes for notebook generation
+    parser.addoption(
+        "--generate-workers", type=int, default=1, help=(
+            "Number of worker processes to use while generating notebooks in the work directory"))
+    # Variant selection
+    parser.addoption(
+        "--variant-strategy", type=str, default="full", help=(
+            "Strategy to select the combinations of tags and parameters to be tested: either full (default), "
+            "which tests every combination, pairwise, which tests a covering array of strength --variant-strength, "
+            "or random:N, which tests N combinations sampled with seed --variant-seed"))
+    parser.addoption(
+        "--variant-strength", type=int, default=2, help=(
+            "Strength of the covering array used by --variant-strategy=pairwise, i.e. the number of tags and "
+            "parameters whose values are tested in every possible combination"))
+    parser.addoption(
+        "--variant-seed", type=int, default=None, help=(
+            "Seed used by --variant-strategy=random:N. If not provided, a seed is chosen at random and recorded "
+            "in the manifest of the work directory, so that the run can be reproduced"))
+    # Dependencies of cells on tags and parameters
+    parser.addoption(
+        "--dump-dependencies", action="store_true", help=(
+            "Write a table of the tags and parameters which every cell depends on in a JSON file in the work "
+            "directory"))
+    # Cluster pool
+    parser.addoption(
+        "--cluster-pool", action="store_true", help=(
+            "Start a single ipyparallel cluster for the whole session, rather than one for each notebook, "
+            "and reset the engines after each notebook"))
+    # Variant scheduler
+    parser.addoption(
+        "--variant-workers", type=str, default="1", help=(
+            "Number of cores available to run notebooks concurrently, or auto to use all available cores. "
+            "Each notebook consumes as many cores as the value passed to --np."))
+    # Prefix sharing
+    parser.addoption(
+        "--prefix-sharing", action="store_true", help=(
+            "Run the cells which notebooks in the same directory have in common at their beginning only once, "
+            "and fork the process running them where notebooks start to differ"))
+    # Result cache
+    parser.addoption(
+        "--ipynb-cache", type=str, default="off", help=(
+            "Cache the outcomes of notebooks which passed, and report them without running the notebook again "
+            "as long as the notebook and the files it depends on are unchanged: either off (default), on, or "
+            "refresh, which runs every notebook and updates the cache"))
+    parser.addoption(
+        "--ipynb-cache-dependency", action="append", type=str, default=[], help=(
+            "Glob pattern, relative to the current directory, of files which every notebook depends on, in addition "
+            "to the data linked in the work directory. The option can be passed multiple times in case multiple "
+            "patterns are desired."))
+    # Durations
+    parser.addoption(
+        "--ipynb-durations", type=int, default=0, help=(
+            "Number of slowest notebooks and cells to be reported in the terminal summary. If zero (default), "
+            "durations are not reported."))
+    parser.addoption(
+        "--ipynb-durations-report", type=str, default="", help=(
+            "Path of a JSON file in which to store the durations of notebook generation, and of the kernel start, "
+            "cells and teardown of each notebook"))
+    # Order
+    parser.addoption(
+        "--ipynb-order", type=str, default="collection", help=(
+            "Order in which notebooks are run: either collection (default), or duration, which runs the notebooks "
+            "that took longest in previous runs first. The duration of notebooks which did not run before is "
+            "estimated from their file size."))
+    # Profiling
+    parser.addoption(
+        "--ipynb-profile", type=str, default="off", help=(
+            "Profile every cell inside the kernel (or on every engine, when running in parallel), and store the "
+            "profile of each cell in a directory next to the log files: either off (default), cprofile, which "
+            "stores function timings, or tracemalloc, which stores a snapshot of the memory allocated by the cell"))
+    # Memory
+    parser.addoption(
+        "--ipynb-memory", action="store_true", help=(
+            "Record the peak resident set size of every cell, and the change of the resident set size and of the "
+            "number of Python allocated blocks, in the kernel (or on every engine, when running in parallel)"))
+    parser.addoption(
+        "--ipynb-memory-budget", type=int, default=0, help=(
+            "Maximum peak resident set size, in MiB, of every cell on every process: cells which exceed it fail. "
+            "Implies --ipynb-memory. If zero (default), there is no budget."))
+    # Impact selection
+    parser.addoption(
+        "--ipynb-impacted-by", type=str, default="", help=(
+            "Path of a file which lists changed files, one per line and relative to the current directory, e.g. "
+            "as written by git diff --name-only --relative. Only the notebooks which covered a line of a changed "
+            "file in a previous run with --coverage-source, or whose source notebook changed, are run."))
+    # Kernel pool
+    parser.addoption(
+        "--kernel-pool", type=int, default=0, help=(
+            "Number of pre-started kernels to be reused across notebooks. If zero (default), every notebook "
+            "starts its own kernel."))
+    parser.addoption(
+        "--kernel-pool-preload", action="append", type=str, default=[], help=(
+            "Module to be imported in every kernel of the pool as soon as it is started. The option can be passed "
+            "multiple times in case multiple modules are desired."))
+    parser.addoption(
+        "--kernel-pool-policy", type=str, default="reset", help=(
+            "Action to carry out on a kernel of the pool after a notebook is done: either reset (default), which "
+            "clears the namespace and keeps the process alive, or restart, which replaces the kernel process."))
 
 
 def sessionstart(session: pytest.Session) -> None:
@@ -84,302 +212,738 @@ def sessionstart(session: pytest.Session) -> None:
     if np > 1 or ipynb_action != "create-notebooks":
         assert work_dir != ".", (
             "Please use a subdirectory as work directory to prevent losing the original notebooks")
+    # Verify log files options
+    log_max_size = session.config.option.log_max_size
+    assert log_max_size >= 0
+    log_ipynb_outputs = session.config.option.log_ipynb_outputs
+    assert log_ipynb_outputs in ("all", "truncate", "none")
+    if log_ipynb_outputs == "truncate":
+        assert log_max_size > 0, "--log-ipynb-outputs=truncate requires --log-max-size"
+    assert session.config.option.log_ipynb_spill_size >= 0
+    # Verify generation options
+    generate_workers = session.config.option.generate_workers
+    assert generate_workers > 0
+    # Verify variant selection options, and choose a seed if not provided
+    variant_strategy = session.config.option.variant_strategy
+    assert variant_strategy in ("full", "pairwise") or re.fullmatch(r"random:[1-9][0-9]*", variant_strategy), (
+        "--variant-strategy must be either full, pairwise or random:N, with N a positive integer")
+    variant_strength = session.config.option.variant_strength
+    assert variant_strength > 0
+    if session.config.option.variant_seed is None:
+        session.config.option.variant_seed = random.randrange(2**32)
+    variant_seed = session.config.option.variant_seed
+    # Verify dependencies options
+    dump_dependencies = session.config.option.dump_dependencies
+    assert dump_dependencies in (True, False)
+    # Verify cluster pool options
+    cluster_pool = session.config.option.cluster_pool
+    assert cluster_pool in (True, False)
+    # Verify kernel pool options
+    kernel_pool = session.config.option.kernel_pool
+    assert kernel_pool >= 0
+    kernel_pool_policy = session.config.option.kernel_pool_policy
+    assert kernel_pool_policy in ("reset", "restart")
+    # Verify variant scheduler options: each notebook requires np cores, and the number of notebooks
+    # running concurrently is determined so that the available cores are never oversubscribed
+    if session.config.option.variant_workers == "auto":
+        variant_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    else:
+        variant_cores = int(session.config.option.variant_workers)
+        assert variant_cores > 0
+    variant_workers = max(1, variant_cores // np)
+    if variant_workers > 1:
+        assert not cluster_pool, "--cluster-pool cannot be used when running notebooks concurrently"
+    # Verify prefix sharing options
+    prefix_sharing = session.config.option.prefix_sharing
+    if prefix_sharing:
+        assert hasattr(os, "fork"), "--prefix-sharing requires an operating system which supports fork"
+        assert np == 1, "--prefix-sharing cannot be used in parallel"
+        assert kernel_pool == 0, "--prefix-sharing cannot be used with --kernel-pool"
+        assert variant_workers == 1, "--prefix-sharing cannot be used when running notebooks concurrently"
+    # Verify pytest-xdist options: only the controller generates notebooks, and workers run them. Cells of a notebook
+    # share a kernel, and hence the controller must send all of them to the same worker
+    xdist_worker = _is_xdist_worker(session.config)
+    xdist_controller = _is_xdist_controller(session.config)
+    if xdist_controller:
+        if session.config.option.dist == "load":
+            session.config.option.dist = "loadgroup"
+        assert session.config.option.dist in ("loadgroup", "loadfile", "loadscope"), (
+            "Please use --dist=loadgroup, so that pytest-xdist sends all cells of a notebook to the same worker")
+    if xdist_worker:
+        # Workers parse the command line again, and hence do not know that the controller replaced --dist=load:
+        # make them add the group to the node id of every cell, since the controller schedules cells by group
+        session.config.option.loadgroup = True
+    if xdist_controller or xdist_worker:
+        assert variant_workers == 1, "--variant-workers cannot be used with pytest-xdist"
+        assert not prefix_sharing, "--prefix-sharing cannot be used with pytest-xdist"
+    run_notebooks = ipynb_action != "create-notebooks" and not xdist_controller
+    # Verify result cache options
+    ipynb_cache = session.config.option.ipynb_cache
+    assert ipynb_cache in ("off", "on", "refresh")
+    # Verify durations options
+    ipynb_durations = session.config.option.ipynb_durations
+    assert ipynb_durations >= 0
+    ipynb_durations_report = session.config.option.ipynb_durations_report
+    # Verify order options
+    ipynb_order = session.config.option.ipynb_order
+    assert ipynb_order in ("collection", "duration")
+    # Verify profiling options
+    ipynb_profile = session.config.option.ipynb_profile
+    assert ipynb_profile in ("off", "cprofile", "tracemalloc")
+    # Verify memory options
+    ipynb_memory_budget = session.config.option.ipynb_memory_budget
+    assert ipynb_memory_budget >= 0
+    ipynb_memory = session.config.option.ipynb_memory or ipynb_memory_budget > 0
+    # Verify impact selection options
+    ipynb_impacted_by = session.config.option.ipynb_impacted_by
     # Verify if keyword matching (-k option) is enabled, as it will be used to match tags or parameters
-    keyword = session.config.option.keyword
-    # pathlib.PurePath.full_match is only available in python 3.13+. In the meantime,
-    # implement the comparison using fnmatch
-    def full_match(path: pathlib.Path, pattern: str) -> bool:
-        """Backport of pathlib.PurePath.full_match."""
-        return fnmatch.fnmatch(str(path), pattern)
-    # List existing files
+    keyword = session.config.option.keyword.lstrip()
+    if keyword != "":
+        try:
+            _pytest.mark.expression.Expression.compile(keyword)
+        except SyntaxError as e:
+            raise pytest.UsageError(f"Wrong expression passed to '-k': {keyword}: {e}") from e
+    # List existing files, walking the file system only once to build an index which will be queried
+    # to discover notebooks, to clean up the work directory and to link data in the work directory
     files = list()
     dirs = list()
+    dirs_to_discover = list()
     for (i_arg, arg) in enumerate(session.config.args):
         collection_argument = _pytest.main.resolve_collection_argument(
             session.config.invocation_params.dir, arg, i_arg
         )
         dir_or_file = collection_argument.path
         if dir_or_file.is_dir():
-            dir_or_file_candidates = [dir_entry for dir_entry in dir_or_file.rglob("*")]
             dirs.append(dir_or_file)
+            dirs_to_discover.append(dir_or_file)
         else:  # pragma: no cover
-            if full_match(dir_or_file, "**/*.ipynb"):
-                dir_or_file_candidates = [dir_or_file]
+            if dir_or_file.name.endswith(".ipynb"):
+                files.append(dir_or_file)
                 dirs.append(dir_or_file.parent)
-            else:
-                dir_or_file_candidates = []
-        for dir_entry in dir_or_file_candidates:
-            if dir_entry.is_file():
-                if (
-                    full_match(dir_entry, "**/*.ipynb")
-                        and
-                    not full_match(dir_entry, "**/.ipynb_checkpoints/*.ipynb")
-                        and
-                    not full_match(dir_entry, "**/.virtual_documents/*.ipynb")
-                        and
-                    not full_match(dir_entry, f"**/{work_dir}/*.ipynb")
-                        and
-                    not any(full_match(dir_entry, f"**/{parent}/*.ipynb") for parent in pathlib.Path(work_dir).parents)
-                ):
-                    files.append(dir_entry)
+    index = _FileSystemIndex(dirs, work_dir)
+    for dir_ in dirs_to_discover:
+        files.extend(index.notebooks(dir_))
     session.config.args = [str(dir_) for dir_ in dirs]
+    # Determine which notebooks were already generated by a previous run with the same options. pytest-xdist workers
+    # rather find the notebooks generated by the controller, and must not modify the work directory
+    options = _GenerationOptions(
+        np=np, coverage_source=coverage_source,
+        coverage_data_file=os.path.join(os.getcwd(), os.environ.get("COVERAGE_FILE", ".coverage")),
+        ipynb_action=ipynb_action, collapse=collapse, work_dir=work_dir, keyword=keyword,
+        rootpath=str(session.config.rootpath), variant_strategy=variant_strategy,
+        variant_strength=variant_strength if variant_strategy == "pairwise" else 0,
+        variant_seed=variant_seed if variant_strategy.startswith("random:") else 0,
+        dump_dependencies=dump_dependencies, cluster_pool=cluster_pool, log_max_size=log_max_size,
+        ipynb_profile=ipynb_profile, ipynb_memory=ipynb_memory, ipynb_memory_budget=ipynb_memory_budget)
+    generation_keys = dict()
+    old_manifests: dict[pathlib.Path, dict[str, typing.Any]] = dict()
+    new_manifests: dict[pathlib.Path, dict[str, typing.Any]] = dict()
+    up_to_date_files = set()
+    up_to_date_nb_copies_paths: set[pathlib.Path] = set()
+    if work_dir != "." and not xdist_worker:
+        for file_ in files:
+            manifest_path = file_.parent / work_dir / _GENERATION_MANIFEST
+            if manifest_path not in old_manifests:
+                old_manifests[manifest_path] = _read_generation_manifest(manifest_path)
+                new_manifests[manifest_path] = dict()
+            generation_keys[file_] = _generation_key(file_, options)
+            manifest_entry = old_manifests[manifest_path].get(file_.name)
+            if _is_generation_manifest_entry_up_to_date(manifest_entry, generation_keys[file_], manifest_path.parent):
+                assert manifest_entry is not None
+                up_to_date_files.add(file_)
+                up_to_date_nb_copies_paths.update(
+                    manifest_path.parent / nb_copy_name for nb_copy_name in manifest_entry["notebooks"])
+                new_manifests[manifest_path][file_.name] = manifest_entry
     # Clean up possibly existing links and notebooks in work directory from a previous run
-    if work_dir != ".":
-        cleanup_patterns = [*link_data_in_work_dir, "**/*.ipynb"]
-        for dir_ in dirs:
-            for dir_entry in dir_.rglob("*"):
-                if (
-                    any(full_match(dir_entry, cleanup_pattern) for cleanup_pattern in cleanup_patterns)
-                        and
-                    work_dir in str(dir_entry)
-                ):
-                    if dir_entry.is_symlink() or dir_entry.is_file():
-                        dir_entry.unlink()
-                    elif dir_entry.is_dir():  # pragma: no cover
-                        shutil.rmtree(dir_entry, ignore_errors=True)
-                    if dir_entry in files:  # pragma: no cover
-                        files.remove(dir_entry)
+    if work_dir != "." and not xdist_worker:
+        cleanup_pattern = _compile_glob_patterns([*link_data_in_work_dir, "**/*.ipynb"])
+        for dir_entry in index.work_dir_entries():
+            if cleanup_pattern.match(str(dir_entry)) and dir_entry not in up_to_date_nb_copies_paths:
+                if dir_entry.is_symlink() or dir_entry.is_file():
+                    dir_entry.unlink()
+                elif dir_entry.is_dir():  # pragma: no cover
+                    shutil.rmtree(dir_entry, ignore_errors=True)
     # Link data in the work directory
+    linked_data: dict[pathlib.Path, list[pathlib.Path]] = {file_.parent / work_dir: list() for file_ in files}
     if work_dir != "." and len(link_data_in_work_dir) > 0:
-        for file_ in files:
-            for source_path in file_.parent.rglob("*"):
-                if (
-                    any(full_match(source_path, pattern) for pattern in link_data_in_work_dir)
-                        and
-                    work_dir not in str(source_path)
-                ):
-                    destination_path = file_.parent / work_dir / source_path.relative_to(file_.parent)
-                    if not destination_path.exists():
-                        destination_path.parent.mkdir(parents=True, exist_ok=True)
-                        destination_path.symlink_to(source_path)
-    # Process each notebook
-    for file_ in files:
-        # Read in notebook
-        with open(file_) as f:
-            nb = nbformat.read(f, as_version=4)  # type: ignore[no-untyped-call]
-        # Determine if tags or parameters were used
-        load_ext_present = False
-        allowed_tags: dict[str, list[bool] | list[int] | list[str]] = {}
-        allowed_parameters: dict[str, list[bool] | list[int] | list[str]] = {}
-        for cell in nb.cells:
-            if cell.cell_type == "code":
-                if cell.source.startswith("%load_ext nbvalx"):
-                    load_ext_present = True
-                    assert len(cell.source.splitlines()) == 1, "Use a standalone cell for %load_ext nbvalx"
-                elif cell.source.startswith("%%register_allowed_run_if_tags"):
-                    assert load_ext_present
-                    lines = cell.source.splitlines()
-                    assert lines[0] == "%%register_allowed_run_if_tags"
-                    nbvalx.jupyter_magics.IPythonExtension.register_allowed_run_if_tags(
-                        "", "\n".join(lines[1:]), allowed_tags)
-                elif cell.source.startswith("%%register_allowed_parameters"):
-                    assert load_ext_present
-                    lines = cell.source.splitlines()
-                    assert lines[0] == "%%register_allowed_parameters"
-                    nbvalx.jupyter_magics.IPythonExtension.register_allowed_parameters(
-                        "", "\n".join(lines[1:]), allowed_parameters)
-                elif cell.source.startswith("__notebook_basename__"):
-                    lines = cell.source.splitlines()
-                    assert len(lines) == 2, (
-                        f"Use a standalone cell for __notebook_basename__ and __notebook_dirname__ in {file_}")
-                    assert lines[0].startswith("__notebook_basename__"), (
-                        f"__notebook_basename__ must be on the first line of the cell in {file_}")
-                    assert lines[1].startswith("__notebook_dirname__"), (
-                        f"__notebook_dirname__ must be on the second line of the cell in {file_}")
-
-                    _, hardcoded_notebook_name = lines[0].split("=")
-                    hardcoded_notebook_name = hardcoded_notebook_name.strip()
-                    assert hardcoded_notebook_name[0] in ('"', "'")
-                    assert hardcoded_notebook_name[-1] in ('"', "'")
-                    hardcoded_notebook_name = hardcoded_notebook_name[1:-1]
-                    assert hardcoded_notebook_name == file_.name, (
-                        f"Wrong attribute __notebook_basename__ for {file_}")
-
-                    _, hardcoded_notebook_path = lines[1].split("=")
-                    hardcoded_notebook_path = hardcoded_notebook_path.strip()
-                    assert hardcoded_notebook_path in ('""', "''")
-        # Condense tags and parameters in a common dictionary of the entries give to magic commands,
-        # where the key is a tuple formed by either "tag" or "parameter" and the tag/parameter name
-        allowed_magic_entries: dict[tuple[str, str], list[bool] | list[int] | list[str]] = {}
-        for (magic_entry_type, allowed_magic_entries_for_entry_type) in (
-            ("tag", allowed_tags), ("parameter", allowed_parameters)
+        link_pattern = _compile_glob_patterns(link_data_in_work_dir)
+        files_dirs = {file_.parent for file_ in files}
+        for source_path in index.source_entries():
+            if link_pattern.match(str(source_path)):
+                for file_dir in source_path.parents:
+                    if file_dir in files_dirs:
+                        linked_data[file_dir / work_dir].append(source_path)
+                        destination_path = file_dir / work_dir / source_path.relative_to(file_dir)
+                        if not xdist_worker and not destination_path.exists():
+                            destination_path.parent.mkdir(parents=True, exist_ok=True)
+                            destination_path.symlink_to(source_path)
+    # Process each notebook, unless the notebooks generated by a previous run are still up to date
+    generation_start = time.perf_counter()
+    files_to_generate = [file_ for file_ in files if file_ not in up_to_date_files and not xdist_worker]
+    if generate_workers > 1 and len(files_to_generate) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(generate_workers, len(files_to_generate))
+        ) as executor:
+            nb_copies_paths = list(executor.map(
+                _generate_and_write_notebook_copies, files_to_generate, itertools.repeat(options)))
+    else:
+        nb_copies_paths = [_generate_and_write_notebook_copies(file_, options) for file_ in files_to_generate]
+    # Record the generated notebooks in the manifest
+    if work_dir != ".":
+        for (file_, nb_copies_paths_file) in zip(files_to_generate, nb_copies_paths):
+            manifest_path = file_.parent / work_dir / _GENERATION_MANIFEST
+            new_manifests[manifest_path][file_.name] = _generation_manifest_entry(
+                generation_keys[file_], nb_copies_paths_file, options)
+    for (manifest_path, manifest) in new_manifests.items():
+        _write_generation_manifest(manifest_path, manifest)
+    generation_duration = time.perf_counter() - generation_start
+    # If the work directory is hidden, patch default norecursepatterns so that the files
+    # we created will not get ignored
+    if work_dir.startswith("."):
+        norecursepatterns = session.config.getini("norecursedirs")
+        assert ".*" in norecursepatterns
+        norecursepatterns.remove(".*")
+    # Combine the coverage data written by every notebook when the session ends, after every kernel has been
+    # stopped (config cleanups are run in reverse order). When running with pytest-xdist, the controller combines
+    # the data written by notebooks on every worker
+    if coverage_source != "" and ipynb_action != "create-notebooks" and not xdist_worker:
+        session.config.add_cleanup(functools.partial(_combine_coverage_data, options.coverage_data_file))
+    # Start an ipyparallel cluster for the whole session, if requested. Notebooks will find out the cluster
+    # identifier from an environment variable, which is inherited by the kernels
+    if np > 1 and cluster_pool and run_notebooks:
+        import ipyparallel
+
+        cluster = ipyparallel.Cluster(engines="MPI", profile="mpi", n=np, cluster_id=f"nbvalx-{os.getpid()}")
+        cluster.start_cluster_sync()
+        session.config.add_cleanup(cluster.stop_cluster_sync)
+        os.environ[_CLUSTER_POOL_ENVIRONMENT_VARIABLE] = cluster.cluster_id
+    # Start a kernel pool, if requested
+    if kernel_pool > 0 and run_notebooks:
+        session.config.stash[_kernel_pool_key] = _KernelPool(
+            kernel_pool, session.config.option.nbval_kernel_startup_timeout,
+            session.config.option.kernel_pool_preload, kernel_pool_policy)
+        session.config.add_cleanup(session.config.stash[_kernel_pool_key].shutdown)
+    # Start a variant scheduler, if requested. The scheduler must be shut down before the kernel pool
+    # (config cleanups are run in reverse order), since it may need to give kernels back to the pool
+    if variant_workers > 1 and run_notebooks:
+        session.config.stash[_variant_scheduler_key] = _VariantScheduler(variant_workers)
+        session.config.add_cleanup(session.config.stash[_variant_scheduler_key].shutdown)
+    # Start a prefix sharing runner, if requested
+    if prefix_sharing and run_notebooks:
+        session.config.stash[_prefix_sharing_runner_key] = _PrefixSharingRunner()
+        session.config.add_cleanup(session.config.stash[_prefix_sharing_runner_key].shutdown)
+    # Load the result cache, if requested. Notebooks in a work directory depend on the data linked there,
+    # and on the files matching the dependency patterns provided on the command line. When running with
+    # pytest-xdist, workers send the outcomes of their notebooks to the controller, which writes the cache files
+    if ipynb_cache != "off" and ipynb_action != "create-notebooks":
+        dependencies = sorted({
+            pathlib.Path(path).absolute() for pattern in session.config.option.ipynb_cache_dependency
+            for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)
+        })
+        session.config.stash[_result_cache_key] = _ResultCache(
+            np, ipynb_cache == "refresh",
+            {work_dir_path: [*data, *dependencies] for (work_dir_path, data) in linked_data.items()})
+        if not xdist_worker:
+            session.config.add_cleanup(session.config.stash[_result_cache_key].write)
+    # Record durations, and store the duration of each notebook in the pytest cache (if enabled) so that
+    # later runs can order notebooks by duration. When running with pytest-xdist, workers send the durations
+    # of their notebooks to the controller, which stores and reports them
+    if ipynb_action != "create-notebooks":
+        session.config.stash[_durations_report_key] = _DurationsReport(generation_duration)
+        cache = getattr(session.config, "cache", None)
+        if cache is not None and not xdist_worker:
+            session.config.add_cleanup(
+                functools.partial(session.config.stash[_durations_report_key].store, cache))
+        if ipynb_durations_report != "" and not xdist_worker:
+            session.config.add_cleanup(
+                functools.partial(session.config.stash[_durations_report_key].write, ipynb_durations_report))
+    # Select the notebooks impacted by the changed files, if requested. The selection is based on the coverage
+    # data stored by a previous run, before the coverage data of the current run is combined into it
+    if ipynb_impacted_by != "" and run_notebooks:
+        with open(ipynb_impacted_by) as f:
+            changed_files = [pathlib.Path(line.strip()) for line in f if line.strip() != ""]
+        session.config.stash[_impact_selector_key] = _ImpactSelector(
+            options.coverage_data_file, changed_files, work_dir, session.config.rootpath)
+
+
+class _FileSystemIndex:
+    """
+    Index of the entries in the directories provided on the command line, built with a single walk.
+
+    Entries in the work directory are stored separately from the source entries. Jupyter checkpoints and
+    virtual documents are never visited, and neither are the siblings of the work directory (e.g., work
+    directories associated to a different number of processes).
+    """
+
+    _pruned_dirs_names = (".ipynb_checkpoints", ".virtual_documents")
+
+    def __init__(self, roots: typing.Iterable[pathlib.Path], work_dir: str) -> None:
+        self._work_dir_parts = pathlib.PurePath(work_dir).parts
+        self._source_entries: dict[pathlib.Path, list[tuple[pathlib.Path, bool]]] = dict()
+        self._work_dir_entries: dict[pathlib.Path, None] = dict()
+        for root in roots:
+            if root not in self._source_entries:
+                self._source_entries[root] = list()
+                self._walk(root, root, 0)
+
+    def _walk(self, root: pathlib.Path, dir_: pathlib.Path, work_dir_depth: int) -> None:
+        """Walk a directory, given the number of leading components of the work directory matched so far."""
+        with os.scandir(dir_) as iterator:
+            dir_entries = sorted(iterator, key=lambda dir_entry: dir_entry.name)
+        in_work_dir = len(self._work_dir_parts) > 0 and work_dir_depth == len(self._work_dir_parts)
+        for dir_entry in dir_entries:
+            path = dir_ / dir_entry.name
+            is_dir = dir_entry.is_dir(follow_symlinks=False)
+            if in_work_dir:
+                self._work_dir_entries[path] = None
+                if is_dir:
+                    self._walk(root, path, work_dir_depth)
+            elif is_dir:
+                if dir_entry.name in self._pruned_dirs_names:
+                    continue
+                elif len(self._work_dir_parts) > 0 and dir_entry.name == self._work_dir_parts[work_dir_depth]:
+                    self._walk(root, path, work_dir_depth + 1)
+                elif work_dir_depth == 0:
+                    self._source_entries[root].append((path, False))
+                    self._walk(root, path, work_dir_depth)
+            elif work_dir_depth == 0:
+                self._source_entries[root].append((path, dir_entry.is_file()))
+
+    def notebooks(self, root: pathlib.Path) -> list[pathlib.Path]:
+        """Return the notebooks in a directory, excluding the ones in the work directory."""
+        return [
+            path for (path, is_file) in self._source_entries[root] if is_file and path.name.endswith(".ipynb")]
+
+    def source_entries(self) -> typing.Iterable[pathlib.Path]:
+        """Return the entries outside of the work directory."""
+        return dict.fromkeys(
+            path for source_entries in self._source_entries.values() for (path, _) in source_entries).keys()
+
+    def work_dir_entries(self) -> typing.Iterable[pathlib.Path]:
+        """Return the entries in the work directory."""
+        return self._work_dir_entries.keys()
+
+
+def _compile_glob_patterns(patterns: list[str]) -> re.Pattern[str]:
+    """Compile glob patterns into a single regular expression, with the same semantics of fnmatch."""
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+_CLUSTER_POOL_ENVIRONMENT_VARIABLE = "NBVALX_CLUSTER_POOL_ID"
+
+
+def _is_xdist_worker(config: pytest.Config) -> bool:
+    """Check if the current process is a pytest-xdist worker."""
+    return hasattr(config, "workerinput")
+
+
+def _is_xdist_controller(config: pytest.Config) -> bool:
+    """Check if the current process is a pytest-xdist controller, which distributes tests to workers."""
+    return not _is_xdist_worker(config) and getattr(config.option, "dist", "no") != "no"
+
+
+class _GenerationOptions(typing.NamedTuple):
+    """Options which affect the content of the notebooks generated in the work directory."""
+
+    np: int
+    coverage_source: str
+    coverage_data_file: str
+    ipynb_action: str
+    collapse: bool
+    work_dir: str
+    keyword: str
+    rootpath: str
+    variant_strategy: str
+    variant_strength: int
+    variant_seed: int
+    dump_dependencies: bool
+    cluster_pool: bool
+    log_max_size: int
+    ipynb_profile: str
+    ipynb_memory: bool
+    ipynb_memory_budget: int
+
+
+class _KeywordMatcher:
+    """Match the keyword expression (-k option) against the names of the items collected from a notebook."""
+
+    def __init__(self, keyword: str, rootpath: pathlib.Path, num_cells: int) -> None:
+        self._expression = _pytest.mark.expression.Expression.compile(keyword) if keyword != "" else None
+        self._rootpath = rootpath
+        self._num_cells = num_cells
+
+    @staticmethod
+    def injected_cells(nb: nbformat.NotebookNode, options: _GenerationOptions) -> int:
+        """
+        Count the code cells that will be added to every copy of the notebook in addition to the original ones.
+
+        The count must match the cells added by _generate_notebook_copies, i.e. the live log, coverage start/stop,
+        cluster start/stop and ipyparallel xfail cells.
+        """
+        injected_cells = 0
+        if options.ipynb_action != "create-notebooks":
+            injected_cells += 1
+            if options.coverage_source != "":
+                injected_cells += 2
+        if options.np > 1:
+            uses_ipyparallel = any(cell.cell_type == "code" and "%%px" in cell.source for cell in nb.cells)
+            if not uses_ipyparallel or options.collapse:
+                # Collapsing may drop every cell using ipyparallel, in which case cluster cells are added:
+                # counting them is safe, since considering more cells never removes a notebook to be kept
+                injected_cells += 2
+            elif options.ipynb_action != "create-notebooks":
+                injected_cells += 1
+        return injected_cells
+
+    def __call__(self, nb_copy_path: pathlib.Path) -> bool:
+        """Determine if at least one cell of the notebook would be selected by the keyword expression."""
+        if self._expression is None:
+            return True
+        # Names are the same as the ones pytest would assign to the collected items, i.e. the directories
+        # below the root directory, the notebook and the cell
+        nb_copy_path = pathlib.Path(os.path.normpath(nb_copy_path))
+        try:
+            dir_names = nb_copy_path.parent.relative_to(self._rootpath).parts
+        except ValueError:  # pragma: no cover
+            dir_names = nb_copy_path.parent.parts[1:]
+        names = [*dir_names, nb_copy_path.name]
+        # Evaluate the expression on all cells, since the actual number of cells is only known after the
+        # notebook has been generated: considering more cells than the actual ones may keep a notebook
+        # whose cells will all be deselected by pytest, but will never remove a notebook that should be kept
+        return any(
+            self._expression.evaluate(functools.partial(self._match, (*names, f"Cell {cell_num}")))
+            for cell_num in range(self._num_cells)
+        )
+
+    @staticmethod
+    def _match(names: tuple[str, ...], subname: str, /, **kwargs: str | int | bool | None) -> bool:
+        """Match a name in the keyword expression with the same rules as pytest."""
+        if kwargs:  # pragma: no cover
+            raise pytest.UsageError("Keyword expressions do not support call parameters.")
+        subname = subname.lower()
+        return any(subname in name.lower() for name in names)
+
+
+def _select_variants(
+    values: list[list[bool] | list[int] | list[str]], options: _GenerationOptions
+) -> list[tuple[bool | int | str, ...]]:
+    """Select the combinations of tags and parameters values to be tested, according to the variant strategy."""
+    sizes = [len(values_) for values_ in values]
+    if options.variant_strategy == "full":
+        indices = list(itertools.product(*(range(size) for size in sizes)))
+    elif options.variant_strategy == "pairwise":
+        indices = _covering_array(sizes, options.variant_strength)
+    else:
+        assert options.variant_strategy.startswith("random:")
+        indices = _random_sample(sizes, int(options.variant_strategy[len("random:"):]), options.variant_seed)
+    return [tuple(values_[index] for (values_, index) in zip(values, indices_)) for indices_ in indices]
+
+
+def _covering_array(sizes: list[int], strength: int) -> list[tuple[int, ...]]:
+    """Greedily build a covering array of value indices, i.e. rows containing every combination of strength values."""
+    strength = min(strength, len(sizes))
+    uncovered = {
+        (columns, entries) for columns in itertools.combinations(range(len(sizes)), strength)
+        for entries in itertools.product(*(range(sizes[column]) for column in columns))
+    }
+
+    def count_uncovered(row: dict[int, int], column: int) -> int:
+        """Count the uncovered interactions which would be covered by the assignment of column in the row."""
+        other_columns = sorted(other_column for other_column in row.keys() if other_column != column)
+        count = 0
+        for columns_but_one in itertools.combinations(other_columns, strength - 1):
+            columns = tuple(sorted((*columns_but_one, column)))
+            if (columns, tuple(row[column_] for column_ in columns)) in uncovered:
+                count += 1
+        return count
+
+    rows = set()
+    while len(uncovered) > 0:
+        # Start from the first uncovered interaction, and then assign the remaining columns one at a time
+        # with the value that covers the largest number of uncovered interactions
+        (columns, entries) = min(uncovered)
+        row = dict(zip(columns, entries))
+        for column in range(len(sizes)):
+            if column not in row:
+                row[column] = max(
+                    range(sizes[column]), key=lambda value: (count_uncovered({**row, column: value}, column), -value))
+        rows.add(tuple(row[column] for column in range(len(sizes))))
+        for columns in itertools.combinations(range(len(sizes)), strength):
+            uncovered.discard((columns, tuple(row[column] for column in columns)))
+    return sorted(rows)
+
+
+def _random_sample(sizes: list[int], samples: int, seed: int) -> list[tuple[int, ...]]:
+    """Sample rows of value indices from the full product without replacement, sorted as in the full product."""
+    total = 1
+    for size in sizes:
+        total *= size
+    rows = list()
+    for flat_index in sorted(random.Random(seed).sample(range(total), min(samples, total))):
+        row = list()
+        for size in reversed(sizes):
+            (flat_index, index) = divmod(flat_index, size)
+            row.append(index)
+        rows.append(tuple(reversed(row)))
+    return rows
+
+
+def _generate_notebook_copies(
+    file_: pathlib.Path, options: _GenerationOptions
+) -> tuple[dict[pathlib.Path, nbformat.NotebookNode], dict[str, typing.Any] | None]:
+    """Generate a copy of the notebook for every combination of tags and parameters, and its dependency table."""
+    np = options.np
+    coverage_source = options.coverage_source
+    ipynb_action = options.ipynb_action
+    collapse = options.collapse
+    work_dir = options.work_dir
+    # Read in notebook
+    with open(file_) as f:
+        nb = nbformat.read(f, as_version=4)  # type: ignore[no-untyped-call]
+    # Prepare keyword matching, so that notebooks which would be deselected are never created
+    keyword_matcher = _KeywordMatcher(
+        options.keyword, pathlib.Path(options.rootpath),
+        sum(cell.cell_type == "code" for cell in nb.cells) + _KeywordMatcher.injected_cells(nb, options))
+    # Determine if tags or parameters were used
+    load_ext_present = False
+    allowed_tags: dict[str, list[bool] | list[int] | list[str]] = {}
+    allowed_parameters: dict[str, list[bool] | list[int] | list[str]] = {}
+    for cell in nb.cells:
+        if cell.cell_type == "code":
+            if cell.source.startswith("%load_ext nbvalx"):
+                load_ext_present = True
+                assert len(cell.source.splitlines()) == 1, "Use a standalone cell for %load_ext nbvalx"
+            elif cell.source.startswith("%%register_allowed_run_if_tags"):
+                assert load_ext_present
+                lines = cell.source.splitlines()
+                assert lines[0] == "%%register_allowed_run_if_tags"
+                nbvalx.jupyter_magics.IPythonExtension.register_allowed_run_if_tags(
+                    "", "\n".join(lines[1:]), allowed_tags)
+            elif cell.source.startswith("%%register_allowed_parameters"):
+                assert load_ext_present
+                lines = cell.source.splitlines()
+                assert lines[0] == "%%register_allowed_parameters"
+                nbvalx.jupyter_magics.IPythonExtension.register_allowed_parameters(
+                    "", "\n".join(lines[1:]), allowed_parameters)
+            elif cell.source.startswith("__notebook_basename__"):
+                lines = cell.source.splitlines()
+                assert len(lines) == 2, (
+                    f"Use a standalone cell for __notebook_basename__ and __notebook_dirname__ in {file_}")
+                assert lines[0].startswith("__notebook_basename__"), (
+                    f"__notebook_basename__ must be on the first line of the cell in {file_}")
+                assert lines[1].startswith("__notebook_dirname__"), (
+                    f"__notebook_dirname__ must be on the second line of the cell in {file_}")
+
+                _, hardcoded_notebook_name = lines[0].split("=")
+                hardcoded_notebook_name = hardcoded_notebook_name.strip()
+                assert hardcoded_notebook_name[0] in ('"', "'")
+                assert hardcoded_notebook_name[-1] in ('"', "'")
+                hardcoded_notebook_name = hardcoded_notebook_name[1:-1]
+                assert hardcoded_notebook_name == file_.name, (
+                    f"Wrong attribute __notebook_basename__ for {file_}")
+
+                _, hardcoded_notebook_path = lines[1].split("=")
+                hardcoded_notebook_path = hardcoded_notebook_path.strip()
+                assert hardcoded_notebook_path in ('""', "''")
+    # Condense tags and parameters in a common dictionary of the entries give to magic commands,
+    # where the key is a tuple formed by either "tag" or "parameter" and the tag/parameter name
+    allowed_magic_entries: dict[tuple[str, str], list[bool] | list[int] | list[str]] = {}
+    for (magic_entry_type, allowed_magic_entries_for_entry_type) in (
+        ("tag", allowed_tags), ("parameter", allowed_parameters)
+    ):
+        for magic_entry_name, magic_entry_values in allowed_magic_entries_for_entry_type.items():
+            allowed_magic_entries[(magic_entry_type, magic_entry_name)] = magic_entry_values
+    # Analyze which tags and parameters every cell depends on, if requested or if any cell caches its variables
+    cache_marker = nbvalx.jupyter_magics.IPythonExtension.cache_marker
+    cache_variables = load_ext_present and any(
+        cell.cell_type == "code" and cache_marker in cell.source for cell in nb.cells)
+    if options.dump_dependencies or cache_variables:
+        cells_dependencies = nbvalx.dependencies.analyze_dependencies(
+            nb.cells, allowed_tags.keys(), allowed_parameters.keys())
+    if options.dump_dependencies:
+        dependencies: dict[str, typing.Any] | None = {
+            "tags": allowed_tags, "parameters": allowed_parameters,
+            "cells": [cell_dependencies._asdict() for cell_dependencies in cells_dependencies]
+        }
+    else:
+        dependencies = None
+    # Record the tags and parameters which cells caching their variables depend on, so that the cached
+    # variables are shared among all combinations of the other tags and parameters
+    if cache_variables:
+        for (cell_index, cell) in enumerate(nb.cells):
+            if cell.cell_type == "code" and cache_marker in cell.source:
+                lines = cell.source.splitlines()
+                for (line_index, line) in enumerate(lines):
+                    if line.startswith(cache_marker):
+                        if "(depends on:" not in line:
+                            lines[line_index] = line.rstrip() + " (depends on: " + ", ".join(
+                                cells_dependencies[cell_index].dependencies) + ")"
+                            nb.cells[cell_index] = _copy_cell(cell, "\n".join(lines))
+                        break
+    del allowed_tags
+    del allowed_parameters
+    # Determine all possible magic entries combinations
+    allowed_magic_entries_keys = list(allowed_magic_entries.keys())
+    if len(allowed_magic_entries_keys) > 0:
+        allowed_magic_entries_values_product = _select_variants(list(allowed_magic_entries.values()), options)
+        allowed_magic_entries_dict_product = [
+            {
+                magic_entry_name: magic_entry_value
+                for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
+                    allowed_magic_entries_keys, magic_entry_values
+                )
+            } for magic_entry_values in allowed_magic_entries_values_product
+        ]
+        allowed_magic_entries_keyword = [
+            ",".join(
+                f"{magic_entry_name}={magic_entry_value}"
+                for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
+                    allowed_magic_entries_keys, magic_entry_values)
+                )
+            for magic_entry_values in allowed_magic_entries_values_product
+        ]
+    else:
+        allowed_magic_entries_values_product = []
+        allowed_magic_entries_dict_product = []
+        allowed_magic_entries_keyword = []
+    assert len(allowed_magic_entries_values_product) == len(allowed_magic_entries_keyword)
+    # Create temporary copies for each magic entry to be processed
+    nb_copies = dict()
+    if load_ext_present and len(allowed_magic_entries_keyword) > 0:
+        selected_magic_entries = list()
+        for (magic_entry_values, magic_entry_dict, magic_entry_keyword) in zip(  # type: ignore[assignment]
+            allowed_magic_entries_values_product, allowed_magic_entries_dict_product,
+            allowed_magic_entries_keyword
         ):
-            for magic_entry_name, magic_entry_values in allowed_magic_entries_for_entry_type.items():
-                allowed_magic_entries[(magic_entry_type, magic_entry_name)] = magic_entry_values
-        del allowed_tags
-        del allowed_parameters
-        # Determine all possible magic entries combinations
-        allowed_magic_entries_keys = list(allowed_magic_entries.keys())
-        if len(allowed_magic_entries_keys) > 0:
-            allowed_magic_entries_values_product = list(itertools.product(*allowed_magic_entries.values()))
-            allowed_magic_entries_dict_product = [
-                {
-                    magic_entry_name: magic_entry_value
-                    for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
-                        allowed_magic_entries_keys, magic_entry_values
-                    )
-                } for magic_entry_values in allowed_magic_entries_values_product
-            ]
-            allowed_magic_entries_keyword = [
-                ",".join(
-                    f"{magic_entry_name}={magic_entry_value}"
-                    for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
-                        allowed_magic_entries_keys, magic_entry_values)
-                    )
-                for magic_entry_values in allowed_magic_entries_values_product
-            ]
-        else:
-            allowed_magic_entries_values_product = []
-            allowed_magic_entries_dict_product = []
-            allowed_magic_entries_keyword = []
-        assert len(allowed_magic_entries_values_product) == len(allowed_magic_entries_keyword)
-        # Create temporary copies for each magic entry to be processed
-        nb_copies = dict()
-        if load_ext_present and len(allowed_magic_entries_keyword) > 0:
-            # Process restricted magic entries
-            for (magic_entry_values, magic_entry_dict, magic_entry_keyword) in zip(  # type: ignore[assignment]
-                allowed_magic_entries_values_product, allowed_magic_entries_dict_product,
-                allowed_magic_entries_keyword
-            ):
-                # Restrict magic entries to match keyword
-                if keyword != "":  # pragma: no cover
-                    if not any(keyword in magic_entry_keword for magic_entry_keword in allowed_magic_entries_keyword):
-                        continue
-                # Determine what will be the new notebook path
-                nb_copy_path = file_.parent / work_dir / file_.name.replace(".ipynb", f"[{magic_entry_keyword}].ipynb")
-                # Replace magic entry and, if collapsing notebooks, strip cells with values different from the current
-                cells_magic_entry = list()
-                for cell in nb.cells:
-                    cell_magic_entry = copy.deepcopy(cell)
-
-                    def store_and_append(source: str) -> None:
-                        """Store source in the cell and append it to the notebook."""
-                        cell_magic_entry.source = source
-                        cells_magic_entry.append(cell_magic_entry)
-
-                    if cell.cell_type == "code":
-                        if (
-                            cell.source.startswith("%load_ext nbvalx")
-                            or cell.source.startswith("%%register_allowed_run_if_tags")
-                            or cell.source.startswith("%%register_allowed_parameters")
-                        ):
-                            if not collapse:
-                                cells_magic_entry.append(cell_magic_entry)
-                        elif cell.source.startswith("%%register_current_run_if_tags"):
-                            if not collapse:
-                                lines = ["%%register_current_run_if_tags"]
-                                for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
-                                    allowed_magic_entries_keys, magic_entry_values
-                                ):
-                                    if magic_entry_type == "tag":
-                                        lines.append(f"{magic_entry_name} = {magic_entry_value!r}")
-                                store_and_append("\n".join(lines))
-                        elif cell.source.startswith("%%register_current_parameters"):
-                            if not collapse:
-                                lines = ["%%register_current_parameters"]
-                            else:
-                                lines = []
+            # Determine what will be the new notebook path
+            nb_copy_path = file_.parent / work_dir / file_.name.replace(".ipynb", f"[{magic_entry_keyword}].ipynb")
+            # Restrict magic entries to match keyword
+            if keyword_matcher(nb_copy_path):
+                selected_magic_entries.append((magic_entry_values, magic_entry_dict, nb_copy_path))
+        # If collapsing notebooks, evaluate the run_if and keep_if conditions of every cell for all
+        # selected magic entries at once. Cells with a condition are stripped of it only once, and the resulting
+        # cell is shared among all notebooks where the condition evaluates to True
+        collapsed_cells: dict[int, tuple[nbformat.NotebookNode, list[bool]]] = dict()
+        if collapse:
+            for (cell_index, cell) in enumerate(nb.cells):
+                condition_and_code = nbvalx.dependencies.split_condition(cell)
+                if condition_and_code is None:
+                    continue
+                (condition, code) = condition_and_code
+                collapsed_cells[cell_index] = (
+                    _copy_cell(cell, code),
+                    nbvalx.jupyter_magics.IPythonExtension.evaluate_condition(
+                        condition, [magic_entry_dict for (_, magic_entry_dict, _) in selected_magic_entries]))
+        # Process restricted magic entries
+        for (selected_index, (magic_entry_values, _, nb_copy_path)) in enumerate(
+            selected_magic_entries
+        ):
+            # Replace magic entry and, if collapsing notebooks, strip cells with values different from the current.
+            # Cells are shared with the original notebook, and only cells whose source changes are copied
+            cells_magic_entry = list()
+            for (cell_index, cell) in enumerate(nb.cells):
+                def store_and_append(source: str) -> None:
+                    """Store source in a copy of the cell and append it to the notebook."""
+                    cells_magic_entry.append(_copy_cell(cell, source))
+
+                if cell_index in collapsed_cells:
+                    (collapsed_cell, collapsed_cell_kept) = collapsed_cells[cell_index]
+                    if collapsed_cell_kept[selected_index]:
+                        cells_magic_entry.append(collapsed_cell)
+                elif cell.cell_type == "code":
+                    if (
+                        cell.source.startswith("%load_ext nbvalx")
+                        or cell.source.startswith("%%register_allowed_run_if_tags")
+                        or cell.source.startswith("%%register_allowed_parameters")
+                    ):
+                        if not collapse:
+                            cells_magic_entry.append(cell)
+                    elif cell.source.startswith("%%register_current_run_if_tags"):
+                        if not collapse:
+                            lines = ["%%register_current_run_if_tags"]
                             for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
                                 allowed_magic_entries_keys, magic_entry_values
                             ):
-                                if magic_entry_type == "parameter":
-                                    if isinstance(magic_entry_value, str):
-                                        # Prefer string representation with double quotes, and use
-                                        # json.dumps to handle escaping of inner quotes
-                                        lines.append(f"{magic_entry_name} = {json.dumps(magic_entry_value)}")
-                                    else:
-                                        lines.append(f"{magic_entry_name} = {magic_entry_value!r}")
+                                if magic_entry_type == "tag":
+                                    lines.append(f"{magic_entry_name} = {magic_entry_value!r}")
                             store_and_append("\n".join(lines))
-                        elif "%%run_if" in cell.source:
-                            if collapse:
-                                lines = cell.source.splitlines()
-                                magic_line_index_begin = 0
-                                while not lines[magic_line_index_begin].startswith("%%run_if"):
-                                    magic_line_index_begin += 1
-                                assert magic_line_index_begin < len(lines)
-                                line = lines[magic_line_index_begin]
-                                magic_line_index_end = magic_line_index_begin + 1
-                                while line.endswith("\\"):
-                                    line = line.strip("\\") + lines[magic_line_index_end].strip()
-                                    magic_line_index_end += 1
-                                assert magic_line_index_end < len(lines)
-                                magic = line.replace("%%run_if", "")
-                                for magic_line_index in range(
-                                        magic_line_index_end - 1, magic_line_index_begin - 1, - 1):
-                                    lines.remove(lines[magic_line_index])
-                                code = "\n".join(lines)
-                                nbvalx.jupyter_magics.IPythonExtension.run_if(
-                                    magic, code, magic_entry_dict, store_and_append)  # type: ignore[arg-type]
-                            else:
-                                cells_magic_entry.append(cell_magic_entry)
+                    elif cell.source.startswith("%%register_current_parameters"):
+                        if not collapse:
+                            lines = ["%%register_current_parameters"]
                         else:
-                            cells_magic_entry.append(cell_magic_entry)
-                    elif cell.cell_type == "markdown":
-                        if "<!-- keep_if" in cell.source:
-                            if collapse:
-                                lines = cell.source.splitlines()
-                                comment_line_index_begin = 0
-                                while not lines[comment_line_index_begin].startswith("<!--"):
-                                    comment_line_index_begin += 1
-                                assert comment_line_index_begin < len(lines)
-                                line = lines[comment_line_index_begin]
-                                comment_line_index_end = comment_line_index_begin + 1
-                                while not line.endswith("-->"):
-                                    line = line + lines[comment_line_index_end].strip()
-                                    comment_line_index_end += 1
-                                assert comment_line_index_end <= len(lines)
-                                comment = line.replace("<!-- keep_if", "").replace("-->", "")
-                                for comment_line_index in range(
-                                        comment_line_index_end - 1, comment_line_index_begin - 1, - 1):
-                                    lines.remove(lines[comment_line_index])
-                                text = "\n".join(lines)
-                                nbvalx.jupyter_magics.IPythonExtension.run_if(
-                                    comment, text, magic_entry_dict, store_and_append)  # type: ignore[arg-type]
-                            else:
-                                cells_magic_entry.append(cell_magic_entry)
+                            lines = []
+                        for ((magic_entry_type, magic_entry_name), magic_entry_value) in zip(
+                            allowed_magic_entries_keys, magic_entry_values
+                        ):
+                            if magic_entry_type == "parameter":
+                                if isinstance(magic_entry_value, str):
+                                    # Prefer string representation with double quotes, and use
+                                    # json.dumps to handle escaping of inner quotes
+                                    lines.append(f"{magic_entry_name} = {json.dumps(magic_entry_value)}")
+                                else:
+                                    lines.append(f"{magic_entry_name} = {magic_entry_value!r}")
+                        store_and_append("\n".join(lines))
+                    else:
+                        cells_magic_entry.append(cell)
+                else:
+                    cells_magic_entry.append(cell)
+            # Attach cells to a shallow copy of the notebook
+            nb_copy = nbformat.NotebookNode(nb)  # type: ignore[no-untyped-call]
+            nb_copy.cells = cells_magic_entry
+            # Store notebook in dictionary
+            nb_copies[nb_copy_path] = nb_copy
+    else:
+        # Determine what will be the new notebook path
+        nb_copy_path = file_.parent / work_dir / file_.name
+        # Create a temporary copy only if it matches keyword
+        if keyword_matcher(nb_copy_path):
+            # Store notebook in dictionary
+            nb_copies[nb_copy_path] = nb
+    # Mark notebooks which became identical to another one after collapsing, so that only the first one
+    # is run and its outcome is reported for all of them. Content is compared before replacing the notebook
+    # name and adding any further cell, since such cells only differ by the notebook name
+    if collapse and ipynb_action != "create-notebooks":
+        nb_copies_by_content: dict[str, pathlib.Path] = dict()
+        nb_copies_aliases: dict[pathlib.Path, list[str]] = dict()
+        cells_content: dict[int, bytes] = dict()
+        for nb_copy_path in sorted(nb_copies.keys()):
+            nb_copy = nb_copies[nb_copy_path]
+            nb_copy_content = _notebook_content_hash(nb_copy, cells_content)
+            if nb_copy_content in nb_copies_by_content:
+                original_nb_copy_path = nb_copies_by_content[nb_copy_content]
+                nb_copies_aliases.setdefault(original_nb_copy_path, []).append(nb_copy_path.name)
+                _set_nbvalx_metadata(nb_copy, {"alias_of": original_nb_copy_path.name})
+            else:
+                nb_copies_by_content[nb_copy_content] = nb_copy_path
+        for (original_nb_copy_path, aliases) in nb_copies_aliases.items():
+            _set_nbvalx_metadata(nb_copies[original_nb_copy_path], {"aliases": aliases})
+    # Replace notebook name
+    for (nb_copy_path, nb_copy) in nb_copies.items():
+        for (cell_index, cell) in enumerate(nb_copy.cells):
+            if cell.cell_type == "code":
+                if cell.source.startswith("__notebook_basename__"):
+                    def wrap_if_long_line(key: str, value: str) -> str:
+                        """Wrap text if line is too long."""
+                        if len(value) < 60:
+                            return f'__notebook_{key}__ = "{value}"'
                         else:
-                            cells_magic_entry.append(cell_magic_entry)
-                    else:  # pragma: no cover
-                        cells_magic_entry.append(cell_magic_entry)
-                # Attach cells to a copy of the notebook
-                nb_copy = copy.deepcopy(nb)
-                nb_copy.cells = cells_magic_entry
-                # Store notebook in dictionary
-                nb_copies[nb_copy_path] = nb_copy
-        else:
-            # Create a temporary copy only if no keyword is provided, as notebooks with no magic entries
-            # would not match any non null keyword
-            if keyword == "":
-                # Determine what will be the new notebook path
-                nb_copy_path = file_.parent / work_dir / file_.name
-                # Store notebook in dictionary
-                nb_copies[nb_copy_path] = nb
-        # Replace notebook name
+                            wrapped_value = textwrap.wrap(value, 60)
+                            return "\n".join([
+                                f"__notebook_{key}__ = (",
+                                *[f'    "{wrapped_value_part}"' for wrapped_value_part in wrapped_value],
+                                ")"
+                            ])
+
+                    nb_copy.cells[cell_index] = _copy_cell(cell, "\n".join([
+                        wrap_if_long_line("basename", str(nb_copy_path.name)),
+                        wrap_if_long_line("dirname", str(nb_copy_path.parent))
+                    ]))
+    # Comment out xfail cells when only asked to create notebooks, so that the user
+    # who requested them can run all cells
+    if ipynb_action == "create-notebooks" and work_dir != ".":
         for (nb_copy_path, nb_copy) in nb_copies.items():
-            for cell in nb_copy.cells:
-                if cell.cell_type == "code":
-                    if cell.source.startswith("__notebook_basename__"):
-                        def wrap_if_long_line(key: str, value: str) -> str:
-                            """Wrap text if line is too long."""
-                            if len(value) < 60:
-                                return f'__notebook_{key}__ = "{value}"'
-                            else:
-                                wrapped_value = textwrap.wrap(value, 60)
-                                return "\n".join([
-                                    f"__notebook_{key}__ = (",
-                                    *[f'    "{wrapped_value_part}"' for wrapped_value_part in wrapped_value],
-                                    ")"
-                                ])
-
-                        cell.source = "\n".join([
-                            wrap_if_long_line("basename", str(nb_copy_path.name)),
-                            wrap_if_long_line("dirname", str(nb_copy_path.parent))
-                        ])
-        # Comment out xfail cells when only asked to create notebooks, so that the user
-        # who requested them can run all cells
-        if ipynb_action == "create-notebooks" and work_dir != ".":
             xfail_and_skip_next = False
-            for cell in nb_copy.cells:
+            for (cell_index, cell) in enumerate(nb_copy.cells):
                 if cell.cell_type == "code":
                     lines = cell.source.splitlines()
                     quotes = "'''" if '"""' in cell.source else '"""'
@@ -399,43 +963,57 @@ def sessionstart(session: pytest.Session) -> None:
                         assert xfail_code_index < len(lines)
                         lines.insert(xfail_code_index, quotes + "Expect this cell to fail.\n")
                         lines.append(quotes)
-                    cell.source = "\n".join(lines)
-        # If requested, add coverage testing when running notebooks through pytest
-        # Coverage is not added when only asked to create notebooks because:
-        # * the user who requested notebook creation may not want coverage testing to take place
-        # * the additional cell may interfere with linting
-        if coverage_source != "" and ipynb_action != "create-notebooks":
-            for (nb_copy_path, nb_copy) in nb_copies.items():
-                # Add a cell on top to start coverage collection
-                coverage_start_code = f"""import coverage
+                    if "\n".join(lines) != cell.source:
+                        nb_copy.cells[cell_index] = _copy_cell(cell, "\n".join(lines))
+    # If requested, add coverage testing when running notebooks through pytest
+    # Coverage is not added when only asked to create notebooks because:
+    # * the user who requested notebook creation may not want coverage testing to take place
+    # * the additional cell may interfere with linting
+    if coverage_source != "" and ipynb_action != "create-notebooks":
+        for (nb_copy_path, nb_copy) in nb_copies.items():
+            # Add a cell on top to start coverage collection. Every notebook (and every process) writes its own
+            # data file, which is combined with the others when the session ends
+            coverage_start_code = f"""import coverage
 
 cov = coverage.Coverage(
-    data_file="{os.path.join(os.getcwd(), os.environ.get("COVERAGE_FILE", ".coverage"))}",
-    data_suffix={np > 1}, source=["{coverage_source}"]
+    data_file="{options.coverage_data_file}",
+    data_suffix=True, source=["{coverage_source}"]
 )
-cov.load()
 cov.start()
+# Label the coverage data of every following cell with the generated notebook and the cell id
+live_log.coverage = cov
 """
-                coverage_start_cell = nbformat.v4.new_code_cell(coverage_start_code)  # type: ignore[no-untyped-call]
-                coverage_start_cell.id = "coverage_start"
-                nb_copy.cells.insert(0, coverage_start_cell)
-                # Add a cell at the end to stop coverage collection
-                coverage_stop_code = """cov.stop()
+            coverage_start_cell = nbformat.v4.new_code_cell(coverage_start_code)  # type: ignore[no-untyped-call]
+            coverage_start_cell.id = "coverage_start"
+            nb_copy.cells.insert(0, coverage_start_cell)
+            # Add a cell at the end to stop coverage collection
+            coverage_stop_code = """live_log.coverage = None
+cov.stop()
 cov.save()
 """
-                coverage_stop_cell = nbformat.v4.new_code_cell(coverage_stop_code)  # type: ignore[no-untyped-call]
-                coverage_stop_cell.id = "coverage_stop"
-                nb_copy.cells.append(coverage_stop_cell)
-        # Add live stdout redirection to file when running notebooks through pytest
-        # Such redirection is not added when only asked to create notebooks because:
-        # * the user who requested notebook creation may not want redirection to take place
-        # * the additional cell may interfere with linting
-        if ipynb_action != "create-notebooks":
-            for (nb_copy_path, nb_copy) in nb_copies.items():
-                # Add the live_log magic to every existing cell
-                _add_cell_magic(nb_copy, "%%live_log")
-                # Add a cell on top to define the live_log magic
-                live_log_magic_code = f'''import sys
+            coverage_stop_cell = nbformat.v4.new_code_cell(coverage_stop_code)  # type: ignore[no-untyped-call]
+            coverage_stop_cell.id = "coverage_stop"
+            nb_copy.cells.append(coverage_stop_cell)
+    # Add live stdout redirection to file when running notebooks through pytest
+    # Such redirection is not added when only asked to create notebooks because:
+    # * the user who requested notebook creation may not want redirection to take place
+    # * the additional cell may interfere with linting
+    if ipynb_action != "create-notebooks":
+        for (nb_copy_path, nb_copy) in nb_copies.items():
+            # Add the live_log magic to every existing cell. The magic is given the cell id, which identifies
+            # the profile and the memory usage of the cell
+            for (cell_index, cell) in enumerate(nb_copy.cells):
+                if cell.cell_type == "code":
+                    nb_copy.cells[cell_index] = _copy_cell(
+                        cell, f"%%live_log {cell.get('id', cell_index)}\n" + cell.source)
+            # Add a cell on top to define the live_log magic
+            live_log_magic_code = f'''import collections
+import cProfile
+import json
+import os
+import shutil
+import sys
+import tracemalloc
 import types
 import typing
 
@@ -454,15 +1032,39 @@ else:
 
 
 class LiveLogStream(typing.IO):
-    """A stream that redirects to both sys.stdout and file."""
+    """A stream that redirects to both sys.stdout and file, retaining only the tail once the file is too large."""
+
+    max_size = {options.log_max_size}
 
     def __init__(self, log_file: typing.IO) -> None:
-        self._targets = [sys.stdout, log_file]
+        self._stdout = sys.stdout
+        self._log_file = log_file
+        self._tail = collections.deque()
+        self._tail_size = 0
+        self._dropped_size = 0
+        # Keep track of the size of the log file, rather than querying it on every write
+        self._log_file.flush()
+        self._size = os.fstat(self._log_file.fileno()).st_size
 
     def write(self, string: typing.AnyStr) -> None:
         """Write string to all targets."""
-        for target in self._targets:
-            target.write(string)
+        self._stdout.write(string)
+        if self.max_size == 0 or self._size <= self.max_size:
+            self._log_file.write(string)
+            self._size += len(string)
+        else:
+            self._tail.append(string)
+            self._tail_size += len(string)
+            while len(self._tail) > 1 and self._tail_size - len(self._tail[0]) >= self.max_size // 2:
+                dropped = self._tail.popleft()
+                self._tail_size -= len(dropped)
+                self._dropped_size += len(dropped)
+
+    def write_tail(self) -> None:
+        """Write to file the tail which was retained once the file was too large."""
+        if self._dropped_size > 0:
+            print("[... " + str(self._dropped_size) + " characters dropped ...]", file=self._log_file)
+        self._log_file.write("".join(self._tail))
 
 
 class LiveLogRedirection:
@@ -476,8 +1078,6 @@ class LiveLogRedirection:
 
     def __enter__(self) -> None:
         """Replace sys.stdout with a LiveLogStream."""
-        # Setup the live log stream
-        self._new_stdout = LiveLogStream(self._log_file)
         # Print helper content to the live log stream
         print("===========================", file=self._log_file)
         print(file=self._log_file)
@@ -488,6 +1088,8 @@ class LiveLogRedirection:
             print("empty", file=self._log_file)
         print(file=self._log_file)
         print("Output (stdout):", file=self._log_file)
+        # Setup the live log stream, which accounts for the helper content in the size of the log file
+        self._new_stdout = LiveLogStream(self._log_file)
         # Override standard stdout
         self._old_stdout = sys.stdout
         sys.stdout = self._new_stdout
@@ -498,6 +1100,8 @@ class LiveLogRedirection:
         traceback: typing.Optional[types.TracebackType]
     ) -> None:
         """Restore sys.stdout to its original value."""
+        # Write the retained tail of the output, if the log file was too large
+        self._new_stdout.write_tail()
         # Print a final blank line to live log stream
         print(file=self._log_file)
         # Clean up the live log stream
@@ -507,9 +1111,117 @@ class LiveLogRedirection:
         self._old_stdout = None
 
 
+class LiveLogProfiler:
+    """A context manager that profiles a cell, and stores the profile in a file named after the cell id."""
+
+    kind = "{options.ipynb_profile}"
+    directory = "{str(nb_copy_path)[:-6]}.profile"  # noqa: E501
+    suffix = ""
+
+    def __init__(self, cell_id: str) -> None:
+        self._cell_id = cell_id
+        self._profile = None
+
+    def __enter__(self) -> None:
+        """Start profiling."""
+        if self.kind == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.kind == "tracemalloc":
+            tracemalloc.start()
+
+    def __exit__(
+        self, exception_type: typing.Optional[typing.Type[BaseException]],
+        exception_value: typing.Optional[BaseException],
+        traceback: typing.Optional[types.TracebackType]
+    ) -> None:
+        """Stop profiling, and store the profile."""
+        if self.kind == "off":
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        profile_filename = os.path.join(self.directory, self._cell_id + self.suffix)
+        if self.kind == "cprofile":
+            self._profile.disable()
+            self._profile.dump_stats(profile_filename + ".prof")
+            self._profile = None
+        elif self.kind == "tracemalloc":
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(profile_filename + ".tracemalloc")
+
+
+class LiveLogMemory:
+    """A context manager that records the peak and the change of the memory used by the process to run a cell."""
+
+    enabled = {options.ipynb_memory}
+    budget = {options.ipynb_memory_budget}
+    filename = "{str(nb_copy_path)[:-6]}.memory"  # noqa: E501
+
+    def __init__(self, log_file: typing.IO, cell_id: str) -> None:
+        self._log_file = log_file
+        self._cell_id = cell_id
+        self._rss = None
+        self._blocks = None
+
+    @staticmethod
+    def rss() -> typing.Tuple[typing.Optional[int], int]:
+        """Return the current (if available) and the peak resident set size of the process, in bytes."""
+        try:
+            with open("/proc/self/status") as status:
+                fields = dict(line.split(":", 1) for line in status if ":" in line)
+            return (int(fields["VmRSS"].split()[0]) * 1024, int(fields["VmHWM"].split()[0]) * 1024)
+        except (OSError, KeyError):
+            import resource
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return (None, peak_rss if sys.platform == "darwin" else peak_rss * 1024)
+
+    def __enter__(self) -> None:
+        """Reset the peak resident set size, where supported, and store the current memory usage."""
+        if not self.enabled:
+            return
+        try:
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+        except OSError:
+            pass
+        (self._rss, _) = self.rss()
+        self._blocks = sys.getallocatedblocks()
+
+    def __exit__(
+        self, exception_type: typing.Optional[typing.Type[BaseException]],
+        exception_value: typing.Optional[BaseException],
+        traceback: typing.Optional[types.TracebackType]
+    ) -> None:
+        """Write the memory usage to the log file and to the memory file, and enforce the budget."""
+        if not self.enabled:
+            return
+        (rss, peak_rss) = self.rss()
+        rss_change = rss - self._rss if rss is not None and self._rss is not None else None
+        blocks_change = sys.getallocatedblocks() - self._blocks
+        print(file=self._log_file)
+        print("Memory:", file=self._log_file)
+        print(
+            "peak RSS: %.1f MiB, RSS change: %s, Python allocated blocks change: %+d" % (
+                peak_rss / 2**20, "%+.1f MiB" % (rss_change / 2**20) if rss_change is not None else "unknown",
+                blocks_change),
+            file=self._log_file)
+        with open(self.filename, "a") as memory_file:
+            print(json.dumps(dict(
+                cell=self._cell_id, peak_rss=peak_rss, rss_change=rss_change, python_blocks_change=blocks_change
+            )), file=memory_file)
+        if self.budget > 0 and exception_type is None and peak_rss > self.budget * 2**20:
+            raise MemoryError(
+                "Peak RSS of %.1f MiB exceeds the memory budget of %d MiB" % (peak_rss / 2**20, self.budget))
+
+
 def live_log(line: str, cell: typing.Optional[str] = None) -> None:
     """Redirect notebook to log file."""
-    with LiveLogRedirection(live_log.__file__, cell):
+    if live_log.coverage is not None:
+        live_log.coverage.switch_context(live_log.coverage_context + line.strip())
+    with (
+        LiveLogRedirection(live_log.__file__, cell), LiveLogMemory(live_log.__file__, line.strip()),
+        LiveLogProfiler(line.strip())
+    ):
         result = IPython.get_ipython().run_cell(cell)
         try:
             result.raise_error()
@@ -520,69 +1232,329 @@ def live_log(line: str, cell: typing.Optional[str] = None) -> None:
 
 
 live_log_filename = "{str(nb_copy_path)[:-6]}" + live_log_suffix  # noqa: E501
+LiveLogProfiler.suffix = live_log_suffix[len(".log"):]
+LiveLogMemory.filename += live_log_suffix[len(".log"):]
 del live_log_suffix
 open(live_log_filename, "w").close()
+if LiveLogProfiler.kind != "off":
+    shutil.rmtree(LiveLogProfiler.directory, ignore_errors=True)
+if LiveLogMemory.enabled:
+    open(LiveLogMemory.filename, "w").close()
 live_log.__file__ = open(live_log_filename, "a", buffering=1)
 del live_log_filename
+live_log.coverage = None
+live_log.coverage_context = os.path.relpath("{nb_copy_path!s}", "{options.rootpath}") + "::"  # noqa: E501
 
 IPython.get_ipython().register_magic_function(live_log, "cell")
 IPython.get_ipython().set_custom_exc(
     (nbvalx.jupyter_magics.IPythonExtension.SuppressTracebackMockError, ),
     nbvalx.jupyter_magics.IPythonExtension.suppress_traceback_handler)'''
-                live_log_magic_cell = nbformat.v4.new_code_cell(live_log_magic_code)  # type: ignore[no-untyped-call]
-                live_log_magic_cell.id = "live_log_magic"
-                nb_copy.cells.insert(0, live_log_magic_cell)
-        # Add parallel support
-        if np > 1:
-            for (nb_copy_path, nb_copy) in nb_copies.items():
-                # Determine if notebook was already using ipyparallel
-                uses_ipyparallel = False
-                for cell in nb_copy.cells:
-                    if cell.cell_type == "code" and "%%px" in cell.source:
-                        uses_ipyparallel = True
-                        break
-                if not uses_ipyparallel:
-                    # Add the px magic to every existing cell
-                    _add_cell_magic(nb_copy, "%%px --no-stream" if ipynb_action != "create-notebooks" else "%%px")
+            live_log_magic_cell = nbformat.v4.new_code_cell(live_log_magic_code)  # type: ignore[no-untyped-call]
+            live_log_magic_cell.id = "live_log_magic"
+            nb_copy.cells.insert(0, live_log_magic_cell)
+    # Add parallel support
+    if np > 1:
+        for (nb_copy_path, nb_copy) in nb_copies.items():
+            # Determine if notebook was already using ipyparallel
+            uses_ipyparallel = False
+            for cell in nb_copy.cells:
+                if cell.cell_type == "code" and "%%px" in cell.source:
+                    uses_ipyparallel = True
+                    break
+            if not uses_ipyparallel:
+                # Add the px magic to every existing cell
+                _add_cell_magic(nb_copy, "%%px --no-stream" if ipynb_action != "create-notebooks" else "%%px")
+                if options.cluster_pool and ipynb_action != "create-notebooks":
+                    # Add a cell on top to connect to the ipyparallel cluster started by sessionstart,
+                    # and move engines to the directory of the notebook. Engines were started before any test
+                    # was run, hence the current test is forwarded from the kernel environment
+                    cluster_start_code = f'''import os
+
+import ipyparallel as ipp
+
+cluster = ipp.Cluster.from_file(profile="mpi", cluster_id=os.environ["{_CLUSTER_POOL_ENVIRONMENT_VARIABLE}"])
+cluster_client = cluster.connect_client_sync()
+cluster_client.wait_for_engines({np}, block=True)
+cluster_client.activate()
+cluster_client[:].execute(f"""\\
+import os as _os
+import sys as _sys
+
+import IPython as _IPython
+
+_os.chdir({{os.getcwd()!r}})
+_os.environ["PYTEST_CURRENT_TEST"] = {{os.environ["PYTEST_CURRENT_TEST"]!r}}
+_sys.path.insert(0, _os.getcwd())
+_extensions = set(_IPython.get_ipython().extension_manager.loaded)""", block=True)'''
+                    # Add a cell at the end to reset the engines, without stopping the ipyparallel cluster
+                    cluster_stop_code = '''cluster_client[:].execute("""\\
+for _extension in set(_IPython.get_ipython().extension_manager.loaded) - _extensions:
+    _IPython.get_ipython().extension_manager.unload_extension(_extension)
+for _name in [
+    _name for (_name, _module) in _sys.modules.items()
+    if (getattr(_module, "__file__", None) or "").startswith(_os.getcwd() + _os.sep)
+]:
+    del _sys.modules[_name]
+_sys.path.remove(_os.getcwd())""", block=True)
+cluster_client.clear(block=True)
+cluster_client.close()'''
+                else:
                     # Add a cell on top to start a new ipyparallel cluster
                     cluster_start_code = f"""import ipyparallel as ipp
 
 cluster = ipp.Cluster(engines="MPI", profile="mpi", n={np})
 cluster.start_and_connect_sync()"""
-                    cluster_start_cell = nbformat.v4.new_code_cell(cluster_start_code)  # type: ignore[no-untyped-call]
-                    cluster_start_cell.id = "cluster_start"
-                    nb_copy.cells.insert(0, cluster_start_cell)
                     # Add a cell at the end to stop the ipyparallel cluster
                     cluster_stop_code = """cluster.stop_cluster_sync()"""
-                    cluster_stop_cell = nbformat.v4.new_code_cell(cluster_stop_code)  # type: ignore[no-untyped-call]
-                    cluster_stop_cell.id = "cluster_stop"
-                    nb_copy.cells.append(cluster_stop_cell)
-                elif ipynb_action != "create-notebooks":
-                    # Add a cell on top to skip the notebook altogether, as setting np > 1 makes no sense here
-                    xfail_uses_ipyparallel_code = """\
+                cluster_start_cell = nbformat.v4.new_code_cell(cluster_start_code)  # type: ignore[no-untyped-call]
+                cluster_start_cell.id = "cluster_start"
+                nb_copy.cells.insert(0, cluster_start_cell)
+                cluster_stop_cell = nbformat.v4.new_code_cell(cluster_stop_code)  # type: ignore[no-untyped-call]
+                cluster_stop_cell.id = "cluster_stop"
+                nb_copy.cells.append(cluster_stop_cell)
+            elif ipynb_action != "create-notebooks":
+                # Add a cell on top to skip the notebook altogether, as setting np > 1 makes no sense here
+                xfail_uses_ipyparallel_code = """\
 # PYTEST_XFAIL_IN_PARALLEL_AND_SKIP_NEXT: already uses ipyparallel
 assert False, 'This code already uses ipyparallel and hence testing it is skipped for np > 1'"""
-                    xfail_uses_ipyparallel_cell = nbformat.v4.new_code_cell(xfail_uses_ipyparallel_code)  # type: ignore[no-untyped-call]
-                    xfail_uses_ipyparallel_cell.id = "xfail_uses_ipyparallel"
-                    nb_copy.cells.insert(0, xfail_uses_ipyparallel_cell)
-        # Write modified notebooks to the work directory
-        for (nb_copy_path, nb_copy) in nb_copies.items():
-            nb_copy_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(nb_copy_path, "w") as f:
-                nbformat.write(nb_copy, f)  # type: ignore[no-untyped-call]
-    # If the work directory is hidden, patch default norecursepatterns so that the files
-    # we created will not get ignored
-    if work_dir.startswith("."):
-        norecursepatterns = session.config.getini("norecursedirs")
-        assert ".*" in norecursepatterns
-        norecursepatterns.remove(".*")
+                xfail_uses_ipyparallel_cell = nbformat.v4.new_code_cell(xfail_uses_ipyparallel_code)  # type: ignore[no-untyped-call]
+                xfail_uses_ipyparallel_cell.id = "xfail_uses_ipyparallel"
+                nb_copy.cells.insert(0, xfail_uses_ipyparallel_cell)
+    return (nb_copies, dependencies)
+
+
+_COVERAGE_FRAGMENTS_PER_WORKER = 8
+
+
+def _combine_coverage_data(data_file: str) -> None:
+    """
+    Combine the coverage data files written by every notebook, and by every process, into the coverage data file.
+
+    Data files are split among worker processes, each of which combines its share into an intermediate file,
+    and intermediate files are eventually combined into the coverage data file. Intermediate files left behind
+    by a previous session are combined first, since worker processes would overwrite them.
+    """
+    fragments = sorted(glob.glob(glob.escape(data_file) + ".*"))
+    leftovers = [
+        fragment for fragment in fragments if re.search(r"\.nbvalx\d+$", fragment[len(data_file):]) is not None]
+    if len(leftovers) > 0:
+        _combine_coverage_data_files(data_file, leftovers)
+        fragments = [fragment for fragment in fragments if fragment not in leftovers]
+    workers = min(os.cpu_count() or 1, len(fragments) // _COVERAGE_FRAGMENTS_PER_WORKER)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            fragments = list(executor.map(
+                _combine_coverage_data_files,
+                [f"{data_file}.nbvalx{worker}" for worker in range(workers)],
+                [fragments[worker::workers] for worker in range(workers)]))
+    if len(fragments) > 0:
+        _combine_coverage_data_files(data_file, fragments)
+
+
+def _combine_coverage_data_files(data_file: str, fragments: list[str]) -> str:
+    """Combine coverage data files into a data file, preserving its existing data, and remove them."""
+    import coverage
+
+    cov = coverage.Coverage(data_file=data_file)
+    cov.load()
+    cov.combine(fragments, keep=False)
+    cov.save()
+    return data_file
+
+
+def _generate_and_write_notebook_copies(file_: pathlib.Path, options: _GenerationOptions) -> list[pathlib.Path]:
+    """Generate the copies of a notebook, write them to the work directory and return the paths of all files."""
+    (nb_copies, dependencies) = _generate_notebook_copies(file_, options)
+    for (nb_copy_path, nb_copy) in nb_copies.items():
+        nb_copy_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(nb_copy_path, "w") as f:
+            nbformat.write(nb_copy, f)  # type: ignore[no-untyped-call]
+    generated_paths = list(nb_copies.keys())
+    if dependencies is not None:
+        dependencies_path = file_.parent / options.work_dir / file_.name.replace(".ipynb", ".dependencies.json")
+        dependencies_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(dependencies_path, "w") as f:
+            json.dump(dependencies, f, indent=1)
+        generated_paths.append(dependencies_path)
+    return generated_paths
+
+
+_GENERATION_MANIFEST = ".nbvalx_manifest.json"
+
+
+@functools.cache
+def _generator_fingerprint() -> bytes:
+    """Hash the source code of the modules involved in the generation of notebooks."""
+    hasher = hashlib.sha256()
+    for module in (sys.modules[__name__], nbvalx.jupyter_magics):
+        assert module.__file__ is not None
+        hasher.update(pathlib.Path(module.__file__).read_bytes())
+    return hasher.digest()
+
+
+def _generation_key(file_: pathlib.Path, options: _GenerationOptions) -> str:
+    """Hash the notebook content, the generation options and the generator itself."""
+    hasher = hashlib.sha256()
+    hasher.update(_generator_fingerprint())
+    hasher.update(json.dumps([str(file_.absolute()), *options]).encode())
+    hasher.update(file_.read_bytes())
+    return hasher.hexdigest()
+
+
+def _read_generation_manifest(manifest_path: pathlib.Path) -> dict[str, typing.Any]:
+    """Read the manifest of the notebooks generated in a work directory by a previous run."""
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    else:
+        if not isinstance(manifest, dict):  # pragma: no cover
+            return dict()
+        return manifest
+
+
+def _write_generation_manifest(manifest_path: pathlib.Path, manifest: dict[str, typing.Any]) -> None:
+    """Write the manifest of the notebooks generated in a work directory."""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def _generation_manifest_entry(
+    key: str, nb_copies_paths: typing.Iterable[pathlib.Path], options: _GenerationOptions
+) -> dict[str, typing.Any]:
+    """Store the generation key, the variant selection and the size and modification time of every notebook."""
+    notebooks = dict()
+    for nb_copy_path in nb_copies_paths:
+        stat = nb_copy_path.stat()
+        notebooks[nb_copy_path.name] = [stat.st_size, stat.st_mtime_ns]
+    variants = {
+        "strategy": options.variant_strategy, "strength": options.variant_strength, "seed": options.variant_seed}
+    return {"key": key, "notebooks": notebooks, "variants": variants}
+
+
+def _is_generation_manifest_entry_up_to_date(
+    manifest_entry: dict[str, typing.Any] | None, key: str, work_dir_path: pathlib.Path
+) -> bool:
+    """Check that the key matches, and that generated notebooks were neither removed nor modified."""
+    if manifest_entry is None or manifest_entry.get("key") != key:
+        return False
+    for (nb_copy_name, (size, mtime_ns)) in manifest_entry["notebooks"].items():
+        try:
+            stat = (work_dir_path / nb_copy_name).stat()
+        except OSError:
+            return False
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            return False
+    return True
+
+
+def _copy_cell(cell: nbformat.NotebookNode, source: str) -> nbformat.NotebookNode:
+    """Copy the cell with a new source, sharing every other attribute with the original cell."""
+    cell_copy = nbformat.NotebookNode(cell)  # type: ignore[no-untyped-call]
+    cell_copy.source = source
+    return cell_copy
+
+
+def _notebook_content_hash(nb: nbformat.NotebookNode, cells_content: dict[int, bytes]) -> str:
+    """Hash the content of a notebook, hashing only once the cells which are shared with other notebooks."""
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({key: value for (key, value) in nb.items() if key != "cells"}, sort_keys=True).encode())
+    for cell in nb.cells:
+        if id(cell) not in cells_content:
+            cells_content[id(cell)] = hashlib.sha256(json.dumps(cell, sort_keys=True).encode()).digest()
+        hasher.update(cells_content[id(cell)])
+    return hasher.hexdigest()
+
+
+def _set_nbvalx_metadata(nb: nbformat.NotebookNode, nbvalx_metadata: dict[str, typing.Any]) -> None:
+    """Store nbvalx metadata in a copy of the notebook metadata, which may be shared with other notebooks."""
+    nb.metadata = nbformat.NotebookNode({**nb.metadata, "nbvalx": nbvalx_metadata})  # type: ignore[no-untyped-call]
 
 
 def _add_cell_magic(nb: nbformat.NotebookNode, additional_cell_magic: str) -> None:
     """Add the cell magic to every cell of the notebook."""
-    for cell in nb.cells:
+    for (cell_index, cell) in enumerate(nb.cells):
         if cell.cell_type == "code":
-            cell.source = additional_cell_magic + "\n" + cell.source
+            nb.cells[cell_index] = _copy_cell(cell, additional_cell_magic + "\n" + cell.source)
+
+
+def _truncate_text(text: str, max_size: int) -> str:
+    """Retain the beginning and the end of a text larger than the maximum size, dropping the part in between."""
+    if len(text) <= max_size:
+        return text
+    head = text[:max_size // 2]
+    tail = text[len(text) - max_size // 2:]
+    # Cut at line boundaries, unless lines are so long that most of the retained text would be lost
+    head_end = head.rfind("\n") + 1
+    if head_end >= len(head) // 2:
+        head = head[:head_end]
+    tail_begin = tail.find("\n") + 1
+    if 0 < tail_begin <= len(tail) // 2:
+        tail = tail[tail_begin:]
+    return head + f"[... {len(text) - len(head) - len(tail)} characters dropped ...]\n" + tail
+
+
+def _text_log_files(log_prefix: str, compressed: bool = False) -> list[str]:
+    """Return the text log files of a notebook, i.e. one for each process, either plain or compressed."""
+    log_suffix = re.compile(r"\.log(-\d+)?" + (r"\.gz" if compressed else ""))
+    return sorted(
+        log_file for log_file in glob.glob(glob.escape(log_prefix) + ".log*")
+        if log_suffix.fullmatch(log_file[len(log_prefix):]) is not None
+    )
+
+
+class _LogWriter:
+    """
+    Write the sections which the hooks add to the text log files of a notebook, i.e. one log file for each process.
+
+    Log files are created by the first cell of the notebook, and are opened only once, as soon as they exist.
+    Sections are buffered, and written to every log file when the cell is done. Log files larger than the
+    maximum size, if provided, are then truncated.
+    """
+
+    def __init__(self, log_prefix: str, max_size: int = 0) -> None:
+        self._log_prefix = log_prefix
+        self._max_size = max_size
+        self._log_files: list[typing.TextIO] = list()
+        self._buffer: list[str] = list()
+
+    def write(self, section: str, content: str) -> None:
+        """Buffer a section."""
+        self._buffer.append(section + ":\n")
+        if content != "":
+            self._buffer.append(content + "\n")
+        self._buffer.append("\n")
+
+    def flush(self) -> None:
+        """Write the buffered sections to every log file."""
+        if len(self._buffer) == 0:
+            return
+        if len(self._log_files) == 0:
+            self._log_files = [open(log_file, "a") for log_file in _text_log_files(self._log_prefix)]
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        for log_file_handler in self._log_files:
+            log_file_handler.write(text)
+            log_file_handler.flush()
+            if self._max_size > 0 and os.fstat(log_file_handler.fileno()).st_size > self._max_size:
+                self._truncate(log_file_handler.name)
+
+    def _truncate(self, log_file: str) -> None:
+        """Truncate a log file in place, so that processes which are appending to it can keep doing so."""
+        with open(log_file, "r+", newline="", errors="surrogateescape") as log_file_handler:
+            text = _truncate_text(log_file_handler.read(), self._max_size)
+            log_file_handler.seek(0)
+            log_file_handler.write(text)
+            log_file_handler.truncate()
+
+    def close(self) -> None:
+        """Write the buffered sections, and close every log file."""
+        self.flush()
+        for log_file_handler in self._log_files:
+            log_file_handler.close()
+        self._log_files.clear()
 
 
 class IPyNbCell(nbval.plugin.IPyNbCell):  # type: ignore[misc,no-any-unimported]
@@ -590,7 +1562,66 @@ class IPyNbCell(nbval.plugin.IPyNbCell):  # type: ignore[misc,no-any-unimported]
 
     _MockExceptionInfo = collections.namedtuple("_MockExceptionInfo", ["value"])
 
+    def setup(self) -> None:
+        """Wait for the cell to be run by the variant scheduler, if available."""
+        variant_scheduler = self.config.stash.get(_variant_scheduler_key, None)
+        if variant_scheduler is None:
+            super().setup()
+        else:
+            variant_scheduler.wait_cell(self)
+
     def runtest(self) -> None:
+        """Run the cell, or report its outcome from the result cache, and store the outcome in the cache."""
+        result_cache = self.config.stash.get(_result_cache_key, None)
+        if result_cache is None:
+            self._report_outcome()
+        elif self.parent._cached_outcomes is not None:
+            result_cache.report(self)
+        else:
+            try:
+                self._report_outcome()
+            except BaseException as e:
+                result_cache.record(self, e)
+                raise
+            else:
+                result_cache.record(self, None)
+
+    def _report_outcome(self) -> None:
+        """Run the cell, or report the outcome of the run carried out by the variant scheduler, if available."""
+        variant_scheduler = self.config.stash.get(_variant_scheduler_key, None)
+        if variant_scheduler is None:
+            if self.parent._alias_of is None:
+                self._run_and_record()
+            else:
+                self._reuse_outcome()
+        else:
+            variant_scheduler.cell_outcome(self)
+
+    def _run_and_record(self) -> None:
+        """Run the cell, and record its outcome in case it needs to be reported for identical notebooks."""
+        start = time.perf_counter()
+        try:
+            self._runtest()
+        except BaseException as e:
+            if self.parent._has_aliases:
+                self.parent._outcomes[self.cell_num] = (e, self.cell.outputs)
+            raise
+        else:
+            if self.parent._has_aliases:
+                self.parent._outcomes[self.cell_num] = (None, self.cell.outputs)
+        finally:
+            durations_report = self.config.stash.get(_durations_report_key, None)
+            if durations_report is not None:
+                durations_report.record_cell(self, time.perf_counter() - start)
+
+    def _reuse_outcome(self) -> None:
+        """Report the outcome of the corresponding cell of the identical notebook which was actually run."""
+        (exception, outputs) = self.parent._alias_of._outcomes[self.cell_num]
+        self.cell.outputs = outputs
+        if exception is not None:
+            raise exception
+
+    def _runtest(self) -> None:
         """
         Redirect jupyter outputs to log file and determine if exceptions were expected or not.
 
@@ -609,7 +1640,7 @@ class IPyNbCell(nbval.plugin.IPyNbCell):  # type: ignore[misc,no-any-unimported]
                 raise pytest.skip.Exception(msg="A previous cell failed", pytrace=False)
             else:
                 # Run the cell
-                super().runtest()
+                self._run_cell()
         except nbval.plugin.NbCellError as e:
             # Write the exception to log file
             if e.inner_traceback:
@@ -648,12 +1679,28 @@ class IPyNbCell(nbval.plugin.IPyNbCell):  # type: ignore[misc,no-any-unimported]
                 self.cell.outputs = self.test_outputs
             # Write other jupyter outputs to log file
             self._write_to_log_file("Output (jupyter)", self._transform_jupyter_outputs_to_text(self.cell.outputs))
+            # Store large outputs in separate files, so that they do not stay in memory until the notebook is done
+            if self.config.option.log_ipynb_spill_size > 0:
+                self._spill_outputs(self.config.option.log_ipynb_spill_size)
             # Write cell name and id to log file
             self._write_to_log_file("Cell name", self.name)
             if hasattr(self.cell, "id"):
                 self._write_to_log_file("Cell ID", self.cell.id)
             else:
                 self._write_to_log_file("Cell ID", "not available")
+            self.parent._log_writer.flush()
+            # Store the state of the notebook, in case other notebooks share the cells up to this one
+            prefix_sharing_runner = self.config.stash.get(_prefix_sharing_runner_key, None)
+            if prefix_sharing_runner is not None:
+                prefix_sharing_runner.cell_done(self)
+
+    def _run_cell(self) -> None:
+        """Run the cell on the kernel, or with the prefix sharing runner, if available."""
+        prefix_sharing_runner = self.config.stash.get(_prefix_sharing_runner_key, None)
+        if prefix_sharing_runner is None:
+            super().runtest()
+        else:
+            prefix_sharing_runner.run_cell(self)
 
     def _transform_jupyter_outputs_to_text(
             self, outputs: typing.Iterable[nbformat.NotebookNode]) -> str:
@@ -671,16 +1718,49 @@ class IPyNbCell(nbval.plugin.IPyNbCell):  # type: ignore[misc,no-any-unimported]
         else:
             return ""
 
+    def _spill_outputs(self, spill_size: int) -> None:
+        """
+        Move outputs larger than the provided size to files in a directory next to the notebook.
+
+        The text of stream outputs is replaced by a line which reports the file name, while the data of other
+        outputs is removed, and the file name is stored in the nbvalx metadata of the output.
+        """
+        spill_dir = pathlib.Path(str(self.parent.fspath)[:-6] + ".outputs")
+        for stale_file in spill_dir.glob(f"cell_{self.cell_num}_*"):
+            stale_file.unlink()
+        for (output_index, output) in enumerate(self.cell.outputs):
+            file_prefix = f"cell_{self.cell_num}_output_{output_index}"
+            if output["output_type"] == "stream" and len(output["text"]) > spill_size:
+                spill_file = spill_dir / (file_prefix + ".txt")
+                spill_dir.mkdir(exist_ok=True)
+                spill_file.write_text(output["text"])
+                output["text"] = f"[{output['name']} stored in {spill_dir.name}/{spill_file.name}]\n"
+            for (mime, value) in list(output.get("data", {}).items()):
+                content = value if isinstance(value, str) else json.dumps(value)
+                if len(content) <= spill_size:
+                    continue
+                # Name the file after the mime type too, since several mime types may share the same extension
+                mime_slug = self._mime_slug_pattern.sub("_", mime)
+                spill_file = spill_dir / f"{file_prefix}_{mime_slug}{mimetypes.guess_extension(mime) or '.data'}"
+                spill_dir.mkdir(exist_ok=True)
+                if (mime.startswith("image/") and mime != "image/svg+xml") or mime == "application/pdf":
+                    # Binary data is encoded in base64 in notebook outputs
+                    spill_file.write_bytes(base64.b64decode(content))
+                else:
+                    spill_file.write_text(content)
+                del output["data"][mime]
+                output.setdefault("metadata", {}).setdefault("nbvalx", {}).setdefault("spilled", {})[mime] = (
+                    f"{spill_dir.name}/{spill_file.name}")
+
+    _mime_slug_pattern = re.compile(r"[^A-Za-z0-9]+")
+
     def _write_to_log_file(self, section: str, content: str) -> None:
         """Write content to a section of the live log file."""
+        if self.cell_num in self.parent._shared_cells:
+            # The log file was copied from the notebook which actually ran the cell
+            return
         if "%%live_log" in self.cell.source:
-            for log_file in glob.glob(str(self.parent.fspath)[:-6] + ".log*"):
-                with open(log_file, "a", buffering=1) as log_file_handler:
-                    print(section + ":", file=log_file_handler)
-                    content = self._strip_ansi(content)
-                    if content != "":
-                        print(content, file=log_file_handler)
-                    print(file=log_file_handler)
+            self.parent._log_writer.write(section, self._strip_ansi(content))
 
     def _strip_ansi(self, content: str) -> str:
         """Strip colors while writing to file. See strip_ansi on PyPI."""
@@ -689,6 +1769,135 @@ class IPyNbCell(nbval.plugin.IPyNbCell):  # type: ignore[misc,no-any-unimported]
     _strip_ansi_pattern = re.compile(r"\x1B\[\d+(;\d+){0,3}m")
 
 
+def _execute_on_kernel(  # type: ignore[no-any-unimported]
+    kernel: nbval.kernel.RunningKernel, code: str, timeout: float
+) -> None:
+    """Execute code on a kernel, and raise an error if execution was not successful."""
+    msg_id = kernel.execute_cell_input(code, allow_stdin=False)
+    while True:
+        msg = kernel.get_message(stream="shell", timeout=timeout)
+        if msg["parent_header"].get("msg_id") == msg_id:
+            break
+    kernel.await_idle(msg_id, timeout)
+    if msg["content"]["status"] != "ok":
+        raise RuntimeError(f"Execution of {code} failed on a kernel: {msg['content'].get('evalue', '')}")
+
+
+class _KernelPool:
+    """
+    A pool of pre-started jupyter kernels, which are handed over to notebooks one at a time.
+
+    Kernels are started and, after a notebook is done, reset or restarted in background threads,
+    so that the next notebook can pick up a warm kernel.
+    """
+
+    _snapshot_code = """\
+import IPython as _IPython
+
+_IPython.get_ipython().nbvalx_kernel_pool_extensions = set(_IPython.get_ipython().extension_manager.loaded)
+del _IPython"""
+
+    _reset_code = """\
+import os as _os
+import sys as _sys
+
+import IPython as _IPython
+
+_ipython = _IPython.get_ipython()
+for _extension in set(_ipython.extension_manager.loaded) - _ipython.nbvalx_kernel_pool_extensions:
+    _ipython.extension_manager.unload_extension(_extension)
+_cwd = _os.getcwd() + _os.sep
+for (_name, _module) in list(_sys.modules.items()):
+    if getattr(_module, "__file__", None) is not None and _os.path.abspath(_module.__file__).startswith(_cwd):
+        del _sys.modules[_name]
+_ipython.run_line_magic("reset", "-f")"""
+
+    def __init__(self, size: int, startup_timeout: float, preload_modules: list[str], policy: str) -> None:
+        self._size = size
+        self._startup_timeout = startup_timeout
+        self._preload_code = "\n".join(f"import {module}" for module in preload_modules)
+        self._policy = policy
+        self._idle_kernels: dict[str, queue.Queue[nbval.kernel.RunningKernel | BaseException]] = dict()  # type: ignore[no-any-unimported]
+        self._busy_kernels: dict[nbval.kernel.RunningKernel, str] = dict()  # type: ignore[no-any-unimported]
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, kernel_name: str, cwd: str) -> nbval.kernel.RunningKernel:  # type: ignore[no-any-unimported]
+        """Hand over an idle kernel, after changing its working directory."""
+        with self._lock:
+            assert not self._closed
+            if kernel_name not in self._idle_kernels:
+                self._idle_kernels[kernel_name] = queue.Queue()
+                for _ in range(self._size):
+                    self._executor.submit(self._start_kernel, kernel_name)
+        kernel = self._idle_kernels[kernel_name].get()
+        if isinstance(kernel, BaseException):
+            raise kernel
+        self._execute(kernel, f"__import__('os').chdir({cwd!r})")
+        with self._lock:
+            self._busy_kernels[kernel] = kernel_name
+        return kernel
+
+    def release(self, kernel: nbval.kernel.RunningKernel) -> None:  # type: ignore[no-any-unimported]
+        """Get a kernel back from a notebook, and reset or restart it."""
+        with self._lock:
+            kernel_name = self._busy_kernels.pop(kernel)
+            if self._closed:
+                self._stop_kernel(kernel)
+            else:
+                self._executor.submit(self._recycle_kernel, kernel_name, kernel)
+
+    def shutdown(self) -> None:
+        """Stop all kernels in the pool."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        for idle_kernels in self._idle_kernels.values():
+            while not idle_kernels.empty():
+                kernel = idle_kernels.get_nowait()
+                if not isinstance(kernel, BaseException):
+                    self._stop_kernel(kernel)
+
+    def _start_kernel(self, kernel_name: str) -> None:
+        """Start a new kernel, preload modules and store it as idle."""
+        kernel: nbval.kernel.RunningKernel | BaseException  # type: ignore[no-any-unimported]
+        try:
+            kernel = nbval.kernel.RunningKernel(kernel_name, startup_timeout=self._startup_timeout)
+            if self._preload_code != "":
+                self._execute(kernel, self._preload_code)
+            self._execute(kernel, self._snapshot_code)
+        except Exception as e:
+            kernel = e
+        self._idle_kernels[kernel_name].put(kernel)
+
+    def _recycle_kernel(self, kernel_name: str, kernel: nbval.kernel.RunningKernel) -> None:  # type: ignore[no-any-unimported]
+        """Reset or restart a kernel, and store it as idle."""
+        if self._policy == "reset" and kernel.is_alive():
+            try:
+                self._execute(kernel, self._reset_code)
+            except Exception:
+                pass
+            else:
+                self._idle_kernels[kernel_name].put(kernel)
+                return
+        self._stop_kernel(kernel)
+        self._start_kernel(kernel_name)
+
+    def _execute(self, kernel: nbval.kernel.RunningKernel, code: str) -> None:  # type: ignore[no-any-unimported]
+        """Execute code on a kernel of the pool, and raise an error if execution was not successful."""
+        _execute_on_kernel(kernel, code, self._startup_timeout)
+
+    @staticmethod
+    def _stop_kernel(kernel: nbval.kernel.RunningKernel) -> None:  # type: ignore[no-any-unimported]
+        """Stop a kernel, if it is still alive."""
+        if kernel.is_alive():
+            kernel.stop()
+
+
+_kernel_pool_key = pytest.StashKey[_KernelPool]()
+
+
 class IPyNbFile(nbval.plugin.IPyNbFile):  # type: ignore[misc,no-any-unimported]
     """Customize nbval IPyNbFile to use IPyNbCell defined in this module rather than nbval's one."""
 
@@ -697,27 +1906,847 @@ class IPyNbFile(nbval.plugin.IPyNbFile):  # type: ignore[misc,no-any-unimported]
         super().__init__(*args, **kwargs)
         self.compare_outputs = False
         self._force_skip = False
+        self._has_aliases = False
+        self._alias_of: IPyNbFile | None = None
+        self._outcomes: dict[int, tuple[BaseException | None, list[nbformat.NotebookNode]]] = dict()
+        self._shared_cells: set[int] = set()
+        self._cached_outcomes: dict[str, list[typing.Any]] | None = None
+        self._log_writer = _LogWriter(str(self.fspath)[:-6], self.config.option.log_max_size)
+
+    def setup(self) -> None:
+        """Start the kernel, unless the variant scheduler is in charge of running the notebook or it is cached."""
+        result_cache = self.config.stash.get(_result_cache_key, None)
+        if result_cache is not None:
+            result_cache.start(self.session.items)
+        if self._cached_outcomes is None:
+            # Remove compressed logs of a previous run, since the notebook is going to write new logs
+            for log_file in _text_log_files(str(self.fspath)[:-6], compressed=True):
+                os.remove(log_file)
+        variant_scheduler = self.config.stash.get(_variant_scheduler_key, None)
+        if variant_scheduler is None:
+            original = self._original()
+            if self._cached_outcomes is not None:
+                # Outcomes will be reported from the result cache: there is no need to start a kernel
+                pass
+            elif original is not None and all(
+                item.cell_num in original._outcomes for item in self.session.items if item.parent is self
+            ):
+                # An identical notebook has already run all the cells: there is no need to start a kernel
+                self._alias_of = original
+            else:
+                self._start_kernel()
+        else:
+            variant_scheduler.start(self.session.items)
+
+    def _original(self) -> "IPyNbFile | None":
+        """Return the notebook of which this notebook is an identical copy, if collected in the current session."""
+        alias_of = self.nb.metadata.get("nbvalx", {}).get("alias_of", None)
+        if alias_of is None:
+            return None
+        else:
+            notebooks: dict[pathlib.Path, IPyNbFile] = self.config.stash[_notebooks_key]
+            return notebooks.get(self.path.parent / alias_of, None)
+
+    def _xdist_group(self) -> str:
+        """
+        Return the group which the cells of this notebook belong to when distributed by pytest-xdist.
+
+        Identical notebooks belong to the group of the notebook they are a copy of, so that they can report its
+        outcomes. Brackets are replaced since pytest-xdist ignores groups whose name contains a closing bracket.
+        """
+        alias_of = self.nb.metadata.get("nbvalx", {}).get("alias_of", None)
+        group_path = self.path if alias_of is None else self.path.parent / alias_of
+        return os.path.relpath(str(group_path), self.config.rootpath).translate(str.maketrans("[]", "()"))
+
+    def _start_kernel(self) -> None:
+        """Get a kernel from the kernel pool, if available, rather than starting a new one."""
+        start = time.perf_counter()
+        prefix_sharing_runner = self.config.stash.get(_prefix_sharing_runner_key, None)
+        kernel_pool = self.config.stash.get(_kernel_pool_key, None)
+        if prefix_sharing_runner is not None:
+            # Cells will be run by the prefix sharing runner rather than on a kernel
+            self.kernel = None
+            prefix_sharing_runner.start(self.session.items)
+            prefix_sharing_runner.setup(self)
+        elif kernel_pool is None:
+            super().setup()
+        else:
+            # Determine the kernel name as in nbval
+            if self.config.option.nbval_current_env:
+                kernel_name = nbval.kernel.CURRENT_ENV_KERNEL_NAME
+            elif self.config.option.nbval_kernel_name:
+                kernel_name = self.config.option.nbval_kernel_name
+            else:
+                kernel_name = self.nb.metadata.get("kernelspec", {}).get("name", "python")
+            self.kernel = kernel_pool.acquire(kernel_name, str(self.fspath.dirname))
+            self.setup_sanitize_files()
+        if self.kernel is not None and (
+            kernel_pool is not None or self.config.stash.get(_variant_scheduler_key, None) is not None
+        ):
+            # Kernels which were started in a background thread may have missed the environment variable
+            # that pytest only sets while running a test: set it as if the kernel was started by the notebook
+            _execute_on_kernel(
+                self.kernel, f"__import__('os').environ['PYTEST_CURRENT_TEST'] = {self.nodeid + ' (setup)'!r}",
+                self.config.option.nbval_kernel_startup_timeout)
+        durations_report = self.config.stash.get(_durations_report_key, None)
+        if durations_report is not None:
+            durations_report.record_file(self, "kernel_start", time.perf_counter() - start)
 
     def collect(self) -> typing.Iterable[IPyNbCell]:
         """Strip nbval's IPyNbCell to the corresponding class defined in this module."""
+        self.config.stash.setdefault(_notebooks_key, dict())[self.path] = self
+        xdist_worker = _is_xdist_worker(self.config)
         for cell in super().collect():
-            yield IPyNbCell.from_parent(
+            item = IPyNbCell.from_parent(
                 cell.parent, name=cell.name, cell_num=cell.cell_num, cell=cell.cell, options=cell.options)
+            if xdist_worker:
+                item.add_marker(pytest.mark.xdist_group(name=self._xdist_group()))
+            yield item
+        self._has_aliases = len(self.nb.metadata.get("nbvalx", {}).get("aliases", [])) > 0
 
     def teardown(self) -> None:
         """Save outputs in a log notebook."""
+        # Wait for the variant scheduler to be done with the notebook, if available
+        variant_scheduler = self.config.stash.get(_variant_scheduler_key, None)
+        if variant_scheduler is not None:
+            variant_scheduler.wait_file(self)
+        start = time.perf_counter()
+        # Close text logs
+        self._log_writer.close()
         # Save outputs in a log notebook
         with open(str(self.fspath)[:-6] + ".log.ipynb", "w") as f:
-            nbformat.write(self.nb, f)  # type: ignore[no-untyped-call]
+            nbformat.write(self._log_notebook(), f)  # type: ignore[no-untyped-call]
+        # Copy text logs of the identical notebook which was actually run
+        if self._alias_of is not None:
+            original_log_prefix = str(self._alias_of.fspath)[:-6]
+            for original_log_file in [
+                *_text_log_files(original_log_prefix), *_text_log_files(original_log_prefix, compressed=True)
+            ]:
+                shutil.copyfile(
+                    original_log_file, str(self.fspath)[:-6] + original_log_file[len(original_log_prefix):])
+        # Compress text logs
+        if self.config.option.log_compress:
+            for log_file in _text_log_files(str(self.fspath)[:-6]):
+                with open(log_file, "rb") as f_in, gzip.open(log_file + ".gz", "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                os.remove(log_file)
+        # Store the outcomes in the result cache, if available
+        result_cache = self.config.stash.get(_result_cache_key, None)
+        if result_cache is not None:
+            result_cache.file_done(self)
+        # Stop the kernel
+        self._stop_kernel()
+        # Record the duration of the teardown and the memory usage of the cells, if available
+        durations_report = self.config.stash.get(_durations_report_key, None)
+        if durations_report is not None:
+            durations_report.record_file(self, "teardown", time.perf_counter() - start)
+            if self._cached_outcomes is None:
+                for memory_file in sorted(glob.glob(glob.escape(str(self.fspath)[:-6]) + ".memory*")):
+                    durations_report.record_memory(self, pathlib.Path(memory_file))
+
+    def _log_notebook(self) -> nbformat.NotebookNode:
+        """Return the notebook to be saved as log, with outputs limited as requested."""
+        log_ipynb_outputs = self.config.option.log_ipynb_outputs
+        log_nb: nbformat.NotebookNode = self.nb
+        if log_ipynb_outputs == "all":
+            return log_nb
+        log_nb = copy.deepcopy(log_nb)
+        max_size = self.config.option.log_max_size
+        for cell in log_nb.cells:
+            if cell.cell_type != "code":
+                continue
+            if log_ipynb_outputs == "none":
+                cell.outputs = []
+                continue
+            for output in cell.outputs:
+                if "text" in output:
+                    output.text = _truncate_text(output.text, max_size)
+                for (mime, value) in list(output.get("data", {}).items()):
+                    if mime.startswith("text/"):
+                        output.data[mime] = _truncate_text(value, max_size)
+                    elif len(str(value)) > max_size:
+                        # Binary data, e.g. images, cannot be truncated and is rather dropped
+                        del output.data[mime]
+        return log_nb
+
+    def _stop_kernel(self) -> None:
+        """Give the kernel back to the kernel pool, if available, rather than stopping it."""
+        prefix_sharing_runner = self.config.stash.get(_prefix_sharing_runner_key, None)
+        if prefix_sharing_runner is not None:
+            prefix_sharing_runner.release(self)
+        kernel_pool = self.config.stash.get(_kernel_pool_key, None)
+        if kernel_pool is not None and self.kernel is not None:
+            kernel_pool.release(self.kernel)
+            self.kernel = None
         # Do the normal teardown
         super().teardown()
 
 
+class _VariantScheduler:
+    """
+    Run notebooks ahead of pytest in a pool of threads, so that several notebooks run concurrently.
+
+    Every notebook is run by a single thread, cell after cell, on its own kernel. pytest items then
+    simply report the outcome of the corresponding cell, in the usual order.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._files: dict[IPyNbFile, concurrent.futures.Future[None]] = dict()
+        self._cells: dict[IPyNbCell, concurrent.futures.Future[None]] = dict()
+        self._started = False
+        self._stopping = threading.Event()
+
+    def start(self, items: list[pytest.Item]) -> None:
+        """Submit every notebook with at least one selected cell, in the same order of the items."""
+        if self._started:
+            return
+        self._started = True
+        cells_by_file: dict[IPyNbFile, list[IPyNbCell]] = dict()
+        for item in items:
+            if isinstance(item, IPyNbCell):
+                self._cells[item] = concurrent.futures.Future()
+                if item.parent._cached_outcomes is None:
+                    cells_by_file.setdefault(item.parent, []).append(item)
+                else:
+                    # The outcome will be reported from the result cache
+                    self._cells[item].set_result(None)
+        for (file_, cells) in cells_by_file.items():
+            original = file_._original()
+            if original in cells_by_file and {cell.cell_num for cell in cells} <= {
+                cell.cell_num for cell in cells_by_file[original]
+            }:
+                # An identical notebook will run all the cells: report its outcomes as soon as they are available
+                assert original is not None
+                file_._alias_of = original
+                original_cells = {cell.cell_num: cell for cell in cells_by_file[original]}
+                for cell in cells:
+                    self._cells[original_cells[cell.cell_num]].add_done_callback(
+                        functools.partial(self._reuse_outcome, cell))
+            else:
+                self._files[file_] = self._executor.submit(self._run, file_, cells)
+
+    def _run(self, file_: IPyNbFile, cells: list[IPyNbCell]) -> None:
+        """Start the kernel and run every cell, storing their outcome."""
+        try:
+            file_._start_kernel()
+        except BaseException as e:
+            for cell in cells:
+                self._cells[cell].set_exception(e)
+            return
+        try:
+            for cell in cells:
+                if self._stopping.is_set():
+                    self._cells[cell].set_exception(
+                        pytest.skip.Exception(msg="The session was interrupted", pytrace=False))
+                    continue
+                try:
+                    nbval.plugin.IPyNbCell.setup(cell)
+                    cell._run_and_record()
+                except BaseException as e:
+                    self._cells[cell].set_exception(e)
+                else:
+                    self._cells[cell].set_result(None)
+        finally:
+            # Stop the kernel as soon as possible, rather than waiting for pytest to tear down the notebook,
+            # so that kernels in the kernel pool become available to other notebooks
+            file_._stop_kernel()
+
+    def _reuse_outcome(self, cell: IPyNbCell, original_cell_outcome: concurrent.futures.Future[None]) -> None:
+        """Store the outcome of the corresponding cell of the identical notebook which was actually run."""
+        assert cell.parent._alias_of is not None
+        if cell.cell_num not in cell.parent._alias_of._outcomes:
+            # The cell was not run at all, e.g. because the kernel failed to start
+            self._cells[cell].set_exception(original_cell_outcome.exception())
+            return
+        try:
+            cell._reuse_outcome()
+        except BaseException as e:
+            self._cells[cell].set_exception(e)
+        else:
+            self._cells[cell].set_result(None)
+
+    def wait_cell(self, cell: IPyNbCell) -> None:
+        """Wait until the cell has been run."""
+        concurrent.futures.wait([self._cells[cell]])
+
+    def cell_outcome(self, cell: IPyNbCell) -> None:
+        """Return if the cell ran successfully, otherwise raise the same exception raised while running it."""
+        self._cells[cell].result()
+
+    def wait_file(self, file_: IPyNbFile) -> None:
+        """Wait until every cell of the notebook has been run."""
+        if file_ in self._files:
+            concurrent.futures.wait([self._files[file_]])
+
+    def shutdown(self) -> None:
+        """Skip the remaining cells of running notebooks, and cancel notebooks that were not started yet."""
+        self._stopping.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _PrefixTrieNode:
+    """A cell in the trie of the notebooks which share the same cells at their beginning."""
+
+    def __init__(self) -> None:
+        self.children: dict[tuple[int, str], _PrefixTrieNode] = dict()
+        self.ends = 0
+        self.users = 0
+        self.done = False
+        self.outcome: tuple[list[dict[str, typing.Any]], bool] | BaseException | None = None
+        self.log: bytes | None = None
+        self.shell: nbvalx.forking_shell.ForkingShell | None = None
+
+
+class _PrefixSharingRunner:
+    """
+    Run notebooks in forking IPython shells, so that the cells which notebooks share at their beginning run once.
+
+    Notebooks in the same directory are arranged in a trie, according to the content of their cells. The first
+    notebook runs its cells and, at every cell after which another notebook will continue differently, leaves
+    behind a fork of its shell and a copy of its log file. Each following notebook reports the outcomes of the
+    cells it shares with previous notebooks, copies their log file and forks their shell to run the rest.
+    """
+
+    _redirect_live_log_code = """\
+if "live_log" in globals():
+    live_log.__file__ = open({log_prefix!r} + ".log", "a", buffering=1)
+    LiveLogProfiler.directory = {log_prefix!r} + ".profile"
+    if LiveLogProfiler.kind != "off":
+        shutil.rmtree(LiveLogProfiler.directory, ignore_errors=True)
+    LiveLogMemory.filename = {log_prefix!r} + ".memory"
+    if LiveLogMemory.enabled:
+        open(LiveLogMemory.filename, "w").close()
+    live_log.coverage_context = os.path.relpath({log_prefix!r} + ".ipynb", {rootpath!r}) + "::"
+"""
+
+    def __init__(self) -> None:
+        self._roots: dict[pathlib.Path, _PrefixTrieNode] = dict()
+        self._paths: dict[IPyNbFile, list[_PrefixTrieNode]] = dict()
+        self._nodes: dict[IPyNbCell, _PrefixTrieNode] = dict()
+        self._shells: dict[IPyNbFile, nbvalx.forking_shell.ForkingShell | None] = dict()
+        self._started = False
+
+    def start(self, items: list[pytest.Item]) -> None:
+        """Arrange every notebook with at least one selected cell in the trie of its directory."""
+        if self._started:
+            return
+        self._started = True
+        for item in items:
+            if isinstance(item, IPyNbCell) and item.parent._cached_outcomes is None:
+                file_ = item.parent
+                if file_ not in self._paths:
+                    root = self._roots.setdefault(file_.path.parent, _PrefixTrieNode())
+                    root.users += 1
+                    self._paths[file_] = [root]
+                else:
+                    self._paths[file_][-1].ends -= 1
+                # The log file name is the only difference between the first cells of notebooks
+                key = (item.cell_num, item.cell.source.replace(str(file_.fspath)[:-6], ""))
+                node = self._paths[file_][-1].children.setdefault(key, _PrefixTrieNode())
+                node.users += 1
+                node.ends += 1
+                self._paths[file_].append(node)
+                self._nodes[item] = node
+
+    def setup(self, file_: IPyNbFile) -> None:
+        """Find the cells shared with previous notebooks, and copy the log file of the last of them."""
+        path = self._paths[file_]
+        shared = 0
+        while shared + 1 < len(path) and path[shared + 1].done:
+            shared += 1
+        file_._shared_cells = {cell.cell_num for (cell, node) in self._nodes.items() if node in path[1:shared + 1]}
+        log = path[shared].log
+        if log is not None:
+            with open(str(file_.fspath)[:-6] + ".log", "wb") as log_file:
+                log_file.write(log)
+
+    def run_cell(self, cell: IPyNbCell) -> None:
+        """Run the cell, or report the outcome of the same cell run by a previous notebook."""
+        if cell.options["skip"]:
+            pytest.skip()
+        node = self._nodes[cell]
+        if not node.done:
+            node.outcome = self._execute(cell)
+        assert node.outcome is not None
+        if isinstance(node.outcome, BaseException):
+            raise node.outcome
+        (outputs, timed_out) = node.outcome
+        if timed_out:
+            cell.parent.timed_out = True
+        # Process outputs as nbval does with the messages sent by the kernel
+        cell.test_outputs = list()
+        for output in outputs:
+            cell.test_outputs.append(nbformat.from_dict(output))  # type: ignore[no-untyped-call]
+            if output["output_type"] == "error" and not cell.options["check_exception"]:
+                if output["ename"] == "KeyboardInterrupt" and timed_out:
+                    message = f"Timeout of {cell.config.option.nbval_cell_timeout:g} seconds exceeded executing cell"
+                else:
+                    message = "Cell execution caused an exception"
+                cell.raise_cell_error(message, "\n" + "\n".join(output["traceback"]))
+        cell.test_outputs[:] = nbval.plugin.coalesce_streams(cell.test_outputs)
+
+    def _execute(self, cell: IPyNbCell) -> tuple[list[dict[str, typing.Any]], bool] | BaseException:
+        """Execute the cell in the shell of the notebook, and return the outputs and whether it timed out."""
+        shell = self._shell(cell.parent)
+        if shell is None:
+            return RuntimeError("Kernel dead on test start")
+        try:
+            try:
+                return (shell.execute(cell.cell.source, cell.config.option.nbval_cell_timeout), False)
+            except TimeoutError:
+                # Interrupt the cell to get a traceback
+                shell.interrupt()
+                try:
+                    return (shell.wait(cell.output_timeout), True)
+                except TimeoutError:
+                    shell.kill()
+                    self._shells[cell.parent] = None
+                    cell.parent.timed_out = True
+                    error: BaseException = nbval.plugin.NbCellError(
+                        cell.cell_num, (
+                            f"Timeout of {cell.config.option.nbval_cell_timeout:g} seconds exceeded while "
+                            f"executing cell. Failed to interrupt kernel in {cell.output_timeout} seconds, "
+                            "so failing without traceback."), cell.cell.source)
+                    return error
+        except (EOFError, OSError):
+            self._shells[cell.parent] = None
+            return RuntimeError("Kernel died while executing cell")
+
+    def _shell(self, file_: IPyNbFile) -> nbvalx.forking_shell.ForkingShell | None:
+        """Return the shell of the notebook, forking the one left behind by the last notebook sharing cells."""
+        if file_ not in self._shells:
+            path = self._paths[file_]
+            shared = max(index for (index, node) in enumerate(path) if index == 0 or node.done)
+            node = path[shared]
+            if node.shell is None:
+                if shared > 0:
+                    # The notebook which ran the shared cells was not able to leave its shell behind
+                    self._shells[file_] = None
+                    return None
+                node.shell = nbvalx.forking_shell.ForkingShell.start(str(file_.fspath.dirname))
+            try:
+                if node.users > 1:
+                    self._shells[file_] = node.shell.fork()
+                else:
+                    (self._shells[file_], node.shell) = (node.shell, None)
+                shell = self._shells[file_]
+                assert shell is not None
+                if shared > 0:
+                    shell.execute(self._redirect_live_log_code.format(
+                        log_prefix=str(file_.fspath)[:-6], rootpath=str(file_.config.rootpath)))
+            except (EOFError, OSError):  # pragma: no cover
+                self._shells[file_] = None
+        return self._shells[file_]
+
+    def cell_done(self, cell: IPyNbCell) -> None:
+        """Leave behind the log file and a fork of the shell, if other notebooks will continue from this cell."""
+        node = self._nodes[cell]
+        if node.done:
+            return
+        node.done = True
+        if node.users > 1:
+            file_ = cell.parent
+            ends_here = self._paths[file_][-1] is node
+            # Other notebooks will stop reusing outcomes here if they end here too, or continue with other cells
+            if node.ends + len(node.children) > 1:
+                log_path = pathlib.Path(str(file_.fspath)[:-6] + ".log")
+                if log_path.exists():
+                    node.log = log_path.read_bytes()
+            # Other notebooks will need a shell from here only if they continue with other cells
+            shell = self._shells.get(file_, None)
+            if shell is not None and not file_._force_skip and len(node.children) > (0 if ends_here else 1):
+                node.shell = shell
+                if ends_here:
+                    del self._shells[file_]
+                else:
+                    try:
+                        self._shells[file_] = shell.fork()
+                    except (EOFError, OSError):  # pragma: no cover
+                        self._shells[file_] = None
+
+    def release(self, file_: IPyNbFile) -> None:
+        """Stop the shell of the notebook, and the ones left behind which no other notebook will use."""
+        shell = self._shells.pop(file_, None)
+        if shell is not None:
+            shell.stop()
+        for node in self._paths.get(file_, []):
+            node.users -= 1
+            if node.users == 0:
+                if node.shell is not None:
+                    node.shell.stop()
+                (node.shell, node.log, node.outcome) = (None, None, None)
+
+    def shutdown(self) -> None:
+        """Stop every shell."""
+        for file_ in list(self._paths):
+            if file_ in self._shells or any(node.users > 0 for node in self._paths[file_]):
+                self.release(file_)
+
+
+class _ResultCache:
+    """
+    Outcomes of the notebooks which passed in previous runs, stored in a file in each work directory.
+
+    Outcomes are keyed by a hash of the generated notebook, of the number of processes and of the content of
+    the files which the notebook depends on. Notebooks with an unchanged key are not run again: the outcome
+    (passed, skipped or xfailed) and the outputs of every cell are rather reported from the cache.
+    """
+
+    def __init__(self, np: int, refresh: bool, dependencies: dict[pathlib.Path, list[pathlib.Path]]) -> None:
+        self._np = np
+        self._refresh = refresh
+        self._dependencies = dependencies
+        self._files_hashes: dict[pathlib.Path, str] = dict()
+        self._caches: dict[pathlib.Path, dict[str, typing.Any]] = dict()
+        self._keys: dict[IPyNbFile, str] = dict()
+        self._outcomes: dict[IPyNbFile, dict[str, list[typing.Any]] | None] = dict()
+        self._changes: dict[pathlib.Path, dict[str, typing.Any]] = dict()
+        self._started = False
+
+    def start(self, items: list[pytest.Item]) -> None:
+        """Determine the notebooks with at least one selected cell whose outcomes can be reported from the cache."""
+        if self._started:
+            return
+        self._started = True
+        cells_nums: dict[IPyNbFile, set[str]] = dict()
+        for item in items:
+            if isinstance(item, IPyNbCell):
+                cells_nums.setdefault(item.parent, set()).add(str(item.cell_num))
+        for (file_, cells_nums_file) in cells_nums.items():
+            cache_path = file_.path.parent / _RESULT_CACHE
+            if cache_path not in self._caches:
+                self._caches[cache_path] = self._read(cache_path)
+            self._keys[file_] = self._key(file_)
+            self._outcomes[file_] = dict()
+            entry = self._caches[cache_path].get(file_.path.name)
+            if (
+                not self._refresh and entry is not None and entry["key"] == self._keys[file_]
+                and cells_nums_file <= entry["cells"].keys()
+            ):
+                file_._cached_outcomes = entry["cells"]
+
+    def _key(self, file_: IPyNbFile) -> str:
+        """Hash the generated notebook, the number of processes and the content of the files it depends on."""
+        hasher = hashlib.sha256()
+        hasher.update(_generator_fingerprint())
+        hasher.update(json.dumps(self._np).encode())
+        hasher.update(file_.path.read_bytes())
+        for path in self._dependencies.get(file_.path.parent, []):
+            if path not in self._files_hashes:
+                self._files_hashes[path] = hashlib.sha256(path.read_bytes()).hexdigest()
+            hasher.update(json.dumps([str(path), self._files_hashes[path]]).encode())
+        return hasher.hexdigest()
+
+    def record(self, cell: IPyNbCell, exception: BaseException | None) -> None:
+        """Store the outcome of a cell, or mark the notebook as failed."""
+        outcomes = self._outcomes.get(cell.parent, None)
+        if outcomes is None:
+            return
+        if exception is None:
+            outcomes[str(cell.cell_num)] = ["passed", "", cell.cell.outputs]
+        elif isinstance(exception, pytest.skip.Exception):
+            outcomes[str(cell.cell_num)] = ["skipped", exception.msg, cell.cell.outputs]
+        elif isinstance(exception, pytest.xfail.Exception):
+            outcomes[str(cell.cell_num)] = ["xfailed", exception.msg, cell.cell.outputs]
+        else:
+            self._outcomes[cell.parent] = None
+
+    def report(self, cell: IPyNbCell) -> None:
+        """Report the outcome of a cell stored in the cache."""
+        assert cell.parent._cached_outcomes is not None
+        (outcome, message, outputs) = cell.parent._cached_outcomes[str(cell.cell_num)]
+        cell.cell.outputs = [nbformat.from_dict(output) for output in outputs]  # type: ignore[no-untyped-call]
+        cell.user_properties.append(("ipynb_cache", "hit"))
+        exception: BaseException | None = None
+        if outcome == "skipped":
+            exception = pytest.skip.Exception(msg=message, pytrace=False)
+        elif outcome == "xfailed":
+            exception = pytest.xfail.Exception(msg=message, pytrace=False)
+        if cell.parent._has_aliases:
+            # Identical notebooks may report the same outcome
+            cell.parent._outcomes[cell.cell_num] = (exception, cell.cell.outputs)
+        if exception is not None:
+            raise exception
+
+    def file_done(self, file_: IPyNbFile) -> None:
+        """Store the outcomes of a notebook in which every cell passed, and forget the ones of a failed notebook."""
+        if file_ not in self._outcomes or file_._cached_outcomes is not None:
+            return
+        cache_path = file_.path.parent / _RESULT_CACHE
+        outcomes = self._outcomes[file_]
+        if outcomes is None or len(outcomes) == 0:
+            self._caches[cache_path].pop(file_.path.name, None)
+            self._changes.setdefault(cache_path, dict())[file_.path.name] = None
+        else:
+            self._caches[cache_path][file_.path.name] = {"key": self._keys[file_], "cells": outcomes}
+            self._changes.setdefault(cache_path, dict())[file_.path.name] = self._caches[cache_path][file_.path.name]
+
+    @staticmethod
+    def _read(cache_path: pathlib.Path) -> dict[str, typing.Any]:
+        """Read the cache file of a work directory."""
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+        else:
+            return cache if isinstance(cache, dict) else dict()
+
+    def dump(self) -> str:
+        """Serialize the entries changed by this process, e.g. to send them from a pytest-xdist worker."""
+        return json.dumps({str(cache_path): changes for (cache_path, changes) in self._changes.items()})
+
+    def merge(self, dump: str) -> None:
+        """Apply the entries changed by another process, as serialized by dump."""
+        for (cache_path_str, changes) in json.loads(dump).items():
+            cache_path = pathlib.Path(cache_path_str)
+            if cache_path not in self._caches:
+                self._caches[cache_path] = self._read(cache_path)
+            for (name, entry) in changes.items():
+                if entry is None:
+                    self._caches[cache_path].pop(name, None)
+                else:
+                    self._caches[cache_path][name] = entry
+
+    def write(self) -> None:
+        """Write the cache file of every work directory."""
+        for (cache_path, cache) in self._caches.items():
+            with open(cache_path, "w") as f:
+                json.dump(cache, f)
+
+
+_RESULT_CACHE = ".nbvalx_cache.json"
+
+
+class _DurationsReport:
+    """
+    Record the wall-clock durations of notebook generation, and of kernel start, cells and teardown of each notebook.
+
+    Notebooks are identified by the node identifier of the generated notebook, and hence each combination of tags
+    and parameters is reported separately. Durations may be recorded concurrently by the variant scheduler.
+    The memory usage of each cell on each process is recorded as well, if requested.
+    """
+
+    def __init__(self, generation: float) -> None:
+        self._generation = generation
+        self._notebooks: dict[str, dict[str, typing.Any]] = dict()
+        self._lock = threading.Lock()
+
+    def _notebook(self, file_: IPyNbFile) -> dict[str, typing.Any]:
+        """Return the durations of a notebook."""
+        return self._notebooks.setdefault(file_.nodeid, {"kernel_start": 0.0, "cells": dict(), "teardown": 0.0})
+
+    def record_file(self, file_: IPyNbFile, phase: str, duration: float) -> None:
+        """Record the duration of the kernel start or of the teardown of a notebook."""
+        with self._lock:
+            self._notebook(file_)[phase] += duration
+
+    def record_cell(self, cell: IPyNbCell, duration: float) -> None:
+        """Record the duration of a cell."""
+        with self._lock:
+            self._notebook(cell.parent)["cells"].setdefault(
+                cell.name, {"id": cell.cell.get("id", None)})["duration"] = duration
+
+    def record_memory(self, file_: IPyNbFile, memory_file: pathlib.Path) -> None:
+        """Record the memory usage of the cells of a notebook, as written by a process in the memory file."""
+        rank = memory_file.name.rsplit(".memory", 1)[1].lstrip("-") or "0"
+        cells_names = {
+            str(item.cell.get("id", None)): item.name for item in file_.session.items if item.parent is file_}
+        with open(memory_file) as f:
+            records = [json.loads(line) for line in f if line.strip() != ""]
+        with self._lock:
+            cells = self._notebook(file_)["cells"]
+            for record in records:
+                cell_id = record.pop("cell")
+                cell_name = cells_names.get(cell_id, cell_id)
+                cells.setdefault(cell_name, {"id": cell_id}).setdefault("memory", dict())[rank] = record
+
+    def report(self) -> dict[str, typing.Any]:
+        """Return the durations, including the total duration of each notebook."""
+        with self._lock:
+            return {
+                "generation": self._generation,
+                "notebooks": {
+                    nodeid: {
+                        **durations, "total": durations["kernel_start"] + durations["teardown"] + sum(
+                            cell.get("duration", 0.0) for cell in durations["cells"].values())
+                    } for (nodeid, durations) in self._notebooks.items()
+                }
+            }
+
+    def dump(self) -> str:
+        """Serialize the durations of the notebooks, e.g. to send them from a pytest-xdist worker."""
+        with self._lock:
+            return json.dumps(self._notebooks)
+
+    def merge(self, dump: str) -> None:
+        """Add the durations of the notebooks run by another process, as serialized by dump."""
+        with self._lock:
+            self._notebooks.update(json.loads(dump))
+
+    def write(self, report_path: str) -> None:
+        """Write the durations to a JSON file."""
+        with open(report_path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+    def store(self, cache: pytest.Cache) -> None:
+        """Store in the pytest cache the total duration of each notebook which ran at least one cell."""
+        durations = cache.get(_DURATIONS_CACHE_KEY, dict())
+        durations.update({
+            nodeid: notebook["total"] for (nodeid, notebook) in self.report()["notebooks"].items()
+            if any("duration" in cell for cell in notebook["cells"].values())
+        })
+        cache.set(_DURATIONS_CACHE_KEY, durations)
+
+
+_DURATIONS_CACHE_KEY = "nbvalx/durations"
+
+
+class _ImpactSelector:
+    """
+    Select the notebooks impacted by changed files, according to the coverage contexts stored by a previous run.
+
+    The coverage data of every cell is labelled by the generated notebook and by the cell id. A generated notebook
+    is impacted if it covered a line of a changed file, if its source notebook changed, or if it does not appear
+    in any context, e.g. because it is new or because it never ran code measured by coverage.
+    """
+
+    def __init__(
+        self, data_file: str, changed_files: typing.Iterable[pathlib.Path], work_dir: str, rootpath: pathlib.Path
+    ) -> None:
+        import coverage
+
+        data = coverage.CoverageData(data_file)
+        data.read()
+        self._changed_files = {path.absolute() for path in changed_files}
+        self._work_dir_depth = len(pathlib.PurePath(work_dir).parts)
+        self._rootpath = rootpath
+        self._known = {self._notebook(context) for context in data.measured_contexts()}
+        self._impacted = {
+            self._notebook(context) for measured_file in data.measured_files()
+            if pathlib.Path(measured_file) in self._changed_files
+            for contexts in data.contexts_by_lineno(measured_file).values() for context in contexts
+        }
+
+    @staticmethod
+    def _notebook(context: str) -> str:
+        """Return the generated notebook which a context refers to."""
+        return context.rsplit("::", 1)[0]
+
+    def is_impacted(self, file_path: pathlib.Path) -> bool:
+        """Check if a generated notebook is impacted by the changed files."""
+        notebook = os.path.relpath(file_path, self._rootpath)
+        source_path = file_path.parents[self._work_dir_depth] / (_variant_pattern.sub("", file_path.stem) + ".ipynb")
+        return (
+            notebook in self._impacted or notebook not in self._known
+            or source_path.absolute() in self._changed_files)
+
+
+_variant_pattern = re.compile(r"\[.*\]$")
+_variant_scheduler_key = pytest.StashKey[_VariantScheduler]()
+_prefix_sharing_runner_key = pytest.StashKey[_PrefixSharingRunner]()
+_result_cache_key = pytest.StashKey[_ResultCache]()
+_notebooks_key = pytest.StashKey[dict[pathlib.Path, IPyNbFile]]()
+_durations_report_key = pytest.StashKey[_DurationsReport]()
+_impact_selector_key = pytest.StashKey[_ImpactSelector]()
+
+
 def collect_file(file_path: pathlib.Path, parent: pytest.Collector) -> IPyNbFile | None:
     """Collect IPython notebooks using the custom pytest nbval collector."""
     ipynb_action = parent.config.option.ipynb_action
     work_dir = parent.config.option.work_dir
-    if file_path.match(f"{work_dir}/*.ipynb") and ipynb_action != "create-notebooks":
+    impact_selector = parent.config.stash.get(_impact_selector_key, None)
+    if (
+        file_path.match(f"{work_dir}/*.ipynb") and ipynb_action != "create-notebooks"
+        and (impact_selector is None or impact_selector.is_impacted(file_path))
+    ):
         return IPyNbFile.from_parent(parent, path=file_path)  # type: ignore[no-any-return]
     else:
         return None
+
+
+def collection_modifyitems(session: pytest.Session, config: pytest.Config, items: list[pytest.Item]) -> None:
+    """Order notebooks from the longest to the shortest, according to the durations of previous runs, if requested."""
+    if config.option.ipynb_order != "duration":
+        return
+    cache = getattr(config, "cache", None)
+    durations: dict[str, float] = cache.get(_DURATIONS_CACHE_KEY, dict()) if cache is not None else dict()
+    files = list(dict.fromkeys(item.parent for item in items if isinstance(item, IPyNbCell)))
+    sizes = {file_: file_.path.stat().st_size for file_ in files}
+    # Estimate the duration of notebooks which did not run before from their size, at the average rate of the others
+    known = [file_ for file_ in files if file_.nodeid in durations]
+    known_size = sum(sizes[file_] for file_ in known)
+    rate = sum(durations[file_.nodeid] for file_ in known) / known_size if known_size > 0 else 1.0
+    estimates = {file_.path: durations.get(file_.nodeid, sizes[file_] * rate) for file_ in files}
+
+    def order(file_: IPyNbFile) -> tuple[float, bool]:
+        """Sort by decreasing duration, placing identical notebooks right after the notebook they are a copy of."""
+        alias_of = file_.nb.metadata.get("nbvalx", {}).get("alias_of", None)
+        if alias_of is None:
+            return (-estimates[file_.path], False)
+        else:
+            return (-estimates.get(file_.path.parent / alias_of, estimates[file_.path]), True)
+
+    # Cells of each notebook retain their order, and items which are not notebook cells retain their position
+    positions = {file_: position for (position, file_) in enumerate(sorted(files, key=order))}
+    cells = iter(sorted(
+        (item for item in items if isinstance(item, IPyNbCell)), key=lambda item: positions[item.parent]))
+    items[:] = [next(cells) if isinstance(item, IPyNbCell) else item for item in items]
+
+
+def sessionfinish(session: pytest.Session, exitstatus: int | pytest.ExitCode) -> None:
+    """Send the durations and the outcomes to be cached to the pytest-xdist controller, when running on a worker."""
+    if not _is_xdist_worker(session.config):
+        return
+    workeroutput = session.config.workeroutput  # type: ignore[attr-defined]
+    durations_report = session.config.stash.get(_durations_report_key, None)
+    if durations_report is not None:
+        workeroutput["nbvalx_durations"] = durations_report.dump()
+    result_cache = session.config.stash.get(_result_cache_key, None)
+    if result_cache is not None:
+        workeroutput["nbvalx_result_cache"] = result_cache.dump()
+
+
+@pytest.hookimpl(optionalhook=True)
+def testnodedown(node: typing.Any, error: typing.Any) -> None:  # noqa: ANN401
+    """Merge the durations and the outcomes to be cached sent by a pytest-xdist worker into the controller ones."""
+    workeroutput = getattr(node, "workeroutput", dict())
+    durations_report = node.config.stash.get(_durations_report_key, None)
+    if durations_report is not None and "nbvalx_durations" in workeroutput:
+        durations_report.merge(workeroutput["nbvalx_durations"])
+    result_cache = node.config.stash.get(_result_cache_key, None)
+    if result_cache is not None and "nbvalx_result_cache" in workeroutput:
+        result_cache.merge(workeroutput["nbvalx_result_cache"])
+
+
+def terminal_summary(
+    terminalreporter: pytest.TerminalReporter, exitstatus: pytest.ExitCode, config: pytest.Config
+) -> None:
+    """Report the slowest notebooks and cells, and the cells using most memory, if requested."""
+    durations_report = config.stash.get(_durations_report_key, None)
+    ipynb_durations = config.option.ipynb_durations
+    if durations_report is None or ipynb_durations == 0:
+        return
+    report = durations_report.report()
+    terminalreporter.write_sep("=", f"slowest {ipynb_durations} notebooks")
+    terminalreporter.write_line(f"{report['generation']:.2f}s notebook generation")
+    notebooks = sorted(report["notebooks"].items(), key=lambda item: item[1]["total"], reverse=True)
+    for (nodeid, durations) in notebooks[:ipynb_durations]:
+        terminalreporter.write_line(
+            f"{durations['total']:.2f}s {nodeid} (kernel start: {durations['kernel_start']:.2f}s, "
+            f"teardown: {durations['teardown']:.2f}s)")
+    terminalreporter.write_sep("=", f"slowest {ipynb_durations} cells")
+    cells = sorted(
+        ((cell["duration"], f"{nodeid}::{name}", cell["id"]) for (nodeid, durations) in report["notebooks"].items()
+         for (name, cell) in durations["cells"].items() if "duration" in cell), reverse=True)
+    for (duration, cell_nodeid, cell_id) in cells[:ipynb_durations]:
+        terminalreporter.write_line(f"{duration:.2f}s {cell_nodeid} (id: {cell_id})")
+    memory = sorted(
+        ((record["peak_rss"], f"{nodeid}::{name}", cell["id"], rank)
+         for (nodeid, durations) in report["notebooks"].items() for (name, cell) in durations["cells"].items()
+         for (rank, record) in cell.get("memory", {}).items()), reverse=True)
+    if len(memory) > 0:
+        terminalreporter.write_sep("=", f"largest {ipynb_durations} cells by peak RSS")
+        for (peak_rss, cell_nodeid, cell_id, rank) in memory[:ipynb_durations]:
+            terminalreporter.write_line(f"{peak_rss / 2**20:.1f}MiB {cell_nodeid} (id: {cell_id}, rank: {rank})")
@@ -11,6 +11,10 @@ import nbvalx.pytest_hooks_notebooks
 
 pytest_addoption = nbvalx.pytest_hooks_notebooks.addoption
 pytest_collect_file = nbvalx.pytest_hooks_notebooks.collect_file
+pytest_collection_modifyitems = nbvalx.pytest_hooks_notebooks.collection_modifyitems
+pytest_sessionfinish = nbvalx.pytest_hooks_notebooks.sessionfinish
+pytest_terminal_summary = nbvalx.pytest_hooks_notebooks.terminal_summary
+pytest_testnodedown = nbvalx.pytest_hooks_notebooks.testnodedown
 
 
 def pytest_sessionstart(session: pytest.Session) -> None:
@@ -5,7 +5,18 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """pytest configuration file for unit tests."""
 
+import pathlib
+
+import pytest
+from notebooks_project import NotebooksProject
+
 import nbvalx.pytest_hooks_unit_tests
 
 pytest_runtest_setup = nbvalx.pytest_hooks_unit_tests.runtest_setup
 pytest_runtest_teardown = nbvalx.pytest_hooks_unit_tests.runtest_teardown
+
+
+@pytest.fixture
+def notebooks_project(tmp_path: pathlib.Path) -> NotebooksProject:
+    """Return a directory of notebooks to be tested in a separate pytest session."""
+    return NotebooksProject(tmp_path)
@@ -0,0 +1,71 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Helper to test notebooks in a separate pytest session with the nbvalx notebooks hooks."""
+
+import os
+import pathlib
+import subprocess
+import sys
+
+import nbformat
+
+
+class NotebooksProject:
+    """A directory of notebooks, tested in a separate pytest session with the nbvalx notebooks hooks."""
+
+    conftest = """import nbvalx.pytest_hooks_notebooks
+
+pytest_addoption = nbvalx.pytest_hooks_notebooks.addoption
+pytest_collect_file = nbvalx.pytest_hooks_notebooks.collect_file
+pytest_collection_modifyitems = nbvalx.pytest_hooks_notebooks.collection_modifyitems
+pytest_sessionfinish = nbvalx.pytest_hooks_notebooks.sessionfinish
+pytest_sessionstart = nbvalx.pytest_hooks_notebooks.sessionstart
+pytest_terminal_summary = nbvalx.pytest_hooks_notebooks.terminal_summary
+pytest_testnodedown = nbvalx.pytest_hooks_notebooks.testnodedown
+"""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        (path / "pytest.ini").write_text("[pytest]\n")
+        (path / "conftest.py").write_text(self.conftest)
+        (path / "data").mkdir()
+
+    def write_notebook(self, name: str, sources: list[str]) -> pathlib.Path:
+        """
+        Write a notebook with a code cell for each source in the data directory.
+
+        Cell ids only depend on the position of the cell, so that notebooks may have cells in common.
+        """
+        nb = nbformat.v4.new_notebook()  # type: ignore[no-untyped-call]
+        nb.cells = [
+            nbformat.v4.new_code_cell(source, id=f"cell-{index}")  # type: ignore[no-untyped-call]
+            for (index, source) in enumerate(sources)]
+        nb.metadata.kernelspec = {"display_name": "Python 3", "language": "python", "name": "python3"}
+        notebook_path = self.path / "data" / name
+        with open(notebook_path, "w") as f:
+            nbformat.write(nb, f)  # type: ignore[no-untyped-call]
+        return notebook_path
+
+    def run(self, *args: str) -> subprocess.CompletedProcess[str]:
+        """Run pytest on the data directory, outside of any MPI run in which the unit tests may be running."""
+        env = {
+            key: value for (key, value) in os.environ.items()
+            if not key.startswith(("OMPI_", "PMIX_", "PMI_", "PRTE_", "MPI_"))
+        }
+        return subprocess.run(
+            [sys.executable, "-m", "pytest", "--coverage-run-allow", *args, "data"],
+            cwd=self.path, env=env, capture_output=True, text=True)
+
+    @staticmethod
+    def outcomes(result: subprocess.CompletedProcess[str]) -> list[str]:
+        """
+        Return the outcome of cells from the short test summary of a pytest session run with -rA.
+
+        Skipped cells are not included, since the summary groups them by the location which skipped them.
+        """
+        return sorted(
+            line.split(" - ")[0] for line in result.stdout.splitlines()
+            if line.startswith(("PASSED", "FAILED", "ERROR", "XFAIL")))
@@ -0,0 +1,43 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the combination of coverage data files in the nbvalx.pytest_hooks_notebooks module."""
+
+import os
+import pathlib
+
+import coverage
+import pytest
+
+import nbvalx.pytest_hooks_notebooks
+
+
+def _write_data_file(data_file: pathlib.Path, suffix: str | None, lines: dict[str, list[int]]) -> None:
+    """Write a coverage data file, with the provided suffix, containing the provided lines."""
+    data = coverage.CoverageData(str(data_file), suffix=suffix)
+    data.add_lines(lines)
+    data.write()
+
+
+@pytest.mark.parametrize("cpu_count", [1, 4])
+def test_combine_coverage_data(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, cpu_count: int) -> None:
+    """Unit test to check that data files of notebooks and intermediate files left behind are combined."""
+    monkeypatch.setattr(os, "cpu_count", lambda: cpu_count)
+    data_file = tmp_path / ".coverage"
+    _write_data_file(data_file, None, {str(tmp_path / "existing.py"): [1]})
+    for fragment in range(20):
+        _write_data_file(data_file, f"notebook{fragment}", {str(tmp_path / f"module_{fragment % 5}.py"): [fragment]})
+    # Intermediate files of a previous session, which may be overwritten by worker processes of this session
+    for worker in range(2):
+        _write_data_file(data_file, f"nbvalx{worker}", {str(tmp_path / f"leftover_{worker}.py"): [1]})
+    nbvalx.pytest_hooks_notebooks._combine_coverage_data(str(data_file))
+    assert [path.name for path in tmp_path.iterdir()] == [".coverage"]
+    data = coverage.CoverageData(str(data_file))
+    data.read()
+    assert data.lines(str(tmp_path / "existing.py")) == [1]
+    for module in range(5):
+        assert sorted(data.lines(str(tmp_path / f"module_{module}.py")) or []) == list(range(module, 20, 5))
+    for worker in range(2):
+        assert data.lines(str(tmp_path / f"leftover_{worker}.py")) == [1]
@@ -0,0 +1,60 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the nbvalx.dependencies module."""
+
+import nbformat
+import pytest
+
+import nbvalx.dependencies
+
+
+def test_split_condition_run_if() -> None:
+    """Unit test to check that a run_if magic spanning several lines is split from the code."""
+    cell = nbformat.v4.new_code_cell("%%run_if (\\\n    tag == 1\\\n)\nprint(tag)")  # type: ignore[no-untyped-call]
+    assert nbvalx.dependencies.split_condition(cell) == ("(tag == 1)", "print(tag)")
+
+
+def test_split_condition_keep_if() -> None:
+    """Unit test to check that a keep_if comment is split from the text."""
+    cell = nbformat.v4.new_markdown_cell("<!-- keep_if tag == 1 -->\nSome text")  # type: ignore[no-untyped-call]
+    assert nbvalx.dependencies.split_condition(cell) == ("tag == 1", "Some text")
+
+
+def test_split_condition_none() -> None:
+    """Unit test to check that cells without conditions are not split."""
+    cell = nbformat.v4.new_code_cell("print(1)")  # type: ignore[no-untyped-call]
+    assert nbvalx.dependencies.split_condition(cell) is None
+
+
+@pytest.mark.parametrize("code,reads,stores", [
+    ("a = b + c", {"b", "c"}, {"a"}),
+    ("a.x = b", {"a", "b"}, {"a"}),
+    ("import numpy as np\ndef f(x):\n    return x + y", {"x", "y"}, {"np", "f"}),
+    ("!echo {a}", {"get_ipython", "echo", "a"}, set()),
+    ("%time b = a", {"get_ipython", "time", "a"}, {"b"}),
+    ("a = (", {"a"}, set())
+])
+def test_code_names(code: str, reads: set[str], stores: set[str]) -> None:
+    """Unit test to check the names read and stored by code."""
+    assert nbvalx.dependencies.code_names(code) == (reads, stores)
+
+
+def test_analyze_dependencies() -> None:
+    """Unit test to check that dependencies are propagated through variables defined in previous cells."""
+    cells = [
+        nbformat.v4.new_code_cell("%load_ext nbvalx"),  # type: ignore[no-untyped-call]
+        nbformat.v4.new_code_cell("a = parameter"),  # type: ignore[no-untyped-call]
+        nbformat.v4.new_code_cell("%%run_if tag == 1\nb = 2"),  # type: ignore[no-untyped-call]
+        nbformat.v4.new_code_cell("c = a + b"),  # type: ignore[no-untyped-call]
+        nbformat.v4.new_code_cell("print(c)"),  # type: ignore[no-untyped-call]
+        nbformat.v4.new_markdown_cell("<!-- keep_if other_tag == 2 -->\nSome text"),  # type: ignore[no-untyped-call]
+        nbformat.v4.new_code_cell("print(1)")  # type: ignore[no-untyped-call]
+    ]
+    table = nbvalx.dependencies.analyze_dependencies(cells, ["tag", "other_tag"], ["parameter"])
+    assert [cell.dependencies for cell in table] == [
+        [], ["parameter"], ["tag"], ["parameter", "tag"], ["parameter", "tag"], ["other_tag"], []]
+    assert [cell.reads for cell in table] == [[], ["parameter"], [], [], [], [], []]
+    assert [cell.condition for cell in table] == [[], [], ["tag"], [], [], ["other_tag"], []]
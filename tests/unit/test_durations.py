@@ -0,0 +1,80 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the durations of notebooks and cells in the nbvalx.pytest_hooks_notebooks module."""
+
+import json
+import subprocess
+
+from notebooks_project import NotebooksProject
+
+
+def test_durations(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that the slowest notebooks and cells are reported, and that durations are stored."""
+    notebooks_project.write_notebook("fast.ipynb", ["value = 1"])
+    notebooks_project.write_notebook("slow.ipynb", ["import time\ntime.sleep(1)", "value = 2"])
+    result = notebooks_project.run("--ipynb-durations=1", "--ipynb-durations-report=durations.json")
+    assert result.returncode == 0
+    # The terminal summary reports the generation, the slowest notebook and the slowest cell
+    summary = result.stdout.splitlines()
+    notebooks_line = next(index for (index, line) in enumerate(summary) if " slowest 1 notebooks " in line)
+    assert summary[notebooks_line + 1].endswith("s notebook generation")
+    assert " data/.ipynb_pytest/np_1/collapse_False/slow.ipynb (kernel start: " in summary[notebooks_line + 2]
+    cells_line = next(index for (index, line) in enumerate(summary) if " slowest 1 cells " in line)
+    assert summary[cells_line + 1].endswith(
+        "s data/.ipynb_pytest/np_1/collapse_False/slow.ipynb::Cell 1 (id: cell-0)")
+    assert not any(" by peak RSS " in line for line in summary)
+    # The report contains the durations of every phase of every notebook
+    with open(notebooks_project.path / "durations.json") as f:
+        report = json.load(f)
+    assert report["generation"] > 0
+    assert sorted(report["notebooks"]) == [
+        "data/.ipynb_pytest/np_1/collapse_False/fast.ipynb", "data/.ipynb_pytest/np_1/collapse_False/slow.ipynb"]
+    slow = report["notebooks"]["data/.ipynb_pytest/np_1/collapse_False/slow.ipynb"]
+    assert slow["kernel_start"] > 0
+    assert slow["teardown"] > 0
+    assert sorted(slow["cells"]) == ["Cell 0", "Cell 1", "Cell 2"]
+    assert slow["cells"]["Cell 1"]["id"] == "cell-0"
+    assert slow["cells"]["Cell 1"]["duration"] >= 1
+    assert slow["total"] >= slow["kernel_start"] + slow["teardown"] + slow["cells"]["Cell 1"]["duration"]
+
+
+def test_durations_disabled(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that durations are neither reported nor stored by default."""
+    notebooks_project.write_notebook("notebook.ipynb", ["value = 1"])
+    result = notebooks_project.run()
+    assert result.returncode == 0
+    assert " slowest " not in result.stdout
+    assert not (notebooks_project.path / "durations.json").exists()
+
+
+def _collected_notebooks(result: subprocess.CompletedProcess[str]) -> list[str]:
+    """Return the names of the notebooks in the order in which their cells were collected, as listed by -q."""
+    notebooks = [line.split("::")[0].rsplit("/", 1)[1] for line in result.stdout.splitlines() if "::" in line]
+    return list(dict.fromkeys(notebooks))
+
+
+def test_order_duration(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that notebooks are ordered from the longest to the shortest in previous runs."""
+    notebooks_project.write_notebook("a_fast.ipynb", ["value = 1"])
+    notebooks_project.write_notebook("b_slow.ipynb", ["import time\ntime.sleep(1)"])
+    notebooks_project.write_notebook("c_tags.ipynb", [
+        "%load_ext nbvalx", "%%register_allowed_run_if_tags\ntag: True, False",
+        "%%register_current_run_if_tags\ntag = True", "import time\ntime.sleep(2)"])
+    assert notebooks_project.run("--collapse").returncode == 0
+    assert _collected_notebooks(notebooks_project.run("--collapse", "--collect-only", "-q")) == [
+        "a_fast.ipynb", "b_slow.ipynb", "c_tags[tag=False].ipynb", "c_tags[tag=True].ipynb"]
+    # The notebook which is identical to the slowest one, and hence did not run, is placed right after it
+    assert _collected_notebooks(
+        notebooks_project.run("--collapse", "--collect-only", "-q", "--ipynb-order=duration")) == [
+        "c_tags[tag=False].ipynb", "c_tags[tag=True].ipynb", "b_slow.ipynb", "a_fast.ipynb"]
+    # The duration of a notebook which did not run before is estimated from its size
+    notebooks_project.write_notebook("d_new.ipynb", ["# " + "x" * 100000 + "\nvalue = 1"])
+    assert _collected_notebooks(
+        notebooks_project.run("--collapse", "--collect-only", "-q", "--ipynb-order=duration")) == [
+        "d_new.ipynb", "c_tags[tag=False].ipynb", "c_tags[tag=True].ipynb", "b_slow.ipynb", "a_fast.ipynb"]
+    # Without the pytest cache, durations are estimated from the size of every notebook
+    assert _collected_notebooks(notebooks_project.run(
+        "--collapse", "--collect-only", "-q", "--ipynb-order=duration", "-p", "no:cacheprovider"))[0] == "d_new.ipynb"
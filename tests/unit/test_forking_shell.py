@@ -0,0 +1,90 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the nbvalx.forking_shell module."""
+
+import collections.abc
+import pathlib
+import signal
+
+import pytest
+
+import nbvalx.forking_shell
+
+
+@pytest.fixture
+def shell(tmp_path: pathlib.Path) -> collections.abc.Iterator[nbvalx.forking_shell.ForkingShell]:
+    """Start a forking shell in a temporary directory."""
+    shell = nbvalx.forking_shell.ForkingShell.start(str(tmp_path))
+    yield shell
+    shell.stop()
+
+
+def test_forking_shell_outputs(shell: nbvalx.forking_shell.ForkingShell) -> None:
+    """Unit test to check that streams, displayed objects and results are returned as notebook outputs."""
+    outputs = shell.execute("import sys\nprint('out')\nprint('err', file=sys.stderr)\ndisplay(2)\n3")
+    assert outputs == [
+        {"output_type": "stream", "name": "stdout", "text": "out\n"},
+        {"output_type": "stream", "name": "stderr", "text": "err\n"},
+        {"output_type": "display_data", "data": {"text/plain": "2"}, "metadata": {}},
+        {"output_type": "execute_result", "data": {"text/plain": "3"}, "metadata": {}, "execution_count": 1}
+    ]
+
+
+def test_forking_shell_streams(shell: nbvalx.forking_shell.ForkingShell) -> None:
+    """Unit test to check that output streams behave as text streams, and that requests to clear outputs are ignored."""
+    outputs = shell.execute(
+        "import sys\nimport IPython.display\nprint(sys.stdout.encoding, sys.stdout.writable())\n"
+        "IPython.display.clear_output()\nprint('after clear')")
+    assert outputs == [{"output_type": "stream", "name": "stdout", "text": "utf-8 True\nafter clear\n"}]
+
+
+def test_forking_shell_error(shell: nbvalx.forking_shell.ForkingShell) -> None:
+    """Unit test to check that exceptions are returned as error outputs."""
+    outputs = shell.execute("raise ValueError('wrong value')")
+    assert len(outputs) == 1
+    assert outputs[0]["output_type"] == "error"
+    assert outputs[0]["ename"] == "ValueError"
+    assert outputs[0]["evalue"] == "wrong value"
+    assert len(outputs[0]["traceback"]) > 0
+
+
+def test_forking_shell_fork(shell: nbvalx.forking_shell.ForkingShell) -> None:
+    """Unit test to check that forked shells start from the same state, and then evolve independently."""
+    shell.execute("a = [1]")
+    forked_shell = shell.fork()
+    try:
+        assert forked_shell.pid != shell.pid
+        forked_shell.execute("a.append(2)")
+        assert forked_shell.execute("a")[0]["data"]["text/plain"] == "[1, 2]"
+        assert shell.execute("a")[0]["data"]["text/plain"] == "[1]"
+        forked_forked_shell = forked_shell.fork()
+        try:
+            assert forked_forked_shell.execute("a")[0]["data"]["text/plain"] == "[1, 2]"
+        finally:
+            forked_forked_shell.stop()
+    finally:
+        forked_shell.stop()
+
+
+def test_forking_shell_interrupt(shell: nbvalx.forking_shell.ForkingShell) -> None:
+    """Unit test to check that code which does not complete in time can be interrupted."""
+    with pytest.raises(TimeoutError):
+        shell.execute("import time\ntime.sleep(60)", timeout=0.5)
+    shell.interrupt()
+    outputs = shell.wait(10)
+    assert outputs[-1]["ename"] == "KeyboardInterrupt"
+    assert shell.execute("1 + 1")[0]["data"]["text/plain"] == "2"
+
+
+def test_forking_shell_kill(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that a shell can be killed while executing code, even more than once."""
+    shell = nbvalx.forking_shell.ForkingShell.start(str(tmp_path))
+    with pytest.raises(TimeoutError):
+        shell.execute("import time\ntime.sleep(60)", timeout=0.5)
+    shell.kill()
+    assert shell._process is not None
+    assert shell._process.returncode == -signal.SIGKILL
+    shell.kill()
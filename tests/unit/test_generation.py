@@ -0,0 +1,223 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the generation of notebooks in the work directory in the nbvalx.pytest_hooks_notebooks module."""
+
+import fnmatch
+import pathlib
+
+import nbformat
+import pytest
+from notebooks_project import NotebooksProject
+
+import nbvalx.pytest_hooks_notebooks
+
+_tags_sources = [
+    "%load_ext nbvalx",
+    "%%register_allowed_run_if_tags\nfirst_tag: True, False\nsecond_tag: True, False",
+    "%%register_current_run_if_tags\nfirst_tag = True\nsecond_tag = True",
+    "%%run_if first_tag\nprint('first')",
+    "%%run_if second_tag\nprint('second')"
+]
+
+
+@pytest.mark.parametrize("work_dir", [".ipynb_pytest/np_1/collapse_False", "work"])
+def test_file_system_index(tmp_path: pathlib.Path, work_dir: str) -> None:
+    """Unit test to check that the file system index finds the same entries as a recursive glob."""
+    for path in (
+        "a.ipynb", "data.txt", "sub/b.ipynb", "sub/data/mesh.xdmf", "sub/sub/c.ipynb",
+        ".ipynb_checkpoints/a-checkpoint.ipynb", "sub/.virtual_documents/b.ipynb",
+        f"{work_dir}/a.ipynb", f"{work_dir}/a.log", f"sub/{work_dir}/b.ipynb", f"sub/{work_dir}/data/mesh.xdmf",
+        f"{work_dir}/../np_2/a.ipynb"
+    ):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    index = nbvalx.pytest_hooks_notebooks._FileSystemIndex([tmp_path], work_dir)
+    # Siblings of the work directory (e.g., work directories associated to a different number of processes)
+    # are never visited
+    pruned = (".ipynb_checkpoints", ".virtual_documents", pathlib.PurePath(work_dir).parts[0])
+    source_entries = [
+        path for path in tmp_path.rglob("*") if not any(part in pruned for part in path.relative_to(tmp_path).parts)]
+    work_dir_entries = [
+        path for path in tmp_path.rglob("*")
+        if any(fnmatch.fnmatch(str(parent), f"*/{work_dir}") for parent in path.parents)]
+    assert sorted(index.notebooks(tmp_path)) == sorted(path for path in source_entries if path.suffix == ".ipynb")
+    assert sorted(index.source_entries()) == sorted(source_entries)
+    assert sorted(index.work_dir_entries()) == sorted(work_dir_entries)
+    assert len(index.notebooks(tmp_path)) == (3 if work_dir != "work" else 4)
+    assert len(list(index.work_dir_entries())) == 5
+
+
+def _work_dir_mtimes(work_dir: pathlib.Path) -> dict[str, int]:
+    """Return the modification time of every notebook in the work directory."""
+    return {path.name: path.stat().st_mtime_ns for path in work_dir.glob("*.ipynb")}
+
+
+def test_manifest_up_to_date(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that notebooks are generated again only if the notebook or the options change."""
+    notebook_path = notebooks_project.write_notebook("notebook.ipynb", _tags_sources)
+    work_dir = notebooks_project.path / "data" / "work"
+    notebooks_project.run("--ipynb-action=create-notebooks", "--work-dir=work")
+    mtimes = _work_dir_mtimes(work_dir)
+    assert len(mtimes) == 4
+    assert (work_dir / nbvalx.pytest_hooks_notebooks._GENERATION_MANIFEST).exists()
+    # Nothing has changed: notebooks are not written again
+    notebooks_project.run("--ipynb-action=create-notebooks", "--work-dir=work")
+    assert _work_dir_mtimes(work_dir) == mtimes
+    # A generated notebook was modified: notebooks are written again
+    (work_dir / "notebook[first_tag=True,second_tag=True].ipynb").write_text("{}")
+    notebooks_project.run("--ipynb-action=create-notebooks", "--work-dir=work")
+    new_mtimes = _work_dir_mtimes(work_dir)
+    assert new_mtimes.keys() == mtimes.keys()
+    assert all(new_mtimes[name] != mtimes[name] for name in mtimes)
+    # The options changed: notebooks are written again, and stale notebooks are removed
+    mtimes = new_mtimes
+    notebooks_project.run(
+        "--ipynb-action=create-notebooks", "--work-dir=work", "--variant-strategy=random:2", "--variant-seed=0")
+    new_mtimes = _work_dir_mtimes(work_dir)
+    assert len(new_mtimes) == 2
+    assert new_mtimes.keys() < mtimes.keys()
+    assert all(new_mtimes[name] != mtimes[name] for name in new_mtimes)
+    # The notebook changed: notebooks are written again
+    mtimes = new_mtimes
+    notebook_path.write_text(notebook_path.read_text().replace("print('first')", "print('first!')"))
+    notebooks_project.run(
+        "--ipynb-action=create-notebooks", "--work-dir=work", "--variant-strategy=random:2", "--variant-seed=0")
+    new_mtimes = _work_dir_mtimes(work_dir)
+    assert new_mtimes.keys() == mtimes.keys()
+    assert all(new_mtimes[name] != mtimes[name] for name in new_mtimes)
+
+
+def _generation_options(
+    rootpath: pathlib.Path, np: int = 1, coverage_source: str = "", ipynb_action: str = "create-notebooks",
+    collapse: bool = False
+) -> nbvalx.pytest_hooks_notebooks._GenerationOptions:
+    """Return the generation options associated to the default values of the command line options."""
+    return nbvalx.pytest_hooks_notebooks._GenerationOptions(
+        np=np, coverage_source=coverage_source, coverage_data_file=str(rootpath / ".coverage"),
+        ipynb_action=ipynb_action, collapse=collapse, work_dir="work", keyword="", rootpath=str(rootpath),
+        variant_strategy="full", variant_strength=0, variant_seed=0, dump_dependencies=False, cluster_pool=False,
+        log_max_size=0, ipynb_profile="off", ipynb_memory=False, ipynb_memory_budget=0)
+
+
+def test_manifest_entry_up_to_date(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that manifest entries are stale if the key changes or a notebook is removed or modified."""
+    options = _generation_options(tmp_path)
+    (tmp_path / "a.ipynb").write_text("a")
+    (tmp_path / "b.ipynb").write_text("b")
+    entry = nbvalx.pytest_hooks_notebooks._generation_manifest_entry(
+        "key", [tmp_path / "a.ipynb", tmp_path / "b.ipynb"], options)
+    is_up_to_date = nbvalx.pytest_hooks_notebooks._is_generation_manifest_entry_up_to_date
+    assert is_up_to_date(entry, "key", tmp_path)
+    assert not is_up_to_date(None, "key", tmp_path)
+    assert not is_up_to_date(entry, "other key", tmp_path)
+    (tmp_path / "b.ipynb").write_text("bb")
+    assert not is_up_to_date(entry, "key", tmp_path)
+    (tmp_path / "b.ipynb").unlink()
+    assert not is_up_to_date(entry, "key", tmp_path)
+
+
+def test_generate_workers(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that notebooks generated by several worker processes are the same as the serial ones."""
+    notebooks_project.write_notebook("first.ipynb", _tags_sources)
+    notebooks_project.write_notebook("second.ipynb", [*_tags_sources, "print('third')"])
+    notebooks_project.write_notebook("third.ipynb", ["print('no tags')"])
+    work_dirs = {
+        generate_workers: notebooks_project.path / "data" / f"work_{generate_workers}" for generate_workers in (1, 2)}
+    for (generate_workers, work_dir) in work_dirs.items():
+        notebooks_project.run(
+            "--ipynb-action=create-notebooks", f"--work-dir={work_dir.name}", f"--generate-workers={generate_workers}")
+    notebooks = [
+        {path.name: path.read_text() for path in work_dir.glob("*.ipynb")} for work_dir in work_dirs.values()]
+    assert len(notebooks[0]) == 9
+    assert notebooks[0] == notebooks[1]
+
+
+@pytest.mark.parametrize("np", [1, 2])
+@pytest.mark.parametrize("coverage_source", ["", "nbvalx"])
+@pytest.mark.parametrize("ipynb_action", ["create-notebooks", "collect-notebooks"])
+@pytest.mark.parametrize("uses_ipyparallel", [False, True])
+def test_keyword_matcher_injected_cells(
+    tmp_path: pathlib.Path, np: int, coverage_source: str, ipynb_action: str, uses_ipyparallel: bool
+) -> None:
+    """Unit test to check that the number of injected cells matches the cells added to the generated notebooks."""
+    notebooks_project = NotebooksProject(tmp_path)
+    notebook_path = notebooks_project.write_notebook(
+        "notebook.ipynb", [*_tags_sources, "%%px\nprint('px')" if uses_ipyparallel else "print('no px')"])
+    options = _generation_options(tmp_path, np, coverage_source, ipynb_action)
+    (nb_copies, _) = nbvalx.pytest_hooks_notebooks._generate_notebook_copies(notebook_path, options)
+    nb = nbformat.read(notebook_path, as_version=4)  # type: ignore[no-untyped-call]
+    injected_cells = nbvalx.pytest_hooks_notebooks._KeywordMatcher.injected_cells(nb, options)
+    assert len(nb_copies) == 4
+    for nb_copy in nb_copies.values():
+        assert sum(cell.cell_type == "code" for cell in nb_copy.cells) == len(nb.cells) + injected_cells
+
+
+def test_keyword_matcher(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that the keyword expression is matched against directories, notebook and cell names."""
+    keyword_matcher = nbvalx.pytest_hooks_notebooks._KeywordMatcher("sub and 2 and not other", tmp_path, 3)
+    assert keyword_matcher(tmp_path / "sub" / "notebook.ipynb")
+    assert keyword_matcher(tmp_path / "sub" / "work" / ".." / "notebook.ipynb")
+    assert not keyword_matcher(tmp_path / "sub" / "other.ipynb")
+    assert not keyword_matcher(tmp_path / "notebook.ipynb")
+    # Only the cells up to the number of cells passed to the matcher are considered
+    keyword_matcher = nbvalx.pytest_hooks_notebooks._KeywordMatcher("3", tmp_path, 3)
+    assert not keyword_matcher(tmp_path / "notebook.ipynb")
+    keyword_matcher = nbvalx.pytest_hooks_notebooks._KeywordMatcher("3", tmp_path, 4)
+    assert keyword_matcher(tmp_path / "notebook.ipynb")
+    # An empty keyword expression matches every notebook
+    keyword_matcher = nbvalx.pytest_hooks_notebooks._KeywordMatcher("", tmp_path, 0)
+    assert keyword_matcher(tmp_path / "notebook.ipynb")
+
+
+def test_collapse_aliases(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that notebooks which are identical after collapsing are aliases, despite their names."""
+    notebooks_project = NotebooksProject(tmp_path)
+    notebook_path = notebooks_project.write_notebook("notebook.ipynb", [
+        *_tags_sources[:3], '__notebook_basename__ = "notebook.ipynb"\n__notebook_dirname__ = ""',
+        "%%run_if first_tag\nprint('first')"])
+    options = _generation_options(tmp_path, ipynb_action="collect-notebooks", collapse=True)
+    (nb_copies, _) = nbvalx.pytest_hooks_notebooks._generate_notebook_copies(notebook_path, options)
+    aliases = {
+        nb_copy_path.name: nb_copy.metadata["nbvalx"].get("alias_of", None)
+        for (nb_copy_path, nb_copy) in nb_copies.items()}
+    # The value of second_tag does not affect any cell, hence notebooks only differ by the notebook name
+    assert aliases == {
+        "notebook[first_tag=False,second_tag=False].ipynb": None,
+        "notebook[first_tag=False,second_tag=True].ipynb": "notebook[first_tag=False,second_tag=False].ipynb",
+        "notebook[first_tag=True,second_tag=False].ipynb": None,
+        "notebook[first_tag=True,second_tag=True].ipynb": "notebook[first_tag=True,second_tag=False].ipynb"
+    }
+    for (nb_copy_path, nb_copy) in nb_copies.items():
+        assert any(f'__notebook_basename__ = "{nb_copy_path.name}"' in cell.source for cell in nb_copy.cells)
+
+
+@pytest.mark.parametrize("collapse", [False, True])
+def test_shared_cells(tmp_path: pathlib.Path, collapse: bool) -> None:
+    """Unit test to check that generated notebooks share unchanged cells, and only copy the rewritten ones."""
+    notebooks_project = NotebooksProject(tmp_path)
+    notebook_path = notebooks_project.write_notebook("notebook.ipynb", [*_tags_sources, "# PYTEST_XFAIL\nassert False"])
+    nb = nbformat.read(notebook_path, as_version=4)  # type: ignore[no-untyped-call]
+    options = _generation_options(tmp_path, collapse=collapse)
+    (nb_copies, _) = nbvalx.pytest_hooks_notebooks._generate_notebook_copies(notebook_path, options)
+    nb_copies_cells = {nb_copy_path.name: nb_copy.cells for (nb_copy_path, nb_copy) in nb_copies.items()}
+    first_cells = nb_copies_cells["notebook[first_tag=True,second_tag=True].ipynb"]
+    second_cells = nb_copies_cells["notebook[first_tag=True,second_tag=False].ipynb"]
+    if not collapse:
+        # Cells are shared, except for the ones in which the current tags or the xfail comment are replaced
+        assert [cell.source for cell in first_cells[:2]] == [cell.source for cell in nb.cells[:2]]
+        assert all(first_cell is second_cell for (first_cell, second_cell) in zip(first_cells[:2], second_cells[:2]))
+        assert all(first_cell is second_cell for (first_cell, second_cell) in zip(first_cells[3:5], second_cells[3:5]))
+        assert first_cells[2].source.endswith("second_tag = True")
+        assert second_cells[2].source.endswith("second_tag = False")
+        assert first_cells[5] is not second_cells[5]
+        assert first_cells[5].source == second_cells[5].source != nb.cells[5].source
+        # Cells which are copied still share every other attribute
+        assert first_cells[2].metadata is second_cells[2].metadata
+    else:
+        # The cell collapsed from the run_if condition on first_tag is shared
+        assert [cell.source for cell in first_cells[:2]] == ["print('first')", "print('second')"]
+        assert second_cells[0].source == "print('first')"
+        assert first_cells[0] is second_cells[0]
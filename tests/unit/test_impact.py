@@ -0,0 +1,40 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the selection of impacted notebooks in the nbvalx.pytest_hooks_notebooks module."""
+
+import pathlib
+
+import coverage
+
+import nbvalx.pytest_hooks_notebooks
+
+
+def test_impact_selector(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that notebooks are selected according to the coverage contexts of their cells."""
+    work_dir = tmp_path / "data" / "work"
+    data = coverage.CoverageData(str(tmp_path / ".coverage"))
+    data.set_context("data/work/notebook[tag=a].ipynb::a1b2")
+    data.add_lines({str(tmp_path / "module_a.py"): [1, 2], str(tmp_path / "module_c.py"): [1]})
+    data.set_context("data/work/notebook[tag=b].ipynb::a1b2")
+    data.add_lines({str(tmp_path / "module_b.py"): [1], str(tmp_path / "module_c.py"): [2]})
+    data.set_context("data/work/other.ipynb::c3d4")
+    data.add_lines({str(tmp_path / "module_b.py"): [2]})
+    data.write()
+
+    def impacted(changed_files: list[pathlib.Path]) -> list[str]:
+        """Return the names of the impacted notebooks."""
+        impact_selector = nbvalx.pytest_hooks_notebooks._ImpactSelector(
+            str(tmp_path / ".coverage"), changed_files, "work", tmp_path)
+        return [
+            name for name in ("notebook[tag=a].ipynb", "notebook[tag=b].ipynb", "other.ipynb", "new.ipynb")
+            if impact_selector.is_impacted(work_dir / name)]
+
+    assert impacted([]) == ["new.ipynb"]
+    assert impacted([tmp_path / "module_a.py"]) == ["notebook[tag=a].ipynb", "new.ipynb"]
+    assert impacted([tmp_path / "module_b.py"]) == ["notebook[tag=b].ipynb", "other.ipynb", "new.ipynb"]
+    assert impacted([tmp_path / "module_c.py"]) == ["notebook[tag=a].ipynb", "notebook[tag=b].ipynb", "new.ipynb"]
+    assert impacted([tmp_path / "data" / "notebook.ipynb"]) == [
+        "notebook[tag=a].ipynb", "notebook[tag=b].ipynb", "new.ipynb"]
@@ -0,0 +1,84 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the kernel pool in the nbvalx.pytest_hooks_notebooks module."""
+
+import pathlib
+
+import pytest
+
+import nbvalx.pytest_hooks_notebooks
+
+
+def test_kernel_pool_reset(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that a kernel is reused after a reset, and that preloaded modules are kept."""
+    (tmp_path / "local_module.py").write_text("value = 1")
+    kernel_pool = nbvalx.pytest_hooks_notebooks._KernelPool(1, 60, ["json"], "reset")
+    try:
+        kernel = kernel_pool.acquire("python3", str(tmp_path))
+        kernel_pool._execute(kernel, "import local_module\nvalue = local_module.value")
+        kernel_pool._execute(kernel, "get_ipython().extension_manager.load_extension('nbvalx')")
+        kernel_pool.release(kernel)
+        reused_kernel = kernel_pool.acquire("python3", str(tmp_path))
+        assert reused_kernel is kernel
+        kernel_pool._execute(reused_kernel, "assert 'value' not in globals()")
+        kernel_pool._execute(reused_kernel, "import sys\nassert 'local_module' not in sys.modules")
+        kernel_pool._execute(reused_kernel, "import sys\nassert 'json' in sys.modules")
+        kernel_pool._execute(
+            reused_kernel, "assert 'nbvalx' not in get_ipython().extension_manager.loaded")
+        # A failing reset causes the kernel to be restarted
+        kernel_pool._execute(reused_kernel, "del get_ipython().nbvalx_kernel_pool_extensions")
+        kernel_pool.release(reused_kernel)
+        restarted_kernel = kernel_pool.acquire("python3", str(tmp_path))
+        assert restarted_kernel is not kernel
+        kernel_pool.release(restarted_kernel)
+    finally:
+        kernel_pool.shutdown()
+    assert not kernel.is_alive()
+    assert not restarted_kernel.is_alive()
+
+
+def test_kernel_pool_restart(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that a kernel is replaced by a new one with the restart policy or if it died."""
+    kernel_pool = nbvalx.pytest_hooks_notebooks._KernelPool(1, 60, [], "restart")
+    try:
+        kernel = kernel_pool.acquire("python3", str(tmp_path))
+        kernel_pool._execute(kernel, "value = 1")
+        kernel_pool.release(kernel)
+        restarted_kernel = kernel_pool.acquire("python3", str(tmp_path))
+        assert restarted_kernel is not kernel
+        assert not kernel.is_alive()
+        kernel_pool._execute(restarted_kernel, "assert 'value' not in globals()")
+        kernel_pool._execute(restarted_kernel, "import os\nassert os.getcwd() == " + repr(str(tmp_path)))
+    finally:
+        kernel_pool.shutdown()
+    # A kernel released after the shutdown is stopped immediately
+    kernel_pool.release(restarted_kernel)
+    assert not restarted_kernel.is_alive()
+
+
+def test_kernel_pool_dead_kernel(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that a kernel which died is replaced by a new one even with the reset policy."""
+    kernel_pool = nbvalx.pytest_hooks_notebooks._KernelPool(1, 60, [], "reset")
+    try:
+        kernel = kernel_pool.acquire("python3", str(tmp_path))
+        kernel.stop()
+        kernel_pool.release(kernel)
+        restarted_kernel = kernel_pool.acquire("python3", str(tmp_path))
+        assert restarted_kernel is not kernel
+        assert restarted_kernel.is_alive()
+        kernel_pool.release(restarted_kernel)
+    finally:
+        kernel_pool.shutdown()
+
+
+def test_kernel_pool_startup_failure(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that a failure while starting a kernel is raised to the notebook acquiring it."""
+    kernel_pool = nbvalx.pytest_hooks_notebooks._KernelPool(2, 60, ["nbvalx_missing_module"], "reset")
+    try:
+        with pytest.raises(RuntimeError, match="No module named 'nbvalx_missing_module'"):
+            kernel_pool.acquire("python3", str(tmp_path))
+    finally:
+        kernel_pool.shutdown()
@@ -0,0 +1,138 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the writing of log files in the nbvalx.pytest_hooks_notebooks module."""
+
+import gzip
+import json
+import pathlib
+
+import nbformat
+from notebooks_project import NotebooksProject
+
+import nbvalx.pytest_hooks_notebooks
+
+
+def test_truncate_text_short() -> None:
+    """Unit test to check that texts within the maximum size are not truncated."""
+    text = "".join(f"line {i}\n" for i in range(10))
+    assert nbvalx.pytest_hooks_notebooks._truncate_text(text, len(text)) == text
+
+
+def test_truncate_text_long() -> None:
+    """Unit test to check that the beginning and the end of long texts are retained, cutting at line boundaries."""
+    text = "".join(f"line {i}\n" for i in range(1000))
+    truncated = nbvalx.pytest_hooks_notebooks._truncate_text(text, 100)
+    lines = truncated.splitlines()
+    assert lines[0] == "line 0"
+    assert lines[-1] == "line 999"
+    assert len([line for line in lines if line.startswith("[... ")]) == 1
+    assert all(line + "\n" in text for line in lines if not line.startswith("[... "))
+    assert len(truncated) < 150
+
+
+def test_log_writer_max_size(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that log files larger than the maximum size are truncated after writing sections."""
+    log_file = tmp_path / "notebook.log"
+    log_file.write_text("".join(f"output {i}\n" for i in range(1000)))
+    log_writer = nbvalx.pytest_hooks_notebooks._LogWriter(str(tmp_path / "notebook"), 200)
+    log_writer.write("Cell ID", "a1b2")
+    log_writer.close()
+    log = log_file.read_text()
+    assert log.startswith("output 0\n")
+    assert log.endswith("Cell ID:\na1b2\n\n")
+    assert len(log) < 250
+
+
+def test_log_writer_sections(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that sections are buffered, and then written to the log file of every process."""
+    log_writer = nbvalx.pytest_hooks_notebooks._LogWriter(str(tmp_path / "notebook"))
+    # Sections written before the log files exist are dropped, and do not create any log file
+    log_writer.write("Cell name", "Cell 0")
+    log_writer.flush()
+    assert list(tmp_path.iterdir()) == []
+    log_files = [tmp_path / "notebook.log", tmp_path / "notebook.log-1"]
+    for log_file in log_files:
+        log_file.write_text("")
+    (tmp_path / "notebook.log.ipynb").write_text("{}")
+    log_writer.write("Cell name", "Cell 1")
+    log_writer.write("Output (jupyter)", "")
+    assert all(log_file.read_text() == "" for log_file in log_files)
+    log_writer.flush()
+    for log_file in log_files:
+        assert log_file.read_text() == "Cell name:\nCell 1\n\nOutput (jupyter):\n\n"
+    assert (tmp_path / "notebook.log.ipynb").read_text() == "{}"
+    # Log files are opened only once, hence log files created afterwards are not written
+    (tmp_path / "notebook.log-2").write_text("")
+    log_writer.write("Cell ID", "a1b2")
+    log_writer.close()
+    for log_file in log_files:
+        assert log_file.read_text().endswith("Cell ID:\na1b2\n\n")
+    assert (tmp_path / "notebook.log-2").read_text() == ""
+
+
+def test_text_log_files(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that only the text log files of every process are found, and not other log files."""
+    for suffix in (".log", ".log-1", ".log-12", ".log.gz", ".log-1.gz", ".log.ipynb", ".logs", ".log-a", ".log.gz.1"):
+        (tmp_path / ("notebook" + suffix)).write_text("")
+    assert nbvalx.pytest_hooks_notebooks._text_log_files(str(tmp_path / "notebook")) == [
+        str(tmp_path / "notebook.log"), str(tmp_path / "notebook.log-1"), str(tmp_path / "notebook.log-12")]
+    assert nbvalx.pytest_hooks_notebooks._text_log_files(str(tmp_path / "notebook"), compressed=True) == [
+        str(tmp_path / "notebook.log-1.gz"), str(tmp_path / "notebook.log.gz")]
+
+
+def test_log_compress(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that compressed log files of a previous run are replaced, rather than written to."""
+    notebooks_project.write_notebook("notebook.ipynb", ["for i in range(1000):\n    print('output', i)"])
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_False"
+    for _ in range(2):
+        assert notebooks_project.run("--log-compress", "--log-max-size=1000").returncode == 0
+        assert not (work_dir / "notebook.log").exists()
+        with gzip.open(work_dir / "notebook.log.gz", "rt") as f:
+            log = f.read()
+        assert log.count("Output (stdout):") == 1
+        assert "output 0\n" in log
+        assert "output 999\n" in log
+        assert "characters dropped" in log
+        assert len(log) < 2000
+    # Compressed log files of a previous run are removed when running again without compression
+    assert notebooks_project.run().returncode == 0
+    assert (work_dir / "notebook.log").exists()
+    assert not (work_dir / "notebook.log.gz").exists()
+
+
+def test_log_compress_aliases(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that notebooks which are identical to a notebook which was run get its compressed logs."""
+    notebooks_project.write_notebook("notebook.ipynb", [
+        "%load_ext nbvalx", "%%register_allowed_run_if_tags\ntag: True, False",
+        "%%register_current_run_if_tags\ntag = True", "print('output')"])
+    assert notebooks_project.run("--collapse", "--log-compress").returncode == 0
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_True"
+    for tag in (True, False):
+        with gzip.open(work_dir / f"notebook[tag={tag}].log.gz", "rt") as f:
+            assert "output\n" in f.read()
+
+
+def test_log_ipynb_spill_size(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that large outputs are stored in separate files, one for each mime type."""
+    notebooks_project.write_notebook("notebook.ipynb", [
+        "print('x' * 100)",
+        "import IPython.display\n"
+        "IPython.display.display({'application/vnd.first+json': {'value': 'y' * 100}, "
+        "'application/vnd.second+json': {'value': 'z' * 100}, 'text/plain': 'short'}, raw=True)"])
+    assert notebooks_project.run("--log-ipynb-spill-size=50").returncode == 0
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_False"
+    log_nb = nbformat.read(work_dir / "notebook.log.ipynb", as_version=4)  # type: ignore[no-untyped-call]
+    (stream_output, ) = log_nb.cells[-2].outputs
+    (stream_file, ) = (work_dir / "notebook.outputs").glob(f"cell_{len(log_nb.cells) - 2}_*.txt")
+    assert stream_output.text == f"[stdout stored in notebook.outputs/{stream_file.name}]\n"
+    assert stream_file.read_text() == "x" * 100 + "\n"
+    (data_output, ) = log_nb.cells[-1].outputs
+    assert data_output.data == {"text/plain": "short"}
+    spilled = data_output.metadata.nbvalx.spilled
+    assert sorted(spilled) == ["application/vnd.first+json", "application/vnd.second+json"]
+    assert len(set(spilled.values())) == 2
+    for (mime, content) in (("application/vnd.first+json", "y"), ("application/vnd.second+json", "z")):
+        assert (work_dir / spilled[mime]).read_text() == json.dumps({"value": content * 100})
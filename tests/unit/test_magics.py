@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 """Unit test for the functions behind the jupyter magics."""
 
+import pathlib
 import typing
 
 import IPython
@@ -38,6 +39,7 @@ class MockIPythonShell:
         self.magics_manager = MockMagicsManager()
         self.custom_exc_manager: dict[
             tuple[type[BaseException]], typing.Callable[[typing.Any], typing.Any]] = dict()
+        self.input_transformers_cleanup: list[typing.Callable[[list[str]], list[str]]] = list()
         self.cell = ""
 
     def register_magic_function(
@@ -344,6 +346,87 @@ def test_run_if_single_condition_false(
     nbvalx.jupyter_magics.unload_ipython_extension(mock_ipython)  # type: ignore[arg-type]
 
 
+@pytest.mark.parametrize(
+    "tag_values,tag_condition,expected", [
+        ([True, False], "tag is True", [True, False]),
+        ([1, 2, 3], "tag**2 > 1 and tag < 3", [False, True, False]),
+        (["a", "b"], "tag + '!' == 'a!'", [True, False])
+    ]
+)
+def test_evaluate_condition(tag_values: list[bool | int | str], tag_condition: str, expected: list[bool]) -> None:
+    """Check evaluating a condition for several values of the current tags at once."""
+    assert nbvalx.jupyter_magics.IPythonExtension.evaluate_condition(
+        tag_condition, [{"tag": tag_value} for tag_value in tag_values]) == expected
+
+
+def test_evaluate_condition_parses_once() -> None:
+    """Check that the same condition is parsed only once."""
+    nbvalx.jupyter_magics.IPythonExtension._parse_condition.cache_clear()
+    for _ in range(3):
+        nbvalx.jupyter_magics.IPythonExtension.evaluate_condition("tag == 1", [{"tag": 1}, {"tag": 2}])
+    cache_info = nbvalx.jupyter_magics.IPythonExtension._parse_condition.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 2
+
+
+def test_transform_cache_marker() -> None:
+    """Check that a cell starting with the cache marker is transformed into a cell running the cache magic."""
+    transform = nbvalx.jupyter_magics.IPythonExtension.transform_cache_marker
+    assert transform(["# NBVALX_CACHE: a, b\n", "a = 1\n", "b = 2\n"]) == [
+        "%%cache_variables a, b\n", "a = 1\n", "b = 2\n"]
+    assert transform(["# A comment\n", "# NBVALX_CACHE: a\n", "a = 1\n"]) == [
+        "# A comment\n", "# NBVALX_CACHE: a\n", "a = 1\n"]
+
+
+def test_cache_variables(tmp_path: pathlib.Path) -> None:
+    """Check that variables are restored from the cache as long as the tags the cell depends on are unchanged."""
+    namespace: dict[str, typing.Any] = dict()
+    runs = list()
+
+    def runner(code: str) -> None:
+        """Define the variable, counting how many times the cell was run."""
+        runs.append(code)
+        namespace["a"] = [len(runs)]
+
+    def cache_variables(line: str, current_tags: dict[str, bool | int | str]) -> None:
+        """Run the cache magic on an empty namespace."""
+        namespace.clear()
+        nbvalx.jupyter_magics.IPythonExtension.cache_variables(
+            line, "a = ...", current_tags, namespace, runner, str(tmp_path))
+
+    cache_variables("a (depends on: tag1)", {"tag1": 1, "tag2": 1})
+    assert namespace["a"] == [1]
+    cache_variables("a (depends on: tag1)", {"tag1": 1, "tag2": 2})
+    assert namespace["a"] == [1]
+    cache_variables("a (depends on: tag1)", {"tag1": 2, "tag2": 2})
+    assert namespace["a"] == [2]
+    cache_variables("a", {"tag1": 2, "tag2": 1})
+    assert namespace["a"] == [3]
+    cache_variables("a", {"tag1": 2, "tag2": 1})
+    assert namespace["a"] == [3]
+    assert len(runs) == 3
+
+
+def test_cache_variables_missing_variable(tmp_path: pathlib.Path) -> None:
+    """Check that an error is raised if the cell does not define a variable to be cached."""
+    with pytest.raises(RuntimeError, match="Variables b were not defined by the cell"):
+        nbvalx.jupyter_magics.IPythonExtension.cache_variables(
+            "a, b", "a = 1", {}, {"a": 1}, lambda code: None, str(tmp_path))
+
+
+def test_cache_variables_eviction(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that the least recently used entries are evicted when the cache grows too large."""
+    namespace = {"a": "x" * 1000}
+    for code in ("a = 1", "a = 2", "a = 3"):
+        nbvalx.jupyter_magics.IPythonExtension.cache_variables(
+            "a", code, {}, namespace, lambda code: None, str(tmp_path))
+    assert len(list(tmp_path.glob("*.pickle"))) == 3
+    monkeypatch.setenv("NBVALX_CELL_CACHE_SIZE", "2500")
+    nbvalx.jupyter_magics.IPythonExtension.cache_variables(
+        "a", "a = 4", {}, namespace, lambda code: None, str(tmp_path))
+    assert len(list(tmp_path.glob("*.pickle"))) == 2
+
+
 @pytest.mark.parametrize(
     "register_allowed_magic_entries_function_name,register_current_magic_entries_function_name,"
     "allowed_magic_entries_dict_name,current_magic_entries_dict_name",
@@ -0,0 +1,48 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the memory usage of cells in the nbvalx.pytest_hooks_notebooks module."""
+
+import json
+
+from notebooks_project import NotebooksProject
+
+
+def test_memory_budget(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that cells whose peak resident set size exceeds the budget fail, and that usage is stored."""
+    notebooks_project.write_notebook(
+        "notebook.ipynb", ["value = 1", "data = b'x' * (300 * 2**20)", "del data"])
+    result = notebooks_project.run(
+        "-rA", "--ipynb-memory-budget=250", "--ipynb-durations=1", "--ipynb-durations-report=durations.json")
+    assert result.returncode == 1
+    assert NotebooksProject.outcomes(result) == [
+        "FAILED data/.ipynb_pytest/np_1/collapse_False/notebook.ipynb::Cell 2",
+        "PASSED data/.ipynb_pytest/np_1/collapse_False/notebook.ipynb::Cell 0",
+        "PASSED data/.ipynb_pytest/np_1/collapse_False/notebook.ipynb::Cell 1"]
+    assert "MemoryError" in result.stdout
+    assert " MiB exceeds the memory budget of 250 MiB" in result.stdout
+    # The terminal summary reports the cell using most memory
+    summary = result.stdout.splitlines()
+    memory_line = next(index for (index, line) in enumerate(summary) if " largest 1 cells by peak RSS " in line)
+    assert summary[memory_line + 1].endswith(
+        "MiB data/.ipynb_pytest/np_1/collapse_False/notebook.ipynb::Cell 2 (id: cell-1, rank: 0)")
+    # The memory usage of every cell is stored in the report and in the log file
+    with open(notebooks_project.path / "durations.json") as f:
+        cells = json.load(f)["notebooks"]["data/.ipynb_pytest/np_1/collapse_False/notebook.ipynb"]["cells"]
+    assert cells["Cell 2"]["memory"]["0"]["peak_rss"] > 300 * 2**20
+    assert sorted(cells["Cell 2"]["memory"]["0"]) == ["peak_rss", "python_blocks_change", "rss_change"]
+    assert cells["Cell 1"]["memory"]["0"]["peak_rss"] < 250 * 2**20
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_False"
+    assert (work_dir / "notebook.log").read_text().count("Memory:\npeak RSS: ") == 2
+
+
+def test_memory_disabled(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that the memory usage is not recorded by default."""
+    notebooks_project.write_notebook("notebook.ipynb", ["data = b'x' * (300 * 2**20)"])
+    result = notebooks_project.run("--ipynb-durations=1")
+    assert result.returncode == 0
+    assert " by peak RSS " not in result.stdout
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_False"
+    assert not (work_dir / "notebook.memory").exists()
@@ -0,0 +1,80 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for running once the cells which notebooks share at their beginning in nbvalx.pytest_hooks_notebooks."""
+
+import pytest
+from notebooks_project import NotebooksProject
+
+_tags_sources = [
+    "%load_ext nbvalx",
+    "%%register_allowed_run_if_tags\nfirst_tag: True, False\nsecond_tag: True, False",
+    "%%register_current_run_if_tags\nfirst_tag = True\nsecond_tag = True",
+    "print('shared')",
+    "# NBVAL_SKIP\nassert False",
+    "%%run_if first_tag\nprint('first')",
+    "%%run_if not first_tag\nassert False",
+    "%%run_if second_tag\nprint('second')"
+]
+
+
+@pytest.mark.parametrize("collapse", [False, True])
+def test_prefix_sharing(notebooks_project: NotebooksProject, collapse: bool) -> None:
+    """Unit test to check that sharing cells among notebooks reports the same outcomes as running them separately."""
+    notebooks_project.write_notebook("tags.ipynb", _tags_sources)
+    # The first notebook is a prefix of the second one, and both have a prefix in common with the third one
+    notebooks_project.write_notebook("a_prefix.ipynb", ["value = 1"])
+    notebooks_project.write_notebook("b_prefix.ipynb", ["value = 1", "assert value == 1", "value = 2"])
+    notebooks_project.write_notebook("c_prefix.ipynb", ["value = 1", "assert value == 1", "assert value == 1"])
+    options = ["-rA", "--collapse"] if collapse else ["-rA"]
+    separate = notebooks_project.run(*options)
+    shared = notebooks_project.run(*options, "--prefix-sharing")
+    assert separate.returncode == shared.returncode == 1
+    assert NotebooksProject.outcomes(shared) == NotebooksProject.outcomes(separate)
+    assert len([outcome for outcome in NotebooksProject.outcomes(shared) if outcome.startswith("FAILED")]) == 2
+    # Log files of the notebooks which did not run the cells in common contain the outputs of those cells
+    for log_path in (notebooks_project.path / "data").glob(f".ipynb_pytest/np_1/collapse_{collapse}/tags*.log"):
+        assert "shared" in log_path.read_text()
+
+
+def test_prefix_sharing_timeout(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that cells which time out are interrupted, or killed if they cannot be interrupted."""
+    notebooks_project.write_notebook("interrupt.ipynb", ["import time\ntime.sleep(30)"])
+    notebooks_project.write_notebook(
+        "kill.ipynb", ["import signal\nimport time\nsignal.signal(signal.SIGINT, signal.SIG_IGN)\ntime.sleep(30)"])
+    result = notebooks_project.run("-rA", "--prefix-sharing", "--nbval-cell-timeout=1")
+    assert result.returncode == 1
+    assert "Timeout of 1 seconds exceeded executing cell" in result.stdout
+    assert "Failed to interrupt kernel in 5 seconds" in result.stdout
+
+
+def test_prefix_sharing_shell_died(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that notebooks which share a cell after which the shell died report it as dead."""
+    notebooks_project.write_notebook("notebook.ipynb", [
+        "%load_ext nbvalx", "%%register_allowed_run_if_tags\ntag: True, False",
+        "%%register_current_run_if_tags\ntag = True", "import os\nos._exit(1)", "%%run_if tag\nprint('tag')"])
+    result = notebooks_project.run("-rA", "--collapse", "--prefix-sharing")
+    assert result.returncode == 1
+    assert NotebooksProject.outcomes(result) == [
+        "FAILED data/.ipynb_pytest/np_1/collapse_True/notebook[tag=False].ipynb::Cell 1",
+        "FAILED data/.ipynb_pytest/np_1/collapse_True/notebook[tag=True].ipynb::Cell 1",
+        "FAILED data/.ipynb_pytest/np_1/collapse_True/notebook[tag=True].ipynb::Cell 2",
+        "PASSED data/.ipynb_pytest/np_1/collapse_True/notebook[tag=False].ipynb::Cell 0",
+        "PASSED data/.ipynb_pytest/np_1/collapse_True/notebook[tag=True].ipynb::Cell 0"]
+    # The cell was run only once, hence the second notebook finds that the shell left behind is dead
+    assert result.stdout.count("pytest plugin exception: Kernel died while executing cell") == 2
+    assert result.stdout.count("pytest plugin exception: Kernel dead on test start") == 1
+
+
+def test_prefix_sharing_interrupted(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that shells left behind for notebooks which never ran are stopped on interruption."""
+    notebooks_project.write_notebook("a_failing.ipynb", ["value = 1", "assert value == 2"])
+    notebooks_project.write_notebook("b_passing.ipynb", ["value = 1", "assert value == 1"])
+    result = notebooks_project.run("-rA", "-x", "--prefix-sharing")
+    assert result.returncode == 1
+    assert NotebooksProject.outcomes(result) == [
+        "FAILED data/.ipynb_pytest/np_1/collapse_False/a_failing.ipynb::Cell 2",
+        "PASSED data/.ipynb_pytest/np_1/collapse_False/a_failing.ipynb::Cell 0",
+        "PASSED data/.ipynb_pytest/np_1/collapse_False/a_failing.ipynb::Cell 1"]
@@ -0,0 +1,63 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the nbvalx.profiles module."""
+
+import cProfile
+import pathlib
+import tracemalloc
+
+import nbvalx.profiles
+
+
+def _store_cprofile(profile_file: pathlib.Path) -> None:
+    """Profile a function which builds a list, and store the profile."""
+    profile = cProfile.Profile()
+    profile.enable()
+    sorted(range(100000), key=lambda value: -value)
+    profile.disable()
+    profile.dump_stats(str(profile_file))
+
+
+def _store_tracemalloc(profile_file: pathlib.Path) -> list[int]:
+    """Build a list while tracing memory allocations, and store a snapshot."""
+    tracemalloc.start()
+    values = list(range(100000))
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    snapshot.dump(str(profile_file))
+    return values
+
+
+def test_read_cell_profile(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that profiles stored by cProfile and by tracemalloc can be read."""
+    _store_cprofile(tmp_path / "a1b2.prof")
+    cell_profile = nbvalx.profiles.read_cell_profile(tmp_path / "a1b2.prof")
+    assert cell_profile.cell == "a1b2"
+    assert cell_profile.total > 0
+    assert any("<lambda>" in entry for entry in cell_profile.entries)
+    _store_tracemalloc(tmp_path / "c3d4-0.tracemalloc")
+    cell_profile = nbvalx.profiles.read_cell_profile(tmp_path / "c3d4-0.tracemalloc")
+    assert cell_profile.cell == "c3d4-0"
+    assert cell_profile.total > 100000 * 28
+    assert any("test_profiles.py" in entry for entry in cell_profile.entries)
+
+
+def test_summarize(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that profiles are grouped by notebook, by variant and by cell."""
+    for variant in ("notebook[tag=a]", "notebook[tag=b]"):
+        (tmp_path / "work" / f"{variant}.profile").mkdir(parents=True)
+        _store_cprofile(tmp_path / "work" / f"{variant}.profile" / "a1b2.prof")
+        _store_tracemalloc(tmp_path / "work" / f"{variant}.profile" / "c3d4.tracemalloc")
+    profiles = nbvalx.profiles.find_profiles([tmp_path])
+    assert list(profiles.keys()) == [str(tmp_path / "work" / "notebook")]
+    assert len(profiles[str(tmp_path / "work" / "notebook")]) == 2
+    summary = nbvalx.profiles.summarize([tmp_path], top=1).splitlines()
+    assert len([line for line in summary if line.endswith(str(tmp_path / "work" / "notebook"))]) == 2
+    assert len([line for line in summary if line.endswith(" notebook[tag=a]")]) == 2
+    assert len([line for line in summary if line.endswith(" cell a1b2")]) == 2
+    assert len([line for line in summary if line.endswith(" cell c3d4")]) == 2
+    assert "    top 1 functions by own time:" in summary
+    assert "    top 1 lines by allocated memory:" in summary
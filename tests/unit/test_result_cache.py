@@ -0,0 +1,80 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the cache of the outcomes of notebooks in the nbvalx.pytest_hooks_notebooks module."""
+
+import json
+import pathlib
+import xml.etree.ElementTree as ET
+
+from notebooks_project import NotebooksProject
+
+import nbvalx.pytest_hooks_notebooks
+
+
+def _cache_hits(junitxml_path: pathlib.Path) -> list[str]:
+    """Return the names of the cells which were reported from the cache, according to a JUnit XML report."""
+    return sorted(
+        testcase.attrib["name"] for testcase in ET.parse(junitxml_path).iter("testcase")
+        if any(
+            prop.attrib["name"] == "ipynb_cache" and prop.attrib["value"] == "hit" for prop in testcase.iter("property")
+        )
+    )
+
+
+def test_result_cache(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that the outcomes of notebooks which passed are reported from the cache."""
+    notebooks_project.write_notebook(
+        "passing.ipynb", ["value = 1\nvalue", "# PYTEST_XFAIL: expected failure\nassert False", "# NBVAL_SKIP\n1"])
+    notebooks_project.write_notebook("failing.ipynb", ["assert False", "value = 1"])
+    (notebooks_project.path / "dependency.txt").write_text("first")
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_False"
+    cache_path = work_dir / nbvalx.pytest_hooks_notebooks._RESULT_CACHE
+    options = ["-rA", "--ipynb-cache=on", "--ipynb-cache-dependency=dependency.txt", "--junitxml=report.xml"]
+    junitxml_path = notebooks_project.path / "report.xml"
+    # The first run stores only the notebook which passed
+    first = notebooks_project.run(*options)
+    assert first.returncode == 1
+    assert _cache_hits(junitxml_path) == []
+    with open(cache_path) as f:
+        assert list(json.load(f)) == ["passing.ipynb"]
+    # The second run reports the notebook which passed from the cache, with the same outcomes and outputs
+    second = notebooks_project.run(*options)
+    assert NotebooksProject.outcomes(second) == NotebooksProject.outcomes(first)
+    assert _cache_hits(junitxml_path) == ["Cell 0", "Cell 1", "Cell 2", "Cell 3"]
+    assert (work_dir / "passing.log.ipynb").exists()
+    # A refresh runs every notebook again
+    notebooks_project.run(*options[:-3], "--ipynb-cache=refresh", *options[-2:])
+    assert _cache_hits(junitxml_path) == []
+    notebooks_project.run(*options)
+    assert _cache_hits(junitxml_path) == ["Cell 0", "Cell 1", "Cell 2", "Cell 3"]
+    # A change to a file the notebooks depend on runs every notebook again
+    (notebooks_project.path / "dependency.txt").write_text("second")
+    notebooks_project.run(*options)
+    assert _cache_hits(junitxml_path) == []
+    notebooks_project.run(*options)
+    assert _cache_hits(junitxml_path) == ["Cell 0", "Cell 1", "Cell 2", "Cell 3"]
+    # A notebook which fails after being cached is removed from the cache
+    notebooks_project.write_notebook(
+        "passing.ipynb", ["value = 2\nvalue", "# PYTEST_XFAIL: expected failure\nassert False", "assert False"])
+    notebooks_project.run(*options)
+    assert _cache_hits(junitxml_path) == []
+    with open(cache_path) as f:
+        assert json.load(f) == dict()
+
+
+def test_result_cache_invalid_file(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that a cache file which cannot be read is ignored, and then written again."""
+    notebooks_project.write_notebook("notebook.ipynb", ["value = 1"])
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / "collapse_False"
+    cache_path = work_dir / nbvalx.pytest_hooks_notebooks._RESULT_CACHE
+    junitxml_path = notebooks_project.path / "report.xml"
+    for content in ("not json", "[]"):
+        notebooks_project.run("--ipynb-cache=on", "--junitxml=report.xml")
+        cache_path.write_text(content)
+        assert notebooks_project.run("--ipynb-cache=on", "--junitxml=report.xml").returncode == 0
+        assert _cache_hits(junitxml_path) == []
+        with open(cache_path) as f:
+            assert list(json.load(f)) == ["notebook.ipynb"]
@@ -0,0 +1,63 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for running notebooks concurrently in the nbvalx.pytest_hooks_notebooks module."""
+
+import pytest
+from notebooks_project import NotebooksProject
+
+_collapse_sources = [
+    "%load_ext nbvalx",
+    "%%register_allowed_run_if_tags\nfirst_tag: True, False\nsecond_tag: True, False",
+    "%%register_current_run_if_tags\nfirst_tag = True\nsecond_tag = True",
+    "value = 1",
+    "%%run_if first_tag\nassert value == 1",
+    "%%run_if not first_tag\nassert value == 2"
+]
+
+
+@pytest.mark.parametrize("collapse", [False, True])
+def test_variant_workers(notebooks_project: NotebooksProject, collapse: bool) -> None:
+    """Unit test to check that running notebooks concurrently reports the same outcomes as running them serially."""
+    notebooks_project.write_notebook("first.ipynb", _collapse_sources)
+    notebooks_project.write_notebook("second.ipynb", ["value = 1", "assert value == 1"])
+    options = ["-rA", "--collapse"] if collapse else ["-rA"]
+    serial = notebooks_project.run(*options)
+    concurrent = notebooks_project.run(*options, "--variant-workers=2")
+    assert serial.returncode == concurrent.returncode == 1
+    assert NotebooksProject.outcomes(concurrent) == NotebooksProject.outcomes(serial)
+    # Both variants with first_tag = False fail, even when one is identical to the other after collapsing
+    assert len([outcome for outcome in NotebooksProject.outcomes(serial) if outcome.startswith("FAILED")]) == 2
+
+
+def test_variant_workers_result_cache(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that running notebooks concurrently reports the outcomes stored in the result cache."""
+    notebooks_project.write_notebook("notebook.ipynb", ["value = 1", "assert value == 1"])
+    first = notebooks_project.run("-rA", "--ipynb-cache=on", "--variant-workers=2")
+    second = notebooks_project.run("-rA", "--ipynb-cache=on", "--variant-workers=2")
+    assert first.returncode == second.returncode == 0
+    assert NotebooksProject.outcomes(second) == NotebooksProject.outcomes(first)
+    assert len(NotebooksProject.outcomes(first)) == 3
+
+
+def test_variant_workers_kernel_failure(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that a failure while starting the kernel is reported by every cell of the notebook."""
+    notebooks_project.write_notebook("notebook.ipynb", _collapse_sources)
+    result = notebooks_project.run(
+        "-rA", "--collapse", "--variant-workers=2", "--nbval-kernel-name=nbvalx_missing_kernel")
+    assert result.returncode == 1
+    assert not any(outcome.startswith("PASSED") for outcome in NotebooksProject.outcomes(result))
+    assert "No such kernel" in result.stdout
+
+
+def test_variant_workers_interrupted(notebooks_project: NotebooksProject) -> None:
+    """Unit test to check that notebooks which are still running are stopped when the session is interrupted."""
+    notebooks_project.write_notebook("failing.ipynb", ["assert False"])
+    notebooks_project.write_notebook("slow.ipynb", ["import time", *["time.sleep(0.5)"] * 10])
+    result = notebooks_project.run("-rA", "-x", "--variant-workers=2")
+    assert result.returncode == 1
+    assert NotebooksProject.outcomes(result) == [
+        "FAILED data/.ipynb_pytest/np_1/collapse_False/failing.ipynb::Cell 1",
+        "PASSED data/.ipynb_pytest/np_1/collapse_False/failing.ipynb::Cell 0"]
@@ -0,0 +1,41 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for the selection of combinations of tags and parameters in the nbvalx.pytest_hooks_notebooks module."""
+
+import itertools
+
+import pytest
+
+import nbvalx.pytest_hooks_notebooks
+
+
+@pytest.mark.parametrize("sizes,strength", [
+    ([4, 4, 4, 4, 4], 2), ([2, 3, 4], 2), ([3, 3, 3, 3], 3), ([2, 2], 3), ([5], 2)])
+def test_covering_array(sizes: list[int], strength: int) -> None:
+    """Unit test to check that every combination of strength values appears in at least a row."""
+    rows = nbvalx.pytest_hooks_notebooks._covering_array(sizes, strength)
+    assert rows == sorted(set(rows))
+    assert all(0 <= index < size for row in rows for (index, size) in zip(row, sizes))
+    for columns in itertools.combinations(range(len(sizes)), min(strength, len(sizes))):
+        covered = {tuple(row[column] for column in columns) for row in rows}
+        assert len(covered) == len(list(itertools.product(*(range(sizes[column]) for column in columns))))
+
+
+def test_covering_array_smaller_than_full_product() -> None:
+    """Unit test to check that a pairwise covering array is much smaller than the full product."""
+    rows = nbvalx.pytest_hooks_notebooks._covering_array([4, 4, 4, 4, 4], 2)
+    assert len(rows) <= 20
+
+
+@pytest.mark.parametrize("samples", [1, 5, 1024, 2000])
+def test_random_sample(samples: int) -> None:
+    """Unit test to check that random samples are distinct rows of the full product, and depend only on the seed."""
+    sizes = [4, 4, 4, 4, 4]
+    rows = nbvalx.pytest_hooks_notebooks._random_sample(sizes, samples, 1)
+    assert len(rows) == min(samples, 1024)
+    assert rows == sorted(set(rows))
+    assert all(0 <= index < size for row in rows for (index, size) in zip(row, sizes))
+    assert rows == nbvalx.pytest_hooks_notebooks._random_sample(sizes, samples, 1)
@@ -0,0 +1,70 @@
+# Copyright (C) 2022-2026 by the nbvalx authors
+#
+# This file is part of nbvalx.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Unit test for running notebooks with pytest-xdist in the nbvalx.pytest_hooks_notebooks module."""
+
+import json
+import pathlib
+
+import pytest
+from notebooks_project import NotebooksProject
+
+import nbvalx.pytest_hooks_notebooks
+
+
+def test_result_cache_merge(tmp_path: pathlib.Path) -> None:
+    """Unit test to check that the controller applies the result cache entries changed by the workers."""
+    cache_path = tmp_path / nbvalx.pytest_hooks_notebooks._RESULT_CACHE
+    with open(cache_path, "w") as f:
+        json.dump({"kept.ipynb": {"key": "a"}, "failed.ipynb": {"key": "b"}}, f)
+    result_cache = nbvalx.pytest_hooks_notebooks._ResultCache(1, False, dict())
+    result_cache.merge(json.dumps({str(cache_path): {"failed.ipynb": None, "passed.ipynb": {"key": "c"}}}))
+    result_cache.merge(json.dumps({str(cache_path): {"other.ipynb": {"key": "d"}}}))
+    result_cache.write()
+    with open(cache_path) as f:
+        assert json.load(f) == {"kept.ipynb": {"key": "a"}, "passed.ipynb": {"key": "c"}, "other.ipynb": {"key": "d"}}
+
+
+def test_durations_report_merge() -> None:
+    """Unit test to check that the controller reports the durations of the notebooks run by the workers."""
+    durations = {"kernel_start": 1.0, "cells": {"Cell 0": {"id": "a1b2", "duration": 2.0}}, "teardown": 0.5}
+    durations_report = nbvalx.pytest_hooks_notebooks._DurationsReport(3.0)
+    durations_report.merge(json.dumps({"notebook[tag=a].ipynb": durations}))
+    durations_report.merge(json.dumps({"notebook[tag=b].ipynb": durations}))
+    report = durations_report.report()
+    assert report["generation"] == 3.0
+    assert list(report["notebooks"]) == ["notebook[tag=a].ipynb", "notebook[tag=b].ipynb"]
+    assert report["notebooks"]["notebook[tag=b].ipynb"]["total"] == 3.5
+    assert durations_report.dump() == json.dumps({
+        "notebook[tag=a].ipynb": durations, "notebook[tag=b].ipynb": durations})
+
+
+@pytest.mark.parametrize("collapse", [False, True])
+def test_xdist(notebooks_project: NotebooksProject, collapse: bool) -> None:
+    """Unit test to check that running notebooks on pytest-xdist workers reports the same outcomes as serially."""
+    notebooks_project.write_notebook("tags.ipynb", [
+        "%load_ext nbvalx", "%%register_allowed_run_if_tags\nfirst_tag: True, False\nsecond_tag: True, False",
+        "%%register_current_run_if_tags\nfirst_tag = True\nsecond_tag = True", "value = 1",
+        "%%run_if first_tag\nvalue += 1", "%%run_if not first_tag\nvalue += 2",
+        "%%run_if first_tag\nassert value == 2", "%%run_if not first_tag\nassert value == 3"])
+    # Every cell depends on the previous ones, and hence fails unless run in the same kernel
+    for notebook in range(4):
+        notebooks_project.write_notebook(f"notebook_{notebook}.ipynb", [
+            f"value = {notebook}", *["value += 1"] * 5, f"assert value == {notebook + 5}"])
+    options = ["-rA", "--collapse"] if collapse else ["-rA"]
+    serial = notebooks_project.run(*options)
+    distributed = notebooks_project.run(
+        *options, "-n", "2", "--ipynb-cache=on", "--ipynb-durations-report=durations.json")
+    assert serial.returncode == distributed.returncode == 0
+    # Workers add the group of every cell, i.e. the notebook it belongs to, to its node identifier
+    assert all("@" in outcome for outcome in NotebooksProject.outcomes(distributed))
+    assert [outcome.split("@")[0] for outcome in NotebooksProject.outcomes(distributed)] == (
+        NotebooksProject.outcomes(serial))
+    # The controller stores the outcomes and the durations of the notebooks run by the workers
+    work_dir = notebooks_project.path / "data" / ".ipynb_pytest" / "np_1" / f"collapse_{collapse}"
+    with open(work_dir / nbvalx.pytest_hooks_notebooks._RESULT_CACHE) as f:
+        assert len(json.load(f)) == 8
+    with open(notebooks_project.path / "durations.json") as f:
+        assert len(json.load(f)["notebooks"]) == 8